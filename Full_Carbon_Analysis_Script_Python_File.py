@@ -20,533 +20,276 @@ and have a 30m resolution.
 '''
 
 #Import packages
-#Numpy is used to make arrays
-import numpy as np
-#Pandas can used Numpy arrays to create dataframes
-import pandas as pd
-#PIL is used to open image files to obtain pixel values
-from PIL import Image
 #OS allows the user to set the working folder
 import os
-#Seaborn is a library for nice graphical data visualization displays
-import seaborn as sns
-#MatPlotLib is a library for data visualization
-import matplotlib.pyplot as plt
-get_ipython().run_line_magic('matplotlib', 'inline')
-
-
-#Set working directory
-dir = os.chdir("C:\\Users\\Emily\\Documents\\Summer_2020\\Py_DataScience_and_MachineLearning\\original\\FL_Script\\Python_FL_Project\\Python_FL_Project")
+#Logging reports how long each step took
+import logging
+#The fl_carbon package next to this script reads the rasters, fits the regressions and draws the figures.
+#It is imported before changing the working directory so Python can still find it.
+from fl_carbon import settings
+from fl_carbon.cache import cached_pixel_table
+from fl_carbon.export import export_results
+from fl_carbon.instrument import StageRecorder, start_recording
+from fl_carbon.patches import event_regression, label_patches, patch_table
+from fl_carbon.plots import render_diagnostics, render_figures
+from fl_carbon.regression import age_summary, batch_regression
+from fl_carbon.resample import resample_regression
+from fl_carbon.strata import select_stratum, stratified_analysis, stratified_table
+from fl_carbon.table import memory_per_pixel
+
+
+#Set working directory. The folder with the eight TIFFs is taken from FL_DATA_DIR, or is the current folder when it is not set.
+#For batch jobs, python -m fl_carbon runs the same steps as separate commands (see fl_carbon/cli.py).
+dir = os.chdir(os.environ.get('FL_DATA_DIR', '.'))
+
+#Every step of the analysis is timed, with the rows going in and out and the memory it used. A table of the steps is printed
+#after Part 1 and at the end. Setting FL_LOG_LEVEL=INFO also logs each step as it finishes, and FL_PROFILE=<step> or
+#FL_TRACEMALLOC=<step> profiles the time or the memory allocations of a step (see fl_carbon/instrument.py).
+logging.basicConfig(level=os.environ.get('FL_LOG_LEVEL', 'WARNING'))
+Recorder = start_recording(StageRecorder.from_environment())
 
 
 ### PART 1: DATA FRAME CREATION & CLEAN UP
 
-#This line deactivates the zip bomb safety in Python 3. Because I am working with large files, I want to deactivate the size limit imposed by the zip bomb check.
-Image.MAX_IMAGE_PIXELS = None
-
-#This section opens each TIFF as an array and assigns them to a variable. Because I already preprocessed the spatial data the images are all the same size.
+#This section reads the eight TIFFs and builds the dataframe. Because I already preprocessed the spatial data the images are all the same size.
 #AGB = Aboveground Biomass
 #NEP = Net Ecosystem Productivity
 #Forest Type = Numeric Code for Forest Type
 #Burn Year = # of Years after 1970 when the area was burned
 
-AGB_2010 = np.asarray(Image.open('Smaller_FL_agb_2010.tif'))
-AGB_2000 = np.asarray(Image.open('Smaller_FL_agb_2000.tif'))
-AGB_1990 = np.asarray(Image.open('Smaller_FL_agb_1990.tif'))
-Forest_Type = np.asarray(Image.open('Smaller_FL_forest_group_NAFD.tif'))
-NEP_1990 = np.asarray(Image.open('Smaller_FL_nep_1990.tif'))
-NEP_2000 = np.asarray(Image.open('Smaller_FL_nep_2000.tif'))
-NEP_2010 = np.asarray(Image.open('Smaller_FL_nep_2010.tif'))
-Burn_Year = np.asarray(Image.open('Smaller_FL_years_disturb_MTSB.tif'))
-
-#Check point to make sure it works 
-print('Ok')
-
-
-#This section flattens each array so the 2D data is converted to 1D data. This allows each raster layer to become a column in the dataframe.
-
-FL_AGB_1990 = AGB_1990.flatten()
-FL_AGB_2000 = AGB_2000.flatten()
-FL_AGB_2010 = AGB_2010.flatten()
-FL_Forest_Type = Forest_Type.flatten()
-FL_NEP_1990 = NEP_1990.flatten()
-FL_NEP_2000 = NEP_2000.flatten()
-FL_NEP_2010 = NEP_2010.flatten()
-FL_Burn_Year = Burn_Year.flatten()
-
-#Check point
-print('Ok')
-
-
-#Here I stack all of the flattened arrays and transpose them into vertical columns. This creates a larger 2D array, FL_arr, from the multiple 1D arrays.
-FL_arr = np.vstack([FL_AGB_1990, FL_AGB_2000, FL_AGB_2010, FL_Forest_Type, FL_NEP_1990, FL_NEP_2000, FL_NEP_2010, FL_Burn_Year]).T
-
-
-#A Pandas dataframe was then created from with the vertically stacked 2D array, FL_arr, and assigned column names.
-FL_Data = pd.DataFrame(FL_arr, columns=['AGB_1990', 'AGB_2000','AGB_2010', 'Forest_Type', 'NEP_1990', 'NEP_2000', 'NEP_2010', 'Burn_Year'])
-
-#Check point. This shows the column names and first five entries. 
-FL_Data.head()
-
-
 '''
-Now that the dataframe is created, I want to remove rows that are not necessary for the analysis.
-First, I want to remove pixels which did not experience fire, or had fires which occured before or at 1990 and at 2010.
-I don't have carbon data outsides of 1990-2010, so I can analyze fire outside of that time interval.
-This will leave only pixels which burned between 1991 - 2009.
+Loading all eight rasters at once and stacking them needs several times the size of the scene in memory, which runs
+out on full Southeastern US tiles. Instead, the layers are read together in bands of rows (windows) and each window is
+cleaned before the next one is read. Only pixels which pass the filters below are kept:
+
+1. Pixels which did not experience fire, or had fires at or before 1990 and at 2010, are removed.
+   I don't have carbon data outsides of 1990-2010, so I can analyze fire outside of that time interval.
+   The only years outside of my target time interval are 0 (No fire), 16 (1986), 20 (1990), and 40 (2010).
+   This will leave only pixels which burned between 1991 - 2009.
+
+2. Only pixels which deifnitely had less aboveground following a fire event are kept. 
+   Though this is not necessarily scientifically sound decision, my professor and I realized there may be a lot of 
+   edge pixels which are considered burned but don't follow expected trends when looking at the AGB and NEP layers.
+   A pixel is kept if its AGB dropped between 1990 & 2000 or between 2000 & 2010 (less AGB at the second time point).
+   The test runs on the raw AGB layers, so no difference columns are added to the dataframe.
+
+3. Only Longleaf/Slash Pine pixels are kept, the most common forest type in my study area. Prior to this, I examined
+   the index count for each forest type. Longleaf/Slash Pine forests had the most pixels.
+
+4. I want to categorize the pixels as having a burn severity of High, Medium, and Low, based on the percent of
+   aboveground biomass lost by a pixel following a fire. For pixels burned before 2001, I calculated this using
+   AGB_1990 and AGB_2000. For pixels burned from 2001 - 2009, I calculated it using AGB_2000 and AGB_2010. The result
+   is the 'Burn_Severity' column. The same pair of years gives 'NEP_Change', the change in NEP across the fire.
+   (fl_carbon/epochs.py picks the pair for each pixel, so more AGB and NEP years can be added in settings.py.)
+   I decided to get rid of pixels with a "Low" severity (0-30% lost) because there were much fewer pixels with that label.
+
+   Pixels with no AGB before the fire (nothing to divide by), or whose AGB grew across the fire, have no severity bin
+   and are dropped too. So are fires before 1990, which have no AGB layer before them. (My first version gave them the
+   1990 - 2000 severity, but apart from 1986, which is excluded anyway, the burn year layer has no such fires.)
+
+Before any of this, pixels with a nodata value (or NaN) in any of the eight layers are dropped. The nodata values are read
+from the TIFF tags, or from settings.NODATA for layers without one.
+
+All of these checks are done together on the raw arrays of each window, so pixels which fail them never become rows.
+The index of the dataframe is still the position of each pixel in the flattened raster.
+
+The dataframe is built one column at a time so every column keeps a compact type. The carbon values are float32 and
+the burn year stays a small integer. Two more columns show the date of the fire and it's age at 2010. The numeric
+'Forest_Type' codes are replaced with descriptive str labels because it's more intuitive to read. The 'Severity_Label'
+column places each pixel into a categorical bin (Low, Moderate or Severe) based on it 'Burn_Severity' value. Both are
+worked out as small integer codes with lookup tables (fl_carbon/classify.py) and stored as categoricals, using the code
+list, forest type names, bins and labels in fl_carbon/settings.py.
+
+The cleaned dataframe is saved in the FL_Cache folder. When the rasters and the settings are unchanged, later runs
+load it from there instead of reading the rasters again, so re-running Parts 2 and 3 only takes seconds.
 '''
 
-#First, I identified all unique values for Burn_Year to see whether there are pixels that occured outside of my target time interval.
-FL_Data['Burn_Year'].unique()
-
-#The only years outside of my target time interval are 0 (No fire), 16 (1986), 20 (1990), and 40 (2010).
-FL_Data = FL_Data[(FL_Data.Burn_Year != 0) & (FL_Data.Burn_Year != 16) & (FL_Data.Burn_Year != 20) & (FL_Data.Burn_Year != 40)]
+FL_Data = cached_pixel_table('.', cache_dir='FL_Cache', window_rows=settings.WINDOW_ROWS,
+                             excluded_years=settings.EXCLUDED_BURN_YEARS, forest_code=settings.LONGLEAF_SLASH_PINE,
+                             drop_low=True, cut_bins=settings.CUT_BINS, bs_labels=settings.BS_LABELS)
 
 #Check that pixels with unwanted years were removed
 FL_Data['Burn_Year'].unique()
 
-
-'''
-Now I want to limit the dataframe to pixels that deifnitely had less aboveground following a fire event. 
-Though this is not necessarily scientifically sound decision, my professor and I realized there may be a lot of 
-edge pixels which are considered burned but don't follow expected trends when looking at the AGB and NEP layers.
-'''
-
-#Here, I create two columns to find the difference in AGB between 1990 & 2000 and 2000 & 2010.
-FL_Data['Minus_90_00'] = FL_Data['AGB_1990'] - FL_Data['AGB_2000']
-FL_Data['Minus_00_10'] = FL_Data['AGB_2000'] - FL_Data['AGB_2010']
-
-#I only select pixels here the net change in AGB between 1990 - 2000 or 2000 - 2010 is positive. (This means there's less AGB in the second time point).
-FL_Data = FL_Data[(FL_Data.Minus_90_00 > 0) | (FL_Data.Minus_00_10 > 0)]
-
-#Here, I created two more columns to show the date of the fire and it's age at 2010.
-FL_Data['Date'] = 1970 + FL_Data['Burn_Year'] 
-FL_Data['Burn_Scar_Age'] = 40 - FL_Data['Burn_Year']
-
-#Check
-print (FL_Data)
-
-
-#I want to create categorize the pixel as having a burn severity of High, Medium, and Low. 
-#I decided the assign these labels based on the percent of aboveground biomass lost by a pixel following a fire.
-
-#First, I created a new column calculating the percent aboveground biomass lost. For pixel burned before 2001, I calculated this using AGB_1990 and AGB_2000.
-FL_Data['Burn_Severity'] = ((FL_Data['AGB_1990']-FL_Data['AGB_2000'])/FL_Data['AGB_1990']*100)
-
-#However, for pixels burned from 2001 - 2009, I want to calculate the percent of AGB lost using the AGB 2000 and AGB 2010 columns. In this case, I replaced the values in 'Burn_Severity' for select rows based on their date.
-FL_Data.loc[(FL_Data.Date>2000), 'Burn_Severity'] = ((FL_Data['AGB_2000']-FL_Data['AGB_2010'])/FL_Data['AGB_2000']*100)
-
-#Check point
-print (FL_Data)
+#Check point. This shows the column types and how much memory each pixel needs, which is used to size runs over larger regions.
+print (FL_Data.dtypes)
+print ('Memory per pixel: %.1f bytes' % memory_per_pixel(FL_Data))
 
 
-#After creating a numeric variable to measure burn severity, I want to place pixels into categorical bins.
-#First I create list of categorical bins
-bs_labels = ['Low', 'Moderate', 'Severe']
+#Here, I check for rows with null values. Pixels with a nodata value in any of the eight layers, and pixels without a
+#Burn_Severity (no AGB before the fire to divide by) or with one outside of the bins, are dropped while the rasters are read
+#(see fl_carbon/validity.py), so this should be 0.
+print (FL_Data.isna().sum().sum())
 
-#Then I assign custom bounds for the intervals.
-cut_bins = [0, 30, 70, 100]
 
-#I used the pd.cut function to create a new variable which places each pixel into a categorical bin based on it 'Burn_Severity' value.
-FL_Data['Severity_Label'] = pd.cut(FL_Data['Burn_Severity'], bins=cut_bins, labels=bs_labels)
-
-#Check point
-print (FL_Data)
-
-
-#Additionally, I want to replace the numeric codes signifying 'Forest_Type' with descriptive str labels because it's more intuitive to read.
-#First I create a list of the str forest type names
-forest_type_list = ['White/Red/Jack Pine', 'Spruce/Fir', 'Longleaf/Slash Pine', 'Loblolly/Shortleaf Pine', 'Pinyon/Juniper', 'Oak/Pine', 'Oak/Hickory', 'Oak/Gum/Cypress', 'Elm/Ash/Cottonwood', 'Maple/Beech/Birch', 'Tropical Hardwoods', 'Exotic Hardwoods']
-
-#Then, I create a list of the values associated with each name
-code_list = [100, 120, 140, 160, 180, 400, 500, 600, 700, 800, 980, 990]
-
-#Finally, I create a dictionary which associates each value with a str label.
-forest_dict = dict(zip(code_list, forest_type_list))
-
-# To replace the numeric code Forest Type with the str label, I used the .replace function.
-FL_Data['Forest_Type'].replace(forest_dict, inplace=True)
-
-
-#Here, I drop any rows which have null values. 
-FL_Data.dropna(axis=0, how='any')       
-
-
-'''
-Finally, I wanted to limit my dataframe to the most common forest type in my study area. Prior to this, I examined the 
-index count for each forest type. Longleaf/Slash Pine forests had the most pixels. In addition, I decided to get rid of 
-pixels with a "Low" severity label because there were much fewer pixels with that label.
-'''
-#Here, I isolate the observations NOT considered Longleaf/Slash Pine forest
-indexNames = FL_Data[ (FL_Data['Forest_Type'] != 'Longleaf/Slash Pine')].index
-
-#In addition, I isolated the observaions with a Low Burn Severity
-indexNames2 = FL_Data[(FL_Data['Severity_Label'] == 'Low')].index
-
-#Finally, I dropped rows which did not meet my criteria
-FL_Data.drop(indexNames2, inplace=True)
-FL_Data.drop(indexNames, inplace=True)
-
-
-#Even through "Low Severity" now longer contains any observations, it still appears as a category in graphs. 
+#Even through "Low Severity" does not contain any observations, it still appears as a category in graphs. 
 #Therefore, I had to drop the "unused" category
 FL_Data.Severity_Label = FL_Data.Severity_Label.cat.remove_unused_categories()
 
 #Here I checked the count for each category - "Low Severity" doesn't appear
 FL_Data["Severity_Label"].value_counts()
 
+#Check point. Time, rows and memory of each step so far, and how many pixels each filter dropped and why.
+print (Recorder.summary())
+print (Recorder.drop_summary())
 
-### PART 2: DATA VISUALIZATION WITH SEABORN
-
-#Histogram of Moderate and Sevever Burns
-hist = sns.countplot(x = 'Date', palette='muted', data= FL_Data, hue = 'Severity_Label')
-#Set axis and title labels
-hist.set_xlabel('Burn Severity')
-#I rotated the x-axis labels because they were overlapping each other
-plt.xticks(rotation=45)
-hist.set_ylabel('Frequency')
-hist.set_title('Pixel Frequencies for Burn Severity Categories')
-plt.tight_layout()
-
-#Here, I customize the legend
-#First, I set the legend to a variable
-leg = hist.get_legend()
-#Then, I set a new axis title
-new_title = 'Severiy Label'
-#Finally, I reset the legend labels to get rid of the column title
-leg.set_title(new_title)
-new_labels = ['Moderate', 'Severe']
-#This sets the new legend
-for t, l in zip(leg.texts, new_labels): t.set_text(l)
-
-#Output this image are a PNG file
-plt.savefig("Histogram_Severity.png")
-
-
-#Create a scatterplot of Aboveground Biomass and Net Ecosystem Productivity to examine multicollinearity
-#Create a list of hue rankings
-hue_ranking = ['Moderate', 'Severe']
-
-#Here, I create a the scatterplot which plots both Moderate and Severe data points
-fig = sns.scatterplot(x="AGB_2010", y="NEP_2010",
-                hue="Severity_Label",
-                palette="muted",
-                hue_order=hue_ranking,
-                linewidth=.1,
-                data=FL_Data)
-
-#Set title and axes labels. 
-plt.title("Multicollinearity of AGB 2010 and NEP 2010")
-plt.xlabel("Aboveground Biomass at 2010 (Kg-C per M-2)")
-plt.ylabel("Net Ecosystem Productivity at 2010 (g-C per M-2)")
-
-#Here, I customize the legend
-#First, I set the legend to a variable
-leg = fig.get_legend()
-#Then, I set a new axis title
-new_title = 'Severiy Label'
-#Finally, I reset the legend labels to get rid of the column title
-leg.set_title(new_title)
-new_labels = ['','Moderate', 'Severe']
-#This sets the new legend
-for t, l in zip(leg.texts, new_labels): t.set_text(l)
-
-#Here, I ensure none of labels overlap
-plt.tight_layout()
-
-#Output this image are a PNG file
-plt.savefig("Scatterplot_AGB_NEP.png")
-
-
-#Create a FacetGrid plot to compare how Aboveground Biomass recovers as a Burn Scar ages
-lm = sns.lmplot(x="Burn_Scar_Age", y="AGB_2010", col="Severity_Label", hue="Severity_Label", data=FL_Data,
-           col_wrap=2, ci=None, palette="muted", height=4,
-           scatter=True, fit_reg=False)
-
-#This section allows me to customs the subplots
-fig = lm.fig
-
-#Assign each subplot axes to a variables
-a1 = fig.axes[1]
-a0 = fig.axes[0]
-
-#Set the range and labeling of the x-axis
-a0.set_xlim(0,20)
-a0.set_xticks(range(0,20))
-
-#Set title and axis labels
-a0.set_title("AGB After Moderate Burns")
-a0.set(xlabel= "Burn Scar Age (Years)", ylabel="Aboveground Biomass at 2010 (Kg-C per M-2)")
-a1.set_title("AGB After Severe Burns")
-a1.set(xlabel= "Burn Scar Age (Years)")
 
-#Stop overlapping of subplots
-fig.tight_layout()
-
-#Output this image are a PNG file
-plt.savefig("FacetGrid_AGB_Raw.png")
-
-
-#Here, I create another FacetPlot both instead its for the mean values of Aboveground Biomass. 
-#This allows us to more clearly see how the correlation between the two datasets differs - since there are many observations
-
-lm = sns.lmplot(x="Burn_Scar_Age", y="AGB_2010", col="Severity_Label", hue="Severity_Label", data=FL_Data, x_estimator=np.mean, 
-           col_wrap=2, ci=None, palette="muted", height=4,
-           scatter=True, fit_reg=False)
-
-#Assign each subplot axes to a variables
-fig = lm.fig
-a1 = fig.axes[1]
-a0 = fig.axes[0]
-
-#Set the range and labeling of the x-axis
-a0.set_xlim(0,20)
-a0.set_xticks(range(0,20))
-
-a0.set_title("Mean AGB after Moderate Burns")
-a0.set(xlabel= "Burn Scar Age (Years)", ylabel="Aboveground Biomass at 2010 (Kg-C per M-2)")
-
-a1.set_title("Mean AGB after Severe Burns")
-a1.set(xlabel= "Burn Scar Age (Years)")
-
-#Stop overlapping of subplots
-fig.tight_layout()
-
-#Output this image are a PNG file
-plt.savefig("FacetGrid_AGB_Mean.png")
-
-
-#Create a FacetGrid plot to compare how Net Ecosystem Productivity recovers as a Burn Scar ages
-lm2 = sns.lmplot(x="Burn_Scar_Age", y="NEP_2010", col="Severity_Label", hue="Severity_Label", data=FL_Data,
-           col_wrap=2, ci=None, palette="muted", height=4,
-           scatter=True, fit_reg=False)
-
-#Again, I assign the subplots, set the axes and titles.
-fig2 = lm2.fig
-a2 = fig2.axes[0]
-a3 = fig2.axes[1]
-
-a2.set_xlim(0,20)
-a2.set_xticks(range(0,20))
-
-a2.set_title("NEP after Moderate Burns")
-a2.set(xlabel= "Burn Scar Age (Years)", ylabel="Net Ecosystem Productivity at 2010 (g-C per M-2)")
-
-a3.set_title("NEP after Severe Burns")
-a3.set(xlabel= "Burn Scar Age (Years)")
-
-#Make a tight layout
-fig.tight_layout()
-
-#Export the plot
-plt.savefig("FacetGrid_NEP_Raw.png")
-
-
-#Finally, make a plot for mean NEP so we can see the trends more clearly
-lm2 = sns.lmplot(x="Burn_Scar_Age", y="NEP_2010", col="Severity_Label", hue="Severity_Label", data=FL_Data, x_estimator= np.mean, 
-           col_wrap=2, ci=None, palette="muted", height=4,
-           scatter=True, fit_reg=False)
+### PART 2: DATA VISUALIZATION WITH SEABORN
 
-#Customize each plot, like above
-fig2 = lm2.fig
-a2 = fig2.axes[0]
-a3 = fig2.axes[1]
+'''
+The figures are drawn by fl_carbon/plots.py. Each figure only depends on the dataframe, so they are drawn at the same
+time in separate worker processes, saved as PNG files and closed. None of them need an interactive backend.
+
+1. Histogram_Severity.png - Histogram of Moderate and Severe burns for each fire date.
+2. Scatterplot_AGB_NEP.png - Scatterplot of Aboveground Biomass and Net Ecosystem Productivity to examine multicollinearity.
+3. FacetGrid_AGB_Raw.png - FacetGrid plot to compare how Aboveground Biomass recovers as a Burn Scar ages.
+4. FacetGrid_AGB_Mean.png - The same FacetGrid for the mean values of Aboveground Biomass. This allows us to more clearly
+   see how the correlation between the two datasets differs - since there are many observations.
+5. FacetGrid_NEP_Raw.png - FacetGrid plot to compare how Net Ecosystem Productivity recovers as a Burn Scar ages.
+6. FacetGrid_NEP_Mean.png - A plot for mean NEP so we can see the trends more clearly.
+
+On large scenes, scatterplots with more than 50,000 points are drawn as density plots (hexbins or 2D histograms).
+'''
 
-a2.set_xlim(0,20)
-a2.set_xticks(range(0,20))
+#Instead of averaging every pixel inside the plots, the pixels are collapsed once into a small table with the count, mean and
+#variance of AGB and NEP for each severity label and burn scar age. Both mean plots use this table.
+Age_Summary = age_summary(FL_Data, by=['Severity_Label'], x='Burn_Scar_Age', responses=['AGB_2010', 'NEP_2010'])
+print (Age_Summary)
 
-a2.set_title("Mean NEP after Moderate Burns")
-a2.set(xlabel= "Burn Scar Age (Years)", ylabel="Net Ecosystem Productivity at 2010 (g-C per M-2)")
+#Draw and save every figure
+Figure_Files = render_figures(FL_Data, Age_Summary, out_dir='.')
+print (Figure_Files)
 
-a3.set_title("Mean Recovery after Severe Burns")
-a3.set(xlabel= "Burn Scar Age (Years)")
 
-#Create tight layout
-fig.tight_layout()
+'''
+All of the regressions are fit together. batch_regression collects the sums of Burn_Scar_Age (and its powers) and of the
+response values for each severity group in one pass over the dataframe. The linear and polynomial (quadratic) models are
+then solved directly from those sums. Like the train/test split I used before, 40% of the pixels are held out to test
+each model, and the RMSE and R-squared are calculated on them. The held out pixels are drawn with a fixed seed, so the
+results are the same on every run.
+'''
 
-#Save figure
-plt.savefig("FacetGrid_NEP_Mean.png")
+Reg_Results = batch_regression(FL_Data, by=['Severity_Label'], responses=['AGB_2010', 'NEP_2010'], x='Burn_Scar_Age',
+                               test_size=0.4, random_state=0)
+Reg_Results = Reg_Results.set_index(['Severity_Label', 'response', 'model'])
 
+#Check point. This shows every fitted model.
+print (Reg_Results)
 
-#Create separate dataframes for Moderate and Severe burns in order to run two separate Regression Analysis
-#Create dataframe for moderate burns
-Mod_FL = FL_Data[(FL_Data['Severity_Label'] == 'Moderate')]
-#Create dataframe for severe burns
-Sev_FL = FL_Data[(FL_Data['Severity_Label'] == 'Severe')]
-print ("Ok")
+#For every model, save a scatterplot of predictions and expected values and a histogram of the residuals
+Diagnostic_Files = render_diagnostics(FL_Data, Reg_Results.reset_index(), out_dir='.')
 
 
-#I created a function to run a Linear Regression. This allows me to call the same function multiple times.
+#I created a function to report a Linear Regression. This allows me to call the same function multiple times.
 
-def LinReg(x,y):
-    #Split test data
-    from  sklearn.model_selection import train_test_split
-    x_train, x_test, y_train, y_test = train_test_split(x,y,test_size=0.4)
-    
-    #Reshape Series into 2D Arrays
-    x_train = np.array(x_train).reshape(len(x_train),1)
-    y_train = np.array(y_train).reshape(len(y_train),1)
-    x_test = np.array(x_test).reshape(len(x_test),1)
-    y_test = np.array(y_test).reshape(len(y_test),1)
-    
-    #Initialize Linear Regression Model
-    from sklearn.linear_model import LinearRegression
-    #Train model using training data
-    reg = LinearRegression().fit(x_train, y_train)
-    predictions = reg.predict(x_train)
-    
-    #Un-Nest Values
-    intercept = reg.intercept_[0]
-    intercept = str(round(intercept, 1))
-    x_coef = reg.coef_[0][0]
-    x_coef = str(round(x_coef, 1))
+def LinReg(severity, response):
+    #Look up the fitted model
+    row = Reg_Results.loc[(severity, response, 'linear')]
     
     #Print intercept and regression coefficients
-    print ("The intercept is: %s" % intercept)
-    print ("The x-coefficient is: %s " % x_coef)
-    
-    #Prediction testing data
-    predictions = reg.predict(x_test)
+    print ("The intercept is: %s" % round(row['intercept'], 1))
+    print ("The x-coefficient is: %s " % round(row['coef_x1'], 1))
     
     #Print RMSE and R-squared Error
-    from sklearn.metrics import mean_squared_error, r2_score
-    
-    rmse = np.sqrt(mean_squared_error(y_test, predictions))
-    rmse = str(round(rmse, 2))
-    r2 = r2_score(y_test, predictions)
-    r2 = str(round(r2, 2))
-
-    print("The RMSE is %s and the R-Squared is: %s " % (rmse,r2))
-    
-    #Create a scatterplot of predictions and expected values
-    fig1 = plt.figure()
-    fig1 = plt.scatter(y_test, predictions)
-    plt.title("Scatterplot of True and Predicted Y-Values")
-    plt.xlabel("True Y-Values")
-    plt.ylabel("Predicted Y-Values")
-    
-    #Create a histogram of residuals by subtracting the observed values from expected. 
-    #In this case, not normally distributed so linear regression in probably not the best choice.
-    fig2 = plt.figure()
-    fig2 = sns.distplot((y_test-predictions), kde=False)
-    plt.title("Residuals of True and Predicted Y-Values")
-    plt.xlabel("Residual Value")
-    plt.ylabel("Frequency")
+    print("The RMSE is %s and the R-Squared is: %s " % (round(row['rmse'], 2), round(row['r2'], 2)))
 
 
 #Run Regression for Burn Scar Age and Moderate Fire Abovegorund Biomass
-LinReg(Mod_FL['Burn_Scar_Age'], Mod_FL['AGB_2010'])
+LinReg('Moderate', 'AGB_2010')
 
 #Run Regression for Burn Scar Age and Severe Fire Aboveground Biomass
-LinReg(Sev_FL['Burn_Scar_Age'], Sev_FL['AGB_2010'])
+LinReg('Severe', 'AGB_2010')
 
 #Run Regression for Burn Scar Age and Moderate Fire Net Ecosystem Productivity
-LinReg(Mod_FL['Burn_Scar_Age'], Mod_FL['NEP_2010'])
+LinReg('Moderate', 'NEP_2010')
 
 #Run Regression for Burn Scar Age and Severe Fire Net Ecosystem Productivity
-LinReg(Sev_FL['Burn_Scar_Age'], Sev_FL['NEP_2010'])
+LinReg('Severe', 'NEP_2010')
 
-#I created a function to run a Polynomial (Quadratic) Regression.
-
-def QuadReg(x,y):
-    from  sklearn.model_selection import train_test_split
-    x_train, x_test, y_train, y_test = train_test_split(x,y,test_size=0.4)
-      
-    from sklearn.preprocessing import PolynomialFeatures
-    
-    #Transform data to include another axis
-    x_train = x_train[:, np.newaxis]
-    y_train = y_train[:, np.newaxis]
-    x_test = x_test[:, np.newaxis]
-    y_test = y_test[:, np.newaxis]
-    
-    x_train = np.array(x_train).reshape(len(x_train),1)
-    y_train = np.array(y_train).reshape(len(y_train),1)
-    x_test = np.array(x_test).reshape(len(x_test),1)
-    y_test = np.array(y_test).reshape(len(y_test),1)
-    
+#I created a function to report a Polynomial (Quadratic) Regression.
 
-    #Set the Polynomial power. It's quadratic here
-    polynomial_features= PolynomialFeatures(degree=2)
-    x_poly = polynomial_features.fit_transform(x_train)
-    x_test_poly = polynomial_features.fit_transform(x_test)
-    
-    from sklearn.linear_model import LinearRegression
-    
-    #Run Regression with transformed independent variables
-    model = LinearRegression().fit(x_poly, y_train)
-    y_poly_pred = model.predict(x_test_poly)
-    
-    #Un-Nest Values
-    intercept = model.intercept_[0]
-    intercept = str(round(intercept, 1))
-    x_coef1 = model.coef_[0][0]
-    x_coef1 = str(round(x_coef1, 2))
-    x_coef2 = model.coef_[0][1]
-    x_coef2 = str(round(x_coef2, 2))
-    x_coef3 = model.coef_[0][2]
-    x_coef3 = str(round(x_coef3, 2))
+def QuadReg(severity, response):
+    #Look up the fitted model
+    row = Reg_Results.loc[(severity, response, 'quadratic')]
     
     #Print intercept and regression coefficients
-    print ("The intercept is: %s" % intercept)
-    print ("The X coefficent is %s and the X^2 coefficent is %s" %(x_coef2, x_coef3))
+    print ("The intercept is: %s" % round(row['intercept'], 1))
+    print ("The X coefficent is %s and the X^2 coefficent is %s" %(round(row['coef_x1'], 2), round(row['coef_x2'], 2)))
     
-    from sklearn.metrics import mean_squared_error, r2_score
-    rmse = np.sqrt(mean_squared_error(y_test, y_poly_pred))
-    rmse = str(round(rmse, 2))
-    r2 = r2_score(y_test, y_poly_pred)
-    r2 = str(round(r2, 2))
-    print("The RMSE is %s and the R-Squared is: %s " % (rmse,r2))
-    
-    #Create a scatterplot of predictions and expected values
-    fig3 = plt.figure()
-    fig3 = plt.scatter(y_test, y_poly_pred)
-    plt.title("Scatterplot of True and Predicted Y-Values")
-    plt.xlabel("True Y-Values")
-    plt.ylabel("Predicted Y-Values")
-    
-    #Create a histogram of residuals by subtracting the observed values from expected. 
-    #In this case, not normally distributed so linear regression in probably not the best choice.
-    fig4 = plt.figure()
-    fig4 = sns.distplot((y_test-y_poly_pred), kde=False)
-    plt.title("Residuals of True and Predicted Y-Values")
-    plt.xlabel("Residual Value")
-    plt.ylabel("Frequency")
+    print("The RMSE is %s and the R-Squared is: %s " % (round(row['rmse'], 2), round(row['r2'], 2)))
 
 #Run Regression for Burn Scar Age and Moderate Fire AGB
-QuadReg(Mod_FL['Burn_Scar_Age'], Mod_FL['AGB_2010'])
+QuadReg('Moderate', 'AGB_2010')
 
 #Run Regression for Burn Scar Age and Severe Fire AGB
-QuadReg(Sev_FL['Burn_Scar_Age'], Sev_FL['AGB_2010'])
+QuadReg('Severe', 'AGB_2010')
 
 #Run Regression for Burn Scar Age and Moderate Fire NEP
-QuadReg(Mod_FL['Burn_Scar_Age'], Mod_FL['NEP_2010'])
+QuadReg('Moderate', 'NEP_2010')
 
 #Run Regression for Burn Scar Age and Severe Fire NEP
-QuadReg(Sev_FL['Burn_Scar_Age'], Sev_FL['NEP_2010'])
+QuadReg('Severe', 'NEP_2010')
 
 #Run Fstat to see if the NEP Data is sifnficantly different from intercept model
-
-#Import F-regression
-from sklearn.feature_selection import f_regression
+#The F-score and p-value of the linear model were calculated with the regressions, using every pixel in the group.
 
 #Create function for F-test
-def F_stat(x,y):
-    #Reshape arrays
-    x_shape = np.array(x).reshape(len(x),1)
-    y_shape = np.array(y).reshape(len(y),1)
-    
-    #Get F-scroes and P-values
-    raw_scores, p_values = f_regression(x_shape, y_shape)
-    F = raw_scores[0]
-    F = str(round(F, 2))
-    p = p_values[0]
-    p = str(round(p, 2))
-    print ("The F-score is: %s" %F)
-    print ("The p-value is: %s" %p)
+def F_stat(severity, response):
+    row = Reg_Results.loc[(severity, response, 'linear')]
+    print ("The F-score is: %s" % round(row['F'], 2))
+    print ("The p-value is: %s" % round(row['p'], 2))
     
 #Run F-Test for Burn Scar Age and Moderate Fire NEP
-F_stat(Mod_FL['Burn_Scar_Age'], Mod_FL['NEP_2010'])
+F_stat('Moderate', 'NEP_2010')
 
 #Run F-Test for Burn Scar Age and Severe Fire NEP
-F_stat(Sev_FL['Burn_Scar_Age'], Sev_FL['NEP_2010'])
+F_stat('Severe', 'NEP_2010')
+
+
+#One split only gives one RMSE and R-squared. To see how much the coefficients and scores vary, every model is refit on
+#1000 bootstrap samples of the pixels of each severity group and scored on the pixels left out of each sample. The table
+#has the estimate from all pixels, and the mean, standard deviation and 95% interval over the samples for every statistic.
+Boot_Summary, Boot_Replicates = resample_regression(FL_Data, by=['Severity_Label'], responses=['AGB_2010', 'NEP_2010'],
+                                                    x='Burn_Scar_Age', method='bootstrap', replicates=1000,
+                                                    random_state=0, confidence=0.95)
+print (Boot_Summary)
+
+
+#The pixels of one fire are not independent samples, so the same models are also fit with one row per fire event.
+#Touching pixels which burned in the same year are grouped into patches, and pixels on the edge of their patch are dropped
+#(erode=1) instead of relying only on the AGB loss filter. Each event is the mean of its pixels (see fl_carbon/patches.py).
+FL_Events, Patches = label_patches('.', FL_Data, window_rows=settings.WINDOW_ROWS, erode=1)
+Events = patch_table(FL_Events, Patches)
+Event_Results = event_regression(Events, by=['Severity_Label'], responses=['AGB_2010', 'NEP_2010'], x='Burn_Scar_Age',
+                                 min_pixels=10)
+
+#Check point. Number of fire events and the models fit to them.
+print ('%d burn patches, %d with pixels in the dataframe' % (len(Patches), len(Events)))
+print (Event_Results)
+
+
+
+#Every other forest type and the Low severity pixels were dropped in Part 1. To compare them, the table is cleaned once more
+#keeping every forest type and severity class, and the counts, per-age means and models of every forest type x severity
+#stratum come from one pass over it (see fl_carbon/strata.py). The Longleaf/Slash Pine results above are one selection of it.
+All_Data = stratified_table('.', cache_dir='FL_Cache', window_rows=settings.WINDOW_ROWS,
+                            excluded_years=settings.EXCLUDED_BURN_YEARS, cut_bins=settings.CUT_BINS,
+                            bs_labels=settings.BS_LABELS)
+Strata_Counts, Strata_Summary, Strata_Results = stratified_analysis(All_Data)
+print (Strata_Counts)
+print (select_stratum(Strata_Results, forest_type=['Oak/Pine', 'Loblolly/Shortleaf Pine']))
+
+
+
+#The functions above only print rounded values. Every table is also saved at full precision in the FL_Results folder, with
+#GeoTIFFs of the severity class, forest class, burn scar age and model residuals of every pixel on the grid of the input
+#rasters, so they can be opened in TerrSet or QGIS without running this script again (see fl_carbon/export.py).
+Results = export_results('.', FL_Data, {'Age_Summary': Age_Summary, 'Regressions': Reg_Results.reset_index(),
+                                        'Boot_Summary': Boot_Summary, 'Event_Results': Event_Results,
+                                        'Strata_Counts': Strata_Counts, 'Strata_Results': Strata_Results},
+                         out_dir='FL_Results', fmt='csv')
+print (Results.model('NEP_2010', 'linear', Severity_Label='Severe'))
+
+
+#Time, rows and memory of every step, and any profiles asked for with FL_PROFILE or FL_TRACEMALLOC
+Recorder.report()
@@ -0,0 +1,22 @@
+'''
+Helpers for the carbon recovery analysis of the Apalachicola National Forest fire study.
+
+Full_Carbon_Analysis_Script_Python_File.py walks through the analysis step by step. The functions in this package
+do the heavy lifting so the same steps can run on scenes much larger than the clipped Apalachicola subset.
+
+The names below are imported on first use, so importing the package (or running python -m fl_carbon) does not load
+pandas until it is needed.
+'''
+
+_EXPORTS = {'open_layers': 'raster', 'read_pixel_table': 'raster', 'stream_pixels': 'raster'}
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+    from importlib import import_module
+    return getattr(import_module('.' + _EXPORTS[name], __name__), name)
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS))
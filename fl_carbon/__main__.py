@@ -0,0 +1,5 @@
+'''Run the command line of cli.py with python -m fl_carbon.'''
+
+from .cli import main
+
+main()
@@ -0,0 +1,291 @@
+'''
+Benchmarks for the pixel table pipeline.
+
+Run from the repository folder with:
+
+    python -m fl_carbon.bench filters --pixels 5000000
+    python -m fl_carbon.bench pipeline --megapixels 100 --out bench.json
+    python -m fl_carbon.bench pipeline --megapixels 100 --out new.json --compare bench.json
+    python -m fl_carbon.bench pipeline --megapixels 100 --compression zlib --backend tifffile
+
+The layers are synthetic, so the numbers can be reproduced without the Apalachicola TIFFs. The filters benchmark
+compares the original chained masks with the fused selection. The pipeline benchmark writes a synthetic scene of
+TIFFs (see synthetic.py) and records every stage of the analysis on it with instrument.py, including the peak
+resident memory of each stage. Its JSON results can be compared with a saved run, so a drop in throughput shows up before a real run.
+'''
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from . import settings
+from .filters import burn_year_lut, forest_lut
+from .instrument import StageRecorder, recording, stage
+from .plots import render_diagnostics, render_figures
+from .raster import filter_window, read_pixel_table
+from .readers import BACKENDS, available_backends
+from .regression import age_summary, batch_regression
+from .synthetic import ensure_scene, scene_shape
+
+#A stage counts as slower when it takes this many times its baseline time, and at least MIN_SECONDS
+TOLERANCE = 1.25
+MIN_SECONDS = 0.05
+
+
+def synthetic_layers(n_pixels, seed=0):
+    '''Flat arrays that look like the eight layers: float32 carbon values, uint16 forest codes and uint8 burn years.'''
+    rng = np.random.default_rng(seed)
+    agb_1990 = rng.gamma(4.0, 2.0, n_pixels).astype(np.float32)
+    agb_2000 = (agb_1990 * rng.uniform(0.0, 1.3, n_pixels)).astype(np.float32)
+    agb_2010 = (agb_2000 * rng.uniform(0.0, 1.5, n_pixels)).astype(np.float32)
+    codes = np.array(settings.CODE_LIST, dtype=np.uint16)
+    #Longleaf/Slash Pine is the most common forest type in the study area
+    weights = np.where(codes == settings.LONGLEAF_SLASH_PINE, 5.0, 1.0)
+    #Most pixels never burned. Every year code is drawn, including fires before the first epoch (see compare_filters)
+    years = np.arange(0, 41, dtype=np.uint8)
+    year_weights = np.where(years == 0, 60.0, np.where(years > 20, 1.0, 0.1))
+    return {
+        'AGB_1990': agb_1990,
+        'AGB_2000': agb_2000,
+        'AGB_2010': agb_2010,
+        'Forest_Type': rng.choice(codes, n_pixels, p=weights / weights.sum()),
+        'NEP_1990': rng.normal(100, 60, n_pixels).astype(np.float32),
+        'NEP_2000': rng.normal(100, 60, n_pixels).astype(np.float32),
+        'NEP_2010': rng.normal(100, 60, n_pixels).astype(np.float32),
+        'Burn_Year': rng.choice(years, n_pixels, p=year_weights / year_weights.sum()),
+    }
+
+
+def legacy_filter(layers):
+    '''The chained dataframe masks of the original script, for comparison.'''
+    FL_arr = np.vstack([layers[name] for name in settings.COLUMNS]).T
+    FL_Data = pd.DataFrame(FL_arr, columns=settings.COLUMNS)
+    FL_Data = FL_Data[(FL_Data.Burn_Year != 0) & (FL_Data.Burn_Year != 16) & (FL_Data.Burn_Year != 20) & (FL_Data.Burn_Year != 40)]
+    FL_Data = FL_Data.copy()
+    FL_Data['Minus_90_00'] = FL_Data['AGB_1990'] - FL_Data['AGB_2000']
+    FL_Data['Minus_00_10'] = FL_Data['AGB_2000'] - FL_Data['AGB_2010']
+    FL_Data = FL_Data[(FL_Data.Minus_90_00 > 0) | (FL_Data.Minus_00_10 > 0)].copy()
+    FL_Data['Date'] = 1970 + FL_Data['Burn_Year']
+    FL_Data['Burn_Severity'] = ((FL_Data['AGB_1990']-FL_Data['AGB_2000'])/FL_Data['AGB_1990']*100)
+    FL_Data.loc[(FL_Data.Date>2000), 'Burn_Severity'] = ((FL_Data['AGB_2000']-FL_Data['AGB_2010'])/FL_Data['AGB_2000']*100)
+    FL_Data['Severity_Label'] = pd.cut(FL_Data['Burn_Severity'], bins=settings.CUT_BINS, labels=settings.BS_LABELS)
+    FL_Data['Forest_Type'] = FL_Data['Forest_Type'].replace(dict(zip(settings.CODE_LIST, settings.FOREST_TYPE_LIST)))
+    indexNames = FL_Data[(FL_Data['Forest_Type'] != 'Longleaf/Slash Pine')].index
+    indexNames2 = FL_Data[(FL_Data['Severity_Label'] == 'Low')].index
+    #The script's dropna() of the empty labels, whose result the original never kept (see validity.py)
+    indexNames3 = FL_Data[FL_Data['Severity_Label'].isna()].index
+    FL_Data.drop(indexNames.union(indexNames2).union(indexNames3), inplace=True)
+    return FL_Data
+
+
+def fused_filter(layers):
+    '''The single selection stage used by the raster reader.'''
+    return filter_window(0, layers, burn_year_lut(), forest_lut())
+
+
+def best_time(func, *args, repeat=3):
+    '''Best wall time of several runs, in seconds, and the result of the last run.'''
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+def compare_filters(n_pixels, repeat=3, seed=0):
+    '''
+    Time the original chained masks against the fused selection on the same synthetic layers.
+
+    The fused selection keeps the pixels of the original masks, apart from fires before the first epoch: they have no
+    pre-fire AGB, so their severity is NaN and they are dropped, where the original masks gave them the 1990 - 2000
+    severity (see settings.EPOCH_YEARS). Any other difference raises an AssertionError.
+    '''
+    layers = synthetic_layers(n_pixels, seed)
+    legacy_time, legacy = best_time(legacy_filter, layers, repeat=repeat)
+    fused_time, fused = best_time(fused_filter, layers, repeat=repeat)
+    first_epoch = np.uint8(settings.EPOCH_YEARS[0] - settings.BURN_YEAR_ORIGIN)
+    pre_epoch = legacy.index[legacy['Burn_Year'].to_numpy() < first_epoch]
+    if not legacy.index.difference(pre_epoch).equals(fused.index):
+        raise AssertionError('The fused filter kept different pixels than the original masks')
+    return {'pixels': n_pixels, 'rows_kept': len(fused), 'pre_epoch_dropped': len(pre_epoch), 'legacy_s': legacy_time,
+            'fused_s': fused_time, 'speedup': legacy_time / fused_time}
+
+
+def run_pipeline(directory, out_dir, window_rows=settings.WINDOW_ROWS, plot_workers=1, backend=settings.RASTER_BACKEND):
+    '''
+    Run the analysis on a scene, the same way as the analysis script. Returns the number of pixels kept.
+
+    The stages are timed by the active recorder. Whole-step stages (regression and plotting) are added around the
+    finer ones. Plotting runs in this process by default, so its memory is counted.
+    '''
+    FL_Data = read_pixel_table(directory, window_rows, backend=backend)
+    FL_Data = FL_Data.dropna(subset=['Severity_Label'])
+    FL_Data['Severity_Label'] = FL_Data['Severity_Label'].cat.remove_unused_categories()
+
+    with stage('regression', rows_in=len(FL_Data)):
+        summary = age_summary(FL_Data)
+        results = batch_regression(FL_Data, test_size=0.4, random_state=0)
+    with stage('plotting', rows_in=len(FL_Data)):
+        render_figures(FL_Data, summary, out_dir=out_dir, workers=plot_workers)
+        render_diagnostics(FL_Data, results, out_dir=out_dir, workers=plot_workers)
+    return len(FL_Data)
+
+
+def _commit():
+    '''Commit of the working tree, with a + when it has uncommitted changes, or None outside a git checkout.'''
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        head = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root, capture_output=True, text=True, check=True)
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return head.stdout.strip() + ('+' if status.stdout.strip() else '')
+
+
+def _versions():
+    import matplotlib
+    import PIL
+    import scipy
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'pillow': PIL.__version__, 'scipy': scipy.__version__, 'matplotlib': matplotlib.__version__}
+
+
+def benchmark_pipeline(megapixels, seed=0, window_rows=settings.WINDOW_ROWS, scene_dir=None, plot_workers=1,
+                       backend=settings.RASTER_BACKEND, compression=None):
+    '''
+    Write (or reuse) a synthetic scene and time the pipeline on it. Returns the results as a JSON-ready dict.
+
+    Without a scene_dir the scene is written to a temporary folder and removed afterwards. A scene_dir that already
+    holds a scene of the same size, seed and compression is reused, which saves the write on large sizes. backend
+    is the raster reader of readers.py, compression that of the scene's TIFFs ('zlib', 'lzw', ... or None).
+    '''
+    rows, cols = scene_shape(megapixels)
+    keep_scene = scene_dir is not None
+    scene_dir = scene_dir or tempfile.mkdtemp(prefix='fl_bench_')
+    out_dir = tempfile.mkdtemp(prefix='fl_bench_figures_')
+    try:
+        t0 = time.perf_counter()
+        ensure_scene(scene_dir, rows, cols, seed, compression)
+        write_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        with recording(StageRecorder()) as recorder:
+            rows_kept = run_pipeline(scene_dir, out_dir, window_rows, plot_workers, backend)
+        total_s = time.perf_counter() - t0
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+        if not keep_scene:
+            shutil.rmtree(scene_dir, ignore_errors=True)
+
+    return {
+        'commit': _commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'versions': _versions(),
+        'scene': {'rows': rows, 'cols': cols, 'pixels': rows * cols, 'seed': seed, 'compression': compression},
+        'backend': backend if backend != 'auto' else available_backends()[0],
+        'window_rows': window_rows,
+        'plot_workers': plot_workers,
+        'rows_kept': rows_kept,
+        'scene_write_s': write_s,
+        'total_s': total_s,
+        'megapixels_per_s': rows * cols / 1e6 / total_s,
+        'peak_rss_reset': recorder.peak_rss_reset,
+        'stages': _stage_stats(recorder.summary()),
+    }
+
+
+def _stage_stats(summary):
+    #JSON has no NaN, stages without row counts get None
+    summary = summary.astype(object).where(summary.notna(), None)
+    return {name: {key: (int(value) if key == 'calls' else value) for key, value in row.items()}
+            for name, row in summary.iterrows()}
+
+
+def compare_results(result, baseline, tolerance=TOLERANCE, min_seconds=MIN_SECONDS):
+    '''
+    Compare the stage times of two pipeline benchmarks. Returns a table of the stages and the names of the stages
+    that got slower than the tolerance allows.
+    '''
+    rows, slower = [], []
+    for name, stats in result['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None:
+            continue
+        ratio = stats['wall_s'] / base['wall_s'] if base['wall_s'] > 0 else float('nan')
+        if ratio > tolerance and stats['wall_s'] - base['wall_s'] >= min_seconds:
+            slower.append(name)
+        rows.append({'stage': name, 'baseline_s': base['wall_s'], 'wall_s': stats['wall_s'], 'ratio': ratio,
+                     'baseline_rss_mb': base['peak_rss_mb'], 'peak_rss_mb': stats['peak_rss_mb']})
+    return pd.DataFrame(rows), slower
+
+
+def _print_stages(result):
+    table = pd.DataFrame.from_dict(result['stages'], orient='index', dtype=float)
+    print('Scene: %(rows)d x %(cols)d pixels' % result['scene'] + ', rows kept: %d' % result['rows_kept'])
+    print(table.to_string(float_format=lambda v: '%.3f' % v))
+    print('Total: %.2f s (%.2f megapixels/s)' % (result['total_s'], result['megapixels_per_s']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the pixel table pipeline.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    filters = commands.add_parser('filters', help='compare the chained dataframe masks with the fused selection')
+    filters.add_argument('--pixels', type=int, default=5000000, help='number of synthetic pixels')
+    filters.add_argument('--repeat', type=int, default=3, help='runs per path, the best one is reported')
+
+    pipeline = commands.add_parser('pipeline', help='time every stage on a synthetic scene of TIFFs')
+    pipeline.add_argument('--megapixels', type=float, default=10.0, help='size of the square scene, 1 to 1000')
+    pipeline.add_argument('--seed', type=int, default=0, help='seed of the synthetic scene')
+    pipeline.add_argument('--window-rows', type=int, default=settings.WINDOW_ROWS, help='raster rows read at once')
+    pipeline.add_argument('--plot-workers', type=int, default=1, help='processes drawing the figures')
+    pipeline.add_argument('--backend', choices=['auto'] + list(BACKENDS), default=settings.RASTER_BACKEND,
+                          help='raster reader')
+    pipeline.add_argument('--compression', default=None, help='compress the scene TIFFs, for example zlib')
+    pipeline.add_argument('--scene-dir', default=None, help='keep the scene here and reuse it on later runs')
+    pipeline.add_argument('--out', default=None, help='write the results to this JSON file')
+    pipeline.add_argument('--compare', default=None, help='JSON results of an earlier run to compare against')
+    pipeline.add_argument('--tolerance', type=float, default=TOLERANCE, help='allowed slowdown of any stage')
+    args = parser.parse_args(argv)
+
+    if args.command == 'filters':
+        result = compare_filters(args.pixels, args.repeat)
+        print('Pixels: %(pixels)d, rows kept: %(rows_kept)d' % result)
+        print('Fires before the first epoch, dropped by the fused selection only: %(pre_epoch_dropped)d' % result)
+        print('Chained dataframe masks: %(legacy_s).3f s' % result)
+        print('Fused selection:         %(fused_s).3f s (%(speedup).1fx faster)' % result)
+        return 0
+
+    result = benchmark_pipeline(args.megapixels, args.seed, args.window_rows, args.scene_dir, args.plot_workers,
+                                args.backend, args.compression)
+    _print_stages(result)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['scene'] != result['scene']:
+            print('Warning: the baseline ran on a different scene: %s' % baseline['scene'])
+        table, slower = compare_results(result, baseline, args.tolerance)
+        print(table.to_string(index=False, float_format=lambda v: '%.3f' % v))
+        if slower:
+            print('Slower than %.2fx the baseline: %s' % (args.tolerance, ', '.join(slower)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+'''
+On-disk cache of the cleaned pixel table.
+
+Decoding the eight TIFFs and cleaning the table is the slow part of every run, even when only the plots or the
+regressions changed. The cleaned table is saved as one .npy file per column, under a key built from the input
+rasters and the filter settings. Later runs memory-map the columns instead of reading the rasters again.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from . import settings
+from .instrument import stage
+from .raster import read_pixel_table
+
+#Bump this when the layout of the pixel table changes, so old caches are not reused
+CACHE_VERSION = 3
+
+INDEX_FILE = '__index__.npy'
+META_FILE = 'meta.json'
+
+
+def _file_fingerprint(path, hash_contents=False):
+    stat = os.stat(path)
+    fingerprint = {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if hash_contents:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        fingerprint['sha1'] = digest.hexdigest()
+    return fingerprint
+
+
+def cache_key(directory, params, hash_contents=False, layer_files=None):
+    '''
+    Key of the cleaned table for a scene and a set of filter settings.
+
+    The key changes when any input raster is replaced or modified (by size and modification time, or by content
+    when hash_contents is True), or when any filter setting changes.
+    '''
+    layer_files = layer_files or settings.LAYER_FILES
+    description = {
+        'version': CACHE_VERSION,
+        'layers': {name: _file_fingerprint(os.path.join(directory, fname), hash_contents)
+                   for name, fname in layer_files.items()},
+        'params': params,
+        'code_list': list(settings.CODE_LIST),
+        'forest_type_list': list(settings.FOREST_TYPE_LIST),
+        'nodata': settings.NODATA,
+    }
+    text = json.dumps(description, sort_keys=True, default=list)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _write_folder(df, parent, key=None):
+    '''Write the pixel table to a new temporary folder in parent and return its path.'''
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp_')
+    meta = {'key': key, 'columns': [], 'rows': len(df)}
+    for i, name in enumerate(df.columns):
+        column = df[name]
+        fname = 'column_%02d.npy' % i
+        info = {'name': name, 'file': fname}
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp, fname), column.cat.codes.to_numpy())
+            info['categories'] = [str(c) for c in column.cat.categories]
+            info['ordered'] = bool(column.cat.ordered)
+        else:
+            np.save(os.path.join(tmp, fname), column.to_numpy())
+        meta['columns'].append(info)
+    np.save(os.path.join(tmp, INDEX_FILE), df.index.to_numpy())
+    with open(os.path.join(tmp, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return tmp
+
+
+def _complete(path):
+    return os.path.exists(os.path.join(path, META_FILE))
+
+
+def _replace_folder(tmp, path):
+    '''
+    Rename the finished folder tmp to path, replacing any folder there.
+
+    An old folder is first renamed aside and removed afterwards, so a crash never leaves half a table at path.
+    '''
+    try:
+        os.replace(tmp, path)
+        return
+    except OSError:
+        if not os.path.exists(path):
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+    aside = tempfile.mkdtemp(dir=os.path.dirname(tmp), prefix='.old_')
+    try:
+        os.replace(path, os.path.join(aside, 'table'))
+    except FileNotFoundError:
+        pass
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        #Put the old folder back, so a failed save leaves path as it was
+        if not os.path.exists(path) and os.path.exists(os.path.join(aside, 'table')):
+            os.replace(os.path.join(aside, 'table'), path)
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    finally:
+        shutil.rmtree(aside, ignore_errors=True)
+
+
+def save_table(df, path, key=None):
+    '''
+    Write the pixel table to a folder of .npy columns, replacing the folder if it exists. Categoricals are stored as
+    their integer codes.
+    '''
+    _replace_folder(_write_folder(df, os.path.dirname(os.path.abspath(path)), key), path)
+
+
+def _save_keyed_table(df, path, key):
+    '''
+    Save the table of a cache key. The folder is named by the key, so a complete folder which appeared at path while
+    this one was written holds the same table, saved by another process (see scenes.py). That copy is kept and this
+    one dropped, and readers of it never see it removed.
+    '''
+    tmp = _write_folder(df, os.path.dirname(os.path.abspath(path)), key)
+    try:
+        os.replace(tmp, path)
+        return
+    except OSError:
+        if not _complete(path):
+            _replace_folder(tmp, path)
+            return
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load_table(path, columns=None, mmap=True):
+    '''
+    Read a cached pixel table. Only the requested columns are loaded.
+
+    With mmap=True the .npy files are memory-mapped, so pages are only read from disk when they are used.
+    '''
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+    mmap_mode = 'r' if mmap else None
+    data = {}
+    for info in meta['columns']:
+        if columns is not None and info['name'] not in columns:
+            continue
+        values = np.load(os.path.join(path, info['file']), mmap_mode=mmap_mode)
+        if 'categories' in info:
+            values = pd.Categorical.from_codes(values, categories=info['categories'], ordered=info['ordered'])
+        data[info['name']] = values
+    index = pd.Index(np.load(os.path.join(path, INDEX_FILE), mmap_mode=mmap_mode))
+    return pd.DataFrame(data, index=index, copy=False)
+
+
+def cached_pixel_table(directory, cache_dir='FL_Cache', hash_contents=False, columns=None,
+                       window_rows=settings.WINDOW_ROWS, excluded_years=settings.EXCLUDED_BURN_YEARS,
+                       forest_code=settings.LONGLEAF_SLASH_PINE, drop_low=True, cut_bins=settings.CUT_BINS,
+                       bs_labels=settings.BS_LABELS, rows=None, backend=settings.RASTER_BACKEND):
+    '''
+    Read the pixel table of a scene from the cache, building and saving it first if needed.
+
+    Takes the same settings as read_pixel_table. A relative cache_dir is placed inside the scene directory. The raster
+    backend is not part of the key, as every backend reads the same values.
+    '''
+    params = {'excluded_years': sorted(excluded_years), 'forest_code': forest_code, 'drop_low': drop_low,
+              'cut_bins': list(cut_bins), 'bs_labels': list(bs_labels), 'rows': rows}
+    key = cache_key(directory, params, hash_contents)
+    path = os.path.join(directory, cache_dir, key)
+    if not _complete(path):
+        FL_Data = read_pixel_table(directory, window_rows, excluded_years, forest_code, drop_low, cut_bins,
+                                   bs_labels, rows, backend)
+        with stage('cache_save', rows_in=len(FL_Data)):
+            _save_keyed_table(FL_Data, path, key)
+    with stage('cache_load') as s:
+        FL_Data = load_table(path, columns)
+        s.rows_out = len(FL_Data)
+    return FL_Data
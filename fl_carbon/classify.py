@@ -0,0 +1,76 @@
+'''
+Integer classification of the forest codes and the burn severity.
+
+The original script labelled the table with pd.cut over Burn_Severity and Forest_Type.replace over the twelve NAFD
+codes, and then filtered on the string labels (!= 'Longleaf/Slash Pine', == 'Low'). Here both columns are first
+mapped to small integer codes: the forest codes through a lookup table indexed by the raw code, the severity bins
+with np.digitize. Filters compare those codes. The names are only attached at the end, as the categories of a
+categorical whose codes are the same integers, so labelling a window does not touch any strings.
+
+The bin edges and the code table are arguments, with the defaults of settings.py (see config.py to change them).
+Code -1 means no category: a forest code missing from the code table, or a severity outside of the bins.
+'''
+
+import numpy as np
+import pandas as pd
+
+from . import settings
+
+#Lookup tables cover every value a 16 bit code can take, so uint8 and uint16 layers index them directly
+LUT_SIZE = 1 << 16
+
+#Code of the pixels which are in no category
+NO_CATEGORY = -1
+
+
+def forest_category_lut(code_list=settings.CODE_LIST):
+    '''Table from NAFD raster code to the position of its name in FOREST_TYPE_LIST, -1 for unknown codes.'''
+    lut = np.full(LUT_SIZE, NO_CATEGORY, dtype=np.int8)
+    lut[list(code_list)] = np.arange(len(code_list))
+    return lut
+
+
+def forest_codes(codes, lut):
+    '''Forest type code of every raw NAFD code. Codes outside the table are -1.'''
+    if codes.dtype.kind == 'u' and codes.dtype.itemsize <= 2:
+        return lut[codes]
+    codes = codes.astype(np.int64)
+    out = np.full(len(codes), NO_CATEGORY, dtype=lut.dtype)
+    inside = (codes >= 0) & (codes < len(lut))
+    out[inside] = lut[codes[inside]]
+    return out
+
+
+def severity_codes(burn_severity, cut_bins=settings.CUT_BINS):
+    '''
+    Severity bin of every pixel, 0 for the first bin.
+
+    Bins are closed on the right like pd.cut: with [0, 30, 70, 100], 30 is in the first bin and 0 is in none.
+    Values outside of the bins and NaN are -1.
+    '''
+    if len(cut_bins) - 1 > np.iinfo(np.int8).max:
+        raise ValueError('At most %d severity bins are supported' % np.iinfo(np.int8).max)
+    bins = np.asarray(cut_bins, dtype=burn_severity.dtype if burn_severity.dtype.kind == 'f' else np.float64)
+    codes = np.digitize(burn_severity, bins, right=True).astype(np.int8) - 1
+    codes[codes == len(cut_bins) - 1] = NO_CATEGORY
+    return codes
+
+
+def attach_labels(codes, labels, ordered=False):
+    '''Categorical with the integer codes and the labels as its categories. Nothing is copied for int8 codes.'''
+    return pd.Categorical.from_codes(codes, categories=labels, ordered=ordered)
+
+
+def category_mask(column, labels):
+    '''
+    Boolean mask of the rows of a categorical column holding a label, or one of a list of labels.
+
+    The labels are turned into their codes once and the rows are compared by code.
+    '''
+    labels = [labels] if np.isscalar(labels) or labels is None else list(labels)
+    codes = column.cat.categories.get_indexer(labels)
+    codes = codes[codes >= 0]
+    column_codes = column.cat.codes.to_numpy()
+    if len(codes) == 1:
+        return column_codes == codes[0]
+    return np.isin(column_codes, codes)
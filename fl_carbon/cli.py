@@ -0,0 +1,171 @@
+'''
+Command line for batch runs of the analysis.
+
+Full_Carbon_Analysis_Script_Python_File.py runs every step in order and prints as it goes. On a cluster the steps
+are usually separate jobs, so here each one is a subcommand working on a scene folder:
+
+    python -m fl_carbon build data/florida --config fl_config.json
+    python -m fl_carbon regress data/florida --out-dir results
+    python -m fl_carbon render data/florida --out-dir figures
+    python -m fl_carbon strata data/florida --out-dir results
+    python -m fl_carbon export data/florida --out-dir results --format parquet
+    python -m fl_carbon config > fl_config.json
+
+build cleans the table into the cache (see cache.py), and regress and render read it from there. The filter settings
+come from the config file (see config.py), or from settings.py without one. strata keeps every forest type and
+severity class whatever the config says, and fits every stratum (see strata.py).
+
+Only argparse and json are imported up front. Each subcommand imports what it needs when it runs, so build never
+loads scipy or matplotlib and starts quickly, and render draws without a display.
+'''
+
+import argparse
+import json
+import os
+
+#Held out share and seed of the regressions, the same as in the analysis script
+TEST_SIZE = 0.4
+RANDOM_STATE = 0
+
+
+def _pixel_table(args, config):
+    from .cache import cached_pixel_table
+    from .config import filter_arguments
+    from .raster import read_pixel_table
+
+    if args.no_cache:
+        return read_pixel_table(args.directory, **filter_arguments(config))
+    return cached_pixel_table(args.directory, cache_dir=config['cache_dir'], **filter_arguments(config))
+
+
+def _regressions(args, FL_Data):
+    from .regression import age_summary, batch_regression
+
+    Age_Summary = age_summary(FL_Data, by=['Severity_Label'], x='Burn_Scar_Age')
+    Reg_Results = batch_regression(FL_Data, by=['Severity_Label'], x='Burn_Scar_Age', test_size=args.test_size or None,
+                                   random_state=args.random_state)
+    return Age_Summary, Reg_Results
+
+
+def build(args, config):
+    '''Clean the pixel table of a scene into the cache and report its size.'''
+    from .table import memory_per_pixel
+
+    FL_Data = _pixel_table(args, config)
+    print('%d pixels, %.1f bytes per pixel' % (len(FL_Data), memory_per_pixel(FL_Data)))
+    print(FL_Data['Severity_Label'].value_counts(sort=False).to_string())
+
+
+def regress(args, config):
+    '''Fit the recovery models and write Age_Summary.csv and Regressions.csv.'''
+    FL_Data = _pixel_table(args, config)
+    Age_Summary, Reg_Results = _regressions(args, FL_Data)
+    os.makedirs(args.out_dir, exist_ok=True)
+    Age_Summary.to_csv(os.path.join(args.out_dir, 'Age_Summary.csv'), index=False)
+    Reg_Results.to_csv(os.path.join(args.out_dir, 'Regressions.csv'), index=False)
+    print(Reg_Results.to_string(index=False))
+
+
+def render(args, config):
+    '''Draw the figures and the diagnostic figures of every model.'''
+    #Never ask for a display, the figures are drawn on their own Figure objects and saved
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    from .plots import MAX_POINTS, render_diagnostics, render_figures
+
+    FL_Data = _pixel_table(args, config)
+    Age_Summary, Reg_Results = _regressions(args, FL_Data)
+    max_points = args.max_points or MAX_POINTS
+    os.makedirs(args.out_dir, exist_ok=True)
+    paths = render_figures(FL_Data, Age_Summary, args.out_dir, args.workers, max_points)
+    paths += render_diagnostics(FL_Data, Reg_Results, args.out_dir, args.workers, max_points)
+    print('\n'.join(str(path) for path in paths))
+
+
+def strata(args, config):
+    '''Fit the recovery models of every forest type and severity class and write them to CSV files.'''
+    from .config import filter_arguments
+    from .strata import stratified_analysis, stratified_table
+
+    options = filter_arguments(config)
+    for name in ('forest_code', 'drop_low'):
+        del options[name]
+    FL_Data = stratified_table(args.directory, cache_dir=None if args.no_cache else config['cache_dir'], **options)
+    Counts, Summary, Results = stratified_analysis(FL_Data)
+    os.makedirs(args.out_dir, exist_ok=True)
+    Counts.to_csv(os.path.join(args.out_dir, 'Strata_Counts.csv'), index=False)
+    Summary.to_csv(os.path.join(args.out_dir, 'Strata_Summary.csv'), index=False)
+    Results.to_csv(os.path.join(args.out_dir, 'Strata_Regressions.csv'), index=False)
+    print(Counts.to_string(index=False))
+
+
+def export(args, config):
+    '''Write the summary tables and the per-pixel rasters of the severity, age and model residuals.'''
+    from .export import export_results
+
+    FL_Data = _pixel_table(args, config)
+    Age_Summary, Reg_Results = _regressions(args, FL_Data)
+    results = export_results(args.directory, FL_Data, {'Age_Summary': Age_Summary, 'Regressions': Reg_Results},
+                             args.out_dir, args.format, rasters=not args.no_rasters, backend=config['backend'],
+                             bs_labels=config['bs_labels'])
+    print('\n'.join(results.files.values()))
+
+
+def show_config(args, config):
+    '''Print the config in use, a starting point for a config file.'''
+    print(json.dumps(config, indent=4))
+
+
+def parser():
+    parser = argparse.ArgumentParser(prog='python -m fl_carbon',
+                                     description='Build the pixel table, fit the recovery models and draw the figures '
+                                                 'of a scene.')
+    parser.add_argument('--config', help='JSON file with the filter settings, see fl_carbon/config.py')
+    parser.add_argument('--timings', action='store_true', help='print the time and memory of every step')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def scene_command(name, func, help):
+        command = commands.add_parser(name, help=help, description=help)
+        command.add_argument('directory', help='folder with the eight TIFFs')
+        command.add_argument('--no-cache', action='store_true', help='read the rasters again instead of the cache')
+        command.set_defaults(func=func)
+        return command
+
+    scene_command('build', build, 'clean the pixel table of a scene into the cache')
+    for command in (scene_command('regress', regress, 'fit the recovery models and write them to CSV files'),
+                    scene_command('render', render, 'draw the figures and the model diagnostics'),
+                    scene_command('export', export, 'write the summary tables and the per-pixel GeoTIFFs')):
+        command.add_argument('--out-dir', default='.', help='folder for the output files')
+        command.add_argument('--test-size', type=float, default=TEST_SIZE,
+                             help='share of the pixels held out to test each model, 0 for in-sample results')
+        command.add_argument('--random-state', type=int, default=RANDOM_STATE, help='seed of the held out pixels')
+    strata_command = scene_command('strata', strata, 'fit the recovery models of every forest type and severity class')
+    strata_command.add_argument('--out-dir', default='.', help='folder for the output files')
+    export_command = commands.choices['export']
+    export_command.add_argument('--format', choices=['csv', 'parquet'], default='csv', help='format of the tables')
+    export_command.add_argument('--no-rasters', action='store_true', help='only write the tables')
+    render_command = commands.choices['render']
+    render_command.add_argument('--workers', type=int, default=None, help='processes drawing the figures')
+    render_command.add_argument('--max-points', type=int, default=None,
+                                help='scatter layers with more points are drawn as density plots (default 50000)')
+    commands.add_parser('config', help='print the config in use').set_defaults(func=show_config)
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+
+    from .config import apply_config, load_config
+    config = load_config(args.config)
+    apply_config(config)
+
+    if not args.timings:
+        return args.func(args, config)
+    from .instrument import StageRecorder, recording
+    with recording(StageRecorder.from_environment()) as recorder:
+        result = args.func(args, config)
+    recorder.report()
+    return result
+
+
+if __name__ == '__main__':
+    main()
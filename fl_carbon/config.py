@@ -0,0 +1,93 @@
+'''
+Filter settings read from a config file.
+
+The script and the modules take their filter choices from settings.py. A batch job can instead keep them in a small
+JSON file next to the data, so changing the excluded years or the severity bins does not mean editing the code:
+
+    {
+        "excluded_years": [0, 16, 20, 40],
+        "cut_bins": [0, 30, 70, 100],
+        "bs_labels": ["Low", "Moderate", "Severe"],
+        "forest_type": "Longleaf/Slash Pine"
+    }
+
+Keys left out keep the values of settings.py. forest_type is the name or the NAFD code of the forest type kept, or
+null to keep every forest type. code_list and forest_type_list replace the NAFD code table, and nodata gives the
+nodata value of layers without a nodata tag, for example {"Forest_Type": 0}. All of them go into the cache key, so
+a table cleaned with other values is never reused.
+
+    python -m fl_carbon config > fl_config.json
+'''
+
+import json
+
+from . import settings
+
+#Every key a config file may hold
+KEYS = ['excluded_years', 'cut_bins', 'bs_labels', 'forest_type', 'code_list', 'forest_type_list', 'nodata',
+        'drop_low', 'window_rows', 'backend', 'cache_dir']
+
+
+def default_config():
+    '''The config with the values of settings.py.'''
+    return {'excluded_years': list(settings.EXCLUDED_BURN_YEARS), 'cut_bins': list(settings.CUT_BINS),
+            'bs_labels': list(settings.BS_LABELS), 'forest_type': settings.LONGLEAF_SLASH_PINE,
+            'code_list': list(settings.CODE_LIST), 'forest_type_list': list(settings.FOREST_TYPE_LIST),
+            'nodata': dict(settings.NODATA), 'drop_low': True, 'window_rows': settings.WINDOW_ROWS,
+            'backend': settings.RASTER_BACKEND, 'cache_dir': 'FL_Cache'}
+
+
+def check_config(config):
+    '''Raise ValueError when the settings of a config do not fit together.'''
+    unknown = sorted(set(config) - set(KEYS))
+    if unknown:
+        raise ValueError('Unknown config keys %s, expected some of %s' % (unknown, KEYS))
+    if len(config['cut_bins']) != len(config['bs_labels']) + 1:
+        raise ValueError('cut_bins needs one more edge than there are bs_labels, got %d edges and %d labels'
+                         % (len(config['cut_bins']), len(config['bs_labels'])))
+    if list(config['cut_bins']) != sorted(config['cut_bins']):
+        raise ValueError('cut_bins must increase, got %s' % (config['cut_bins'],))
+    if len(config['code_list']) != len(config['forest_type_list']):
+        raise ValueError('code_list and forest_type_list must have the same length')
+    forest_code(config)
+
+
+def forest_code(config):
+    '''The NAFD code of the forest type kept, from its name or its code. None keeps every forest type.'''
+    forest_type = config['forest_type']
+    if forest_type is None or isinstance(forest_type, int):
+        return forest_type
+    if isinstance(forest_type, list):
+        return [forest_code(dict(config, forest_type=value)) for value in forest_type]
+    if forest_type not in config['forest_type_list']:
+        raise ValueError('Unknown forest type %r, expected one of %s' % (forest_type, config['forest_type_list']))
+    return config['code_list'][config['forest_type_list'].index(forest_type)]
+
+
+def load_config(path=None):
+    '''Read a config file over the defaults. With no path the defaults are returned.'''
+    config = default_config()
+    if path:
+        with open(path) as f:
+            config.update(json.load(f))
+    check_config(config)
+    return config
+
+
+def apply_config(config):
+    '''
+    Put the code table and the nodata values of a config into settings, where the table builder, the validity mask
+    and the cache key read them.
+
+    The other settings are passed to the functions as arguments, see filter_arguments.
+    '''
+    settings.CODE_LIST = list(config['code_list'])
+    settings.FOREST_TYPE_LIST = list(config['forest_type_list'])
+    settings.NODATA = dict(config['nodata'])
+
+
+def filter_arguments(config):
+    '''Keyword arguments of read_pixel_table and cached_pixel_table for a config.'''
+    return {'window_rows': config['window_rows'], 'excluded_years': tuple(config['excluded_years']),
+            'forest_code': forest_code(config), 'drop_low': config['drop_low'], 'cut_bins': list(config['cut_bins']),
+            'bs_labels': list(config['bs_labels']), 'backend': config['backend']}
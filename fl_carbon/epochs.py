@@ -0,0 +1,94 @@
+'''
+Change detection over any number of AGB and NEP epochs.
+
+Burn_Severity used to be computed twice over the whole column, once from AGB_1990 and AGB_2000 and once from
+AGB_2000 and AGB_2010, with the second overwriting the first for fires after 2000. That only works for three
+epochs. Here the epochs of a layer are a cube of shape (epochs, pixels). The pre-fire and post-fire epochs of every
+pixel are found from its Burn_Year with one binary search, and the values of both epochs are taken from the AGB and
+NEP cubes with one gather. The cost grows linearly with epochs x pixels, so annual stacks work the same way as the
+three decadal layers.
+
+For each pixel the pre-fire epoch is the last epoch before the fire year and the post-fire epoch is the first epoch
+in or after it. With the 1990/2000/2010 layers that gives the original choice: fires up to 2000 compare 1990 with
+2000, later fires compare 2000 with 2010. Fires with no epoch before or after them, or with no AGB in the pre-fire
+epoch, get a NaN Burn_Severity.
+'''
+
+import numpy as np
+
+from . import settings
+
+
+def epoch_cube(layers, idx=None):
+    '''
+    Stack the per-epoch arrays of one variable into a cube of shape (epochs, pixels).
+
+    layers is a list of 1D arrays in epoch order. With idx, only those pixel positions are taken.
+    '''
+    if idx is not None:
+        layers = [layer[idx] for layer in layers]
+    return np.stack(layers)
+
+
+def bracketing_epochs(epoch_years, fire_years):
+    '''
+    Index of the pre-fire and post-fire epoch of every pixel, and a mask of the pixels that have both.
+
+    epoch_years must be sorted. Indices of pixels without a bracket are clipped into range, so check the mask.
+    '''
+    epoch_years = np.asarray(epoch_years)
+    post = np.searchsorted(epoch_years, fire_years, side='left')
+    pre = post - 1
+    valid = (pre >= 0) & (post < len(epoch_years))
+    return np.clip(pre, 0, len(epoch_years) - 1), np.clip(post, 0, len(epoch_years) - 1), valid
+
+
+def fire_years(burn_year, origin=settings.BURN_YEAR_ORIGIN):
+    '''Calendar year of the fire from the Burn_Year code, which counts years after origin.'''
+    return burn_year.astype(np.int32) + origin
+
+
+def epoch_change(agb, nep, burn_year, epoch_years=None, origin=settings.BURN_YEAR_ORIGIN):
+    '''
+    Percent of AGB lost and the change in NEP between the bracketing epochs of every pixel's fire.
+
+    agb and nep are (epochs, pixels) cubes of the same pixels, or lists of per-epoch arrays. nep can be None. Returns
+    a dict with Burn_Severity (percent of AGB lost, in the dtype of agb) and, with nep, NEP_Change (post-fire minus
+    pre-fire NEP). The arithmetic is the same as the original columns, (pre - post) / pre * 100.
+    '''
+    epoch_years = settings.EPOCH_YEARS if epoch_years is None else epoch_years
+    #Integer layers are promoted so the results can hold NaN
+    agb = np.asarray(agb)
+    dtype = np.result_type(agb.dtype, np.float32)
+    cube = agb[None].astype(dtype, copy=False) if nep is None else np.stack([agb, nep]).astype(dtype, copy=False)
+    if cube.shape[1] != len(epoch_years):
+        raise ValueError('Expected %d epochs, got %d' % (len(epoch_years), cube.shape[1]))
+
+    pre, post, valid = bracketing_epochs(epoch_years, fire_years(burn_year, origin))
+    #One gather takes the pre and post values of every layer: the result has shape (layers, 2, pixels)
+    bracket = np.take_along_axis(cube, np.stack([pre, post])[None], axis=1)
+
+    #Pixels without a pre-fire AGB to divide by get NaN without dividing, so no float warnings are raised
+    pre_agb = bracket[0, 0]
+    severity = np.full(pre_agb.shape, np.nan, dtype=dtype)
+    np.divide(pre_agb - bracket[0, 1], pre_agb, out=severity, where=valid & (pre_agb != 0))
+    severity *= 100
+    change = {'Burn_Severity': severity}
+    if nep is not None:
+        nep_change = bracket[1, 1] - bracket[1, 0]
+        nep_change[~valid] = np.nan
+        change['NEP_Change'] = nep_change
+    return change
+
+
+def agb_loss(window, agb_columns=None):
+    '''
+    True for pixels with less aboveground biomass in any epoch than in the epoch before it.
+
+    With the three decadal layers this is the Minus_90_00 > 0 or Minus_00_10 > 0 test of the original script.
+    '''
+    agb_columns = agb_columns or list(settings.AGB_EPOCHS.values())
+    loss = np.zeros(len(window[agb_columns[0]]), dtype=bool)
+    for before, after in zip(agb_columns[:-1], agb_columns[1:]):
+        np.logical_or(loss, np.greater(window[before], window[after]), out=loss)
+    return loss
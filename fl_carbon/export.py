@@ -0,0 +1,240 @@
+'''
+Export of the results: summary tables as CSV or Parquet and per-pixel products as GeoTIFFs.
+
+The script prints its results and LinReg, QuadReg and F_stat round the coefficients into strings, so a later GIS job
+had to run the analysis again to use them. export_results keeps every summary table at full precision in an
+AnalysisResults object and writes it out, and writes the per-pixel products back onto the grid of the scene:
+
+- Severity_Class, the severity bin of every kept pixel (0 for the first label of BS_LABELS),
+- Forest_Class, the position of its forest type in FOREST_TYPE_LIST,
+- Burn_Scar_Age, in years at 2010,
+- Residual_<response>_<model>, the residual of every fitted model of the regressions table.
+
+The index of FL_Data is the flat pixel index in the scene, so each value goes back to its raster row and column.
+Pixels which were filtered out are nodata: 255 in the class and age rasters, NaN in the residuals. The rasters are
+tiled and deflate compressed, and carry the georeferencing tags of the source layers. They are written one band of
+tiles at a time, so a scene never has to fit in memory as a full raster. The codes of the class rasters are listed
+in the Legend table and in each file's ImageDescription. They come from the full lists of labels, not from the
+categories the table happens to carry, so a class has the same code whichever classes a scene holds.
+
+    results = export_results('.', FL_Data, {'Age_Summary': Age_Summary, 'Regressions': Reg_Results}, 'FL_Results')
+    results.model('AGB_2010', 'linear', Severity_Label='Severe')['coef_x1']
+
+Parquet needs pyarrow, and the rasters need tifffile.
+'''
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from . import settings
+from .classify import category_mask
+from .instrument import stage
+from .raster import open_layers, scene_grid
+from .readers import GDAL_NODATA, GEO_KEY_DIRECTORY, MODEL_PIXEL_SCALE, MODEL_TIEPOINT, MODEL_TRANSFORMATION
+from .regression import predict
+
+#Side of the square tiles of the written rasters
+TILE_SIZE = 256
+
+#Nodata of the class and age rasters, which are uint8
+CLASS_NODATA = 255
+
+#GeoTIFF tags copied from the source layers: the model tags, the GeoKey directory and its double and ascii params
+GEO_DOUBLE_PARAMS = 34736
+GEO_ASCII_PARAMS = 34737
+GEO_TAGS = [MODEL_PIXEL_SCALE, MODEL_TIEPOINT, MODEL_TRANSFORMATION, GEO_KEY_DIRECTORY, GEO_DOUBLE_PARAMS,
+            GEO_ASCII_PARAMS]
+
+TABLE_FORMATS = ['csv', 'parquet']
+
+
+def write_table(table, path):
+    '''Write a table as CSV or Parquet, chosen by the extension of path. Parquet keeps the categoricals.'''
+    if path.endswith('.parquet'):
+        table.to_parquet(path, index=False)
+    else:
+        table.to_csv(path, index=False)
+    return path
+
+
+class AnalysisResults:
+    '''
+    The summary tables of one run of the analysis, at full precision, and the files they were written to.
+
+    tables maps a name (Age_Summary, Regressions, ...) to a DataFrame, and files maps the name of every table and
+    raster written to its path.
+    '''
+
+    def __init__(self, tables=None, files=None):
+        self.tables = dict(tables or {})
+        self.files = dict(files or {})
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+    def model(self, response, model, table='Regressions', **groups):
+        '''
+        One fitted model of a regressions table as a dict, for example model('NEP_2010', 'linear',
+        Severity_Label='Severe'). Raises KeyError unless exactly one row matches.
+        '''
+        rows = self.tables[table]
+        keep = (rows['response'] == response) & (rows['model'] == model)
+        for name, value in groups.items():
+            keep &= (rows[name] == value)
+        rows = rows[keep]
+        if len(rows) != 1:
+            raise KeyError('%d rows of %s match %s %s %s' % (len(rows), table, response, model, groups))
+        return rows.iloc[0].to_dict()
+
+    def write_tables(self, out_dir, fmt='csv'):
+        '''Write every table to <out_dir>/<name>.<fmt> and return their paths.'''
+        if fmt not in TABLE_FORMATS:
+            raise ValueError('Unknown table format %r, expected one of %s' % (fmt, TABLE_FORMATS))
+        os.makedirs(out_dir, exist_ok=True)
+        with stage('export_tables', rows_in=sum(len(table) for table in self.tables.values())):
+            paths = {name: write_table(table, os.path.join(out_dir, '%s.%s' % (name, fmt)))
+                     for name, table in self.tables.items()}
+        self.files.update(paths)
+        return paths
+
+
+def _class_codes(column, labels):
+    #Codes of the fixed labels, whatever categories were dropped from the column (remove_unused_categories)
+    codes = column.cat.set_categories(labels).cat.codes.to_numpy()
+    return np.where(codes >= 0, codes, CLASS_NODATA).astype(np.uint8)
+
+
+def _group_mask(FL_Data, row, by):
+    keep = np.ones(len(FL_Data), dtype=bool)
+    for name in by:
+        column = FL_Data[name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            keep &= category_mask(column, row[name])
+        else:
+            keep &= (column == row[name]).to_numpy()
+    return keep
+
+
+def pixel_products(FL_Data, Reg_Results=None, by=('Severity_Label',), x='Burn_Scar_Age', bs_labels=settings.BS_LABELS,
+                   forest_type_list=None):
+    '''
+    The per-pixel products of the analysis, aligned with the rows of FL_Data.
+
+    Returns {name: (values, nodata, labels)}, labels being the names of the codes of a class product and None
+    otherwise. The class codes are positions in bs_labels and forest_type_list (settings.FOREST_TYPE_LIST at call
+    time). With Reg_Results (a batch_regression table grouped by the by columns), the residual of every pixel under
+    every fitted model of its group is added. Pixels of groups without a fit get NaN.
+    '''
+    bs_labels = list(bs_labels)
+    forest_type_list = list(settings.FOREST_TYPE_LIST if forest_type_list is None else forest_type_list)
+    products = {
+        'Severity_Class': (_class_codes(FL_Data['Severity_Label'], bs_labels), CLASS_NODATA, bs_labels),
+        'Forest_Class': (_class_codes(FL_Data['Forest_Type'], forest_type_list), CLASS_NODATA, forest_type_list),
+        'Burn_Scar_Age': (FL_Data[x].to_numpy().astype(np.uint8), CLASS_NODATA, None),
+    }
+    if Reg_Results is None:
+        return products
+    by = list(by)
+    xv = FL_Data[x].to_numpy(dtype=np.float64)
+    for (response, model), rows in Reg_Results.groupby(['response', 'model'], sort=False):
+        y = FL_Data[response].to_numpy(dtype=np.float64)
+        residual = np.full(len(FL_Data), np.nan, dtype=np.float32)
+        for _, row in rows.iterrows():
+            if np.isnan(row['intercept']):
+                continue
+            keep = _group_mask(FL_Data, row, by)
+            residual[keep] = y[keep] - predict(row, xv[keep])
+        products['Residual_%s_%s' % (response, model)] = (residual, np.nan, None)
+    return products
+
+
+def geotiff_tags(path):
+    '''The georeferencing tags of a GeoTIFF, as tifffile extratags, so a written raster sits on the same grid.'''
+    import tifffile
+    with tifffile.TiffFile(path) as tif:
+        tags = tif.pages[0].tags
+        return [(code, int(tags[code].dtype), tags[code].count, tags[code].value, True)
+                for code in GEO_TAGS if code in tags]
+
+
+def write_raster(path, index, values, shape, nodata, geotags=(), description=None, tile=TILE_SIZE,
+                 compression='zlib'):
+    '''
+    Write the values of the pixels at the flat positions in index as a tiled, compressed GeoTIFF of the given shape.
+
+    index must be sorted, as the index of the pixel table is. The other pixels are nodata. The raster is written one
+    band of tiles at a time.
+    '''
+    import tifffile
+    height, width = shape
+    values = np.asarray(values)
+    padded = -(-width // tile) * tile
+
+    def tiles():
+        for row0 in range(0, height, tile):
+            row1 = min(row0 + tile, height)
+            band = np.full((tile, padded), nodata, dtype=values.dtype)
+            lo, hi = np.searchsorted(index, [row0 * width, row1 * width])
+            rows, cols = np.divmod(index[lo:hi] - row0 * width, width)
+            band[rows, cols] = values[lo:hi]
+            for col0 in range(0, padded, tile):
+                yield np.ascontiguousarray(band[:, col0:col0 + tile])
+
+    nodata_text = 'nan' if np.isnan(nodata) else '%g' % nodata
+    extratags = list(geotags) + [(GDAL_NODATA, 's', 0, nodata_text, True)]
+    tifffile.imwrite(path, tiles(), shape=(height, width), dtype=values.dtype, tile=(tile, tile),
+                     compression=compression, extratags=extratags, description=description, metadata=None,
+                     bigtiff=height * width * values.dtype.itemsize > (1 << 32) - (1 << 24))
+    return path
+
+
+def export_rasters(FL_Data, shape, out_dir, products, geotags=(), tile=TILE_SIZE, compression='zlib'):
+    '''Write every product of pixel_products as <out_dir>/<name>.tif and return their paths.'''
+    index = FL_Data.index.to_numpy()
+    order = None
+    if len(index) > 1 and not (index[1:] > index[:-1]).all():
+        order = np.argsort(index, kind='stable')
+        index = index[order]
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {}
+    for name, (values, nodata, labels) in products.items():
+        with stage('export_raster', rows_in=len(values)):
+            values = values if order is None else values[order]
+            description = json.dumps({'product': name, 'labels': labels})
+            paths[name] = write_raster(os.path.join(out_dir, name + '.tif'), index, values, shape, nodata, geotags,
+                                       description, tile, compression)
+    return paths
+
+
+def legend(products):
+    '''Table of the code and label of every class of the class products.'''
+    rows = [{'product': name, 'code': code, 'label': label}
+            for name, (_, _, labels) in products.items() if labels for code, label in enumerate(labels)]
+    return pd.DataFrame(rows, columns=['product', 'code', 'label'])
+
+
+def export_results(directory, FL_Data, tables, out_dir='FL_Results', fmt='csv', rasters=True, regressions='Regressions',
+                   by=('Severity_Label',), x='Burn_Scar_Age', compression='zlib', backend=settings.RASTER_BACKEND,
+                   bs_labels=settings.BS_LABELS):
+    '''
+    Write the summary tables and the per-pixel products of the scene in directory to out_dir.
+
+    tables maps names to the summary tables. The residual rasters use the fits in tables[regressions], grouped by
+    the by columns. bs_labels are the severity labels the table was built with. Returns the AnalysisResults, with
+    the Legend table added when rasters are written.
+    '''
+    results = AnalysisResults(tables)
+    if rasters:
+        layers = open_layers(directory, backend=backend)
+        grid = scene_grid(layers)
+        products = pixel_products(FL_Data, tables.get(regressions), by, x, bs_labels)
+        path = next(iter(layers.values())).path
+        geotags = geotiff_tags(path) if path.lower().endswith(('.tif', '.tiff')) else []
+        results.files.update(export_rasters(FL_Data, grid['shape'], out_dir, products, geotags,
+                                            compression=compression))
+        results.tables['Legend'] = legend(products)
+    results.write_tables(out_dir, fmt)
+    return results
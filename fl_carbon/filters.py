@@ -0,0 +1,114 @@
+'''
+Fused pixel selection over the raw layer arrays.
+
+The original script filtered the dataframe in several passes (burn year, AGB loss, forest type, Low severity), and
+each pass copied the frame or built an index to drop. Here every criterion is evaluated on the NumPy arrays of a
+window in one stage, using lookup tables for the burn-year and forest codes, and only the surviving rows are turned
+into a dataframe. Pixels missing a layer (validity.py) are dropped before any of them.
+'''
+
+import numpy as np
+
+from . import settings
+from .classify import LUT_SIZE, NO_CATEGORY, severity_codes
+from .epochs import agb_loss, epoch_change, epoch_cube
+from .instrument import active_recorder, record_drops, stage
+from .validity import missing_counts, validity_bits
+
+#Severity code of the Low bin, the first one
+LOW_SEVERITY = 0
+
+
+def burn_year_lut(excluded_years=settings.EXCLUDED_BURN_YEARS):
+    '''Boolean table which is True for every Burn_Year code the analysis keeps.'''
+    lut = np.ones(LUT_SIZE, dtype=bool)
+    lut[list(excluded_years)] = False
+    return lut
+
+
+def forest_lut(forest_code=settings.LONGLEAF_SLASH_PINE):
+    '''Boolean table which is True for the target forest code(s), or for every code when forest_code is None.'''
+    if forest_code is None:
+        return np.ones(LUT_SIZE, dtype=bool)
+    lut = np.zeros(LUT_SIZE, dtype=bool)
+    lut[np.atleast_1d(forest_code)] = True
+    return lut
+
+
+def lookup(lut, codes):
+    '''Look up integer raster codes in a table. Codes outside the table are treated as False.'''
+    if codes.dtype.kind == 'u' and codes.dtype.itemsize <= 2:
+        return lut[codes]
+    #Some exports store the codes as floats or signed integers
+    codes = codes.astype(np.int64)
+    inside = (codes >= 0) & (codes < len(lut))
+    out = np.zeros(len(codes), dtype=bool)
+    out[inside] = lut[codes[inside]]
+    return out
+
+
+def select_pixels(window, year_lut, type_lut, drop_low=True, cut_bins=settings.CUT_BINS,
+                  agb_epochs=settings.AGB_EPOCHS, nep_epochs=settings.NEP_EPOCHS, nodata=None):
+    '''
+    Return the positions of the pixels in a window that pass every filter, and their change between epochs.
+
+    Pixels missing any layer (nodata, NaN or infinite, see validity.py) are dropped first. The cheap code lookups and
+    the AGB loss test run over the whole window. Burn_Severity and NEP_Change (see epochs.py) are then only computed
+    for the pixels still left, and Burn_Severity is binned into the integer Severity_Code (see classify.py). Pixels
+    without a severity, or with one outside of the bins, are dropped along with the Low severity ones. The change is
+    returned as a dict of arrays of the kept pixels.
+
+    nodata maps layer names to their nodata value (validity.layer_nodata). Every filter reports the pixels it
+    dropped and why to the active recorder (instrument.record_drops).
+    '''
+    agb_columns = list(agb_epochs.values())
+
+    #rows_in of each filter is the number of pixels it looks at, the ones still left
+    pixels = len(window['Burn_Year'])
+    with stage('filter_nodata', rows_in=pixels) as s:
+        bits = validity_bits(window, nodata)
+        keep = None if bits is None else bits == 0
+        s.rows_out = pixels if keep is None else keep
+    if active_recorder() is not None:
+        record_drops(s, missing_counts(bits, list(window)))
+    with stage('filter_burn_year', rows_in=pixels if keep is None else keep) as s:
+        years = lookup(year_lut, window['Burn_Year'])
+        keep = years if keep is None else np.logical_and(keep, years, out=keep)
+        s.rows_out = keep
+    record_drops(s, 'excluded_burn_year')
+    with stage('filter_forest_type', rows_in=keep) as s:
+        np.logical_and(keep, lookup(type_lut, window['Forest_Type']), out=keep)
+        s.rows_out = keep
+    record_drops(s, 'other_forest_type')
+
+    #Less aboveground biomass after the fire, between 1990 & 2000 or 2000 & 2010
+    with stage('filter_agb_loss', rows_in=keep) as s:
+        np.logical_and(keep, agb_loss(window, agb_columns), out=keep)
+        idx = np.flatnonzero(keep)
+        s.rows_out = len(idx)
+    record_drops(s, 'no_agb_loss')
+
+    with stage('burn_severity', rows_in=len(idx)):
+        change = epoch_change(epoch_cube([window[c] for c in agb_columns], idx),
+                              epoch_cube([window[c] for c in nep_epochs.values()], idx),
+                              window['Burn_Year'][idx], list(agb_epochs))
+    #Binned from the float32 values stored in the table, so the code always matches the Burn_Severity column
+    with stage('classify_severity', rows_in=len(idx)):
+        change['Severity_Code'] = severity_codes(change['Burn_Severity'].astype(np.float32, copy=False), cut_bins)
+
+    #Severity is NaN without an AGB value before the fire to divide by, or without an epoch before or after it
+    with stage('filter_severity', rows_in=len(idx)) as s:
+        severity, codes = change['Burn_Severity'], change['Severity_Code']
+        keep = codes != NO_CATEGORY
+        if drop_low:
+            np.logical_and(keep, codes != LOW_SEVERITY, out=keep)
+        if not keep.all():
+            idx = idx[keep]
+            change = {name: values[keep] for name, values in change.items()}
+        s.rows_out = len(idx)
+    if active_recorder() is not None:
+        no_severity = int(np.count_nonzero(np.isnan(severity)))
+        record_drops(s, {'no_severity': no_severity,
+                         'severity_outside_bins': int(np.count_nonzero(codes == NO_CATEGORY)) - no_severity,
+                         'low_severity': codes == LOW_SEVERITY if drop_low else 0})
+    return idx, change
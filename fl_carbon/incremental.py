@@ -0,0 +1,290 @@
+'''
+Incremental updates of the pixel table, the group statistics and the figures.
+
+When one layer is replaced, for example an updated MTSB burn-year layer, the cache key changes and the whole table
+would be rebuilt from all eight layers. In the update mode a state folder keeps the table, a digest of every band of
+rows of every layer, the per-cell sums behind the statistics and a digest of the data of every figure. update() then:
+
+1. finds the layers whose file changed (size or modification time), and the bands of rows whose pixels changed in
+   them, by comparing the band digests,
+2. reads and cleans only those bands again, from all layers. The filters and derived columns only look at the pixel
+   itself, so the rows of the other bands stay valid,
+3. updates the count, sum and sum of squares of every severity group and burn scar age by taking away the old rows
+   of the changed bands and adding the new ones. The per-age summary and the regressions are solved from these sums
+   (batch_regression_from_summary), so they are not recomputed from the pixels,
+4. draws again only the figures whose data changed.
+
+A change to the list of layers (a new epoch), the grid, the band size or the filter settings makes the next update a
+full rebuild, which also writes a new state.
+
+    python -m fl_carbon.incremental data/florida --out-dir figures
+'''
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from . import settings
+from .cache import CACHE_VERSION, _file_fingerprint, load_table, save_table
+from .filters import burn_year_lut, forest_lut
+from .instrument import stage
+from .plots import _render, diagnostic_tasks, figure_tasks, task_digest
+from .raster import filter_window, iter_windows, open_layers
+from .readers import BACKENDS
+from .regression import RESPONSES, batch_regression_from_summary
+from .validity import layer_nodata
+
+STATE_FILE = 'state.json'
+
+#The table and the cell sums of every update go to new folders, <name>_<generation>, named in the state file
+TABLE_FOLDER = 'table'
+CELLS_FOLDER = 'cells'
+
+#Groups of the statistics and figures kept up to date
+BY = ['Severity_Label']
+X = 'Burn_Scar_Age'
+
+
+def band_digest(values):
+    '''Digest of the pixels of one band of a layer.'''
+    values = np.ascontiguousarray(values)
+    digest = hashlib.sha1(values.dtype.str.encode('ascii'))
+    digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def cell_sums(FL_Data, by=BY, x=X, responses=RESPONSES):
+    '''Pixel count and the sum and sum of squares of every response, for each group and value of x.'''
+    keys = list(by) + [x]
+    data = FL_Data[keys].copy()
+    columns = []
+    for response in responses:
+        values = FL_Data[response].to_numpy(dtype=np.float64)
+        data[response + '_sum'] = values
+        data[response + '_sq'] = values * values
+        columns += [response + '_sum', response + '_sq']
+    grouped = data.groupby(keys, observed=True, sort=True)
+    sums = grouped[columns].sum()
+    sums.insert(0, 'count', grouped.size().astype(np.float64))
+    return sums
+
+
+def summary_from_cells(cells, responses=RESPONSES):
+    '''The age_summary table (count, mean and ddof=0 variance of every response) from the cell sums.'''
+    cells = cells[cells['count'] > 0]
+    count = cells['count']
+    summary = pd.DataFrame({'count': count.astype(np.int64)}, index=cells.index)
+    for response in responses:
+        summary[response + '_mean'] = cells[response + '_sum'] / count
+    for response in responses:
+        mean = summary[response + '_mean']
+        summary[response + '_var'] = (cells[response + '_sq'] / count - mean * mean).clip(lower=0)
+    return summary.reset_index()
+
+
+def _state_description(directory, layers, window_rows, params):
+    #Anything which, when it changes, makes the stored table and digests useless
+    return {'version': CACHE_VERSION, 'layers': {name: layer.path for name, layer in layers.items()},
+            'shape': list(next(iter(layers.values())).shape), 'window_rows': window_rows, 'params': params,
+            'code_list': list(settings.CODE_LIST), 'forest_type_list': list(settings.FOREST_TYPE_LIST),
+            'nodata': dict(settings.NODATA),
+            'by': BY, 'x': X, 'responses': RESPONSES}
+
+
+def _remove_stale(state_path, folders):
+    #Folders of earlier updates, once the state file points at the new ones
+    for name in os.listdir(state_path):
+        if name.split('_')[0] in (TABLE_FOLDER, CELLS_FOLDER) and name not in folders.values():
+            shutil.rmtree(os.path.join(state_path, name), ignore_errors=True)
+
+
+def _changed_rows(old, new):
+    '''Rows added, removed and changed between the old and new rows of a band, and the changes per column.'''
+    added = new.index.difference(old.index)
+    removed = old.index.difference(new.index)
+    common = old.index.intersection(new.index)
+    changed = np.zeros(len(common), dtype=bool)
+    columns = {}
+    for name in new.columns:
+        a, b = old.loc[common, name], new.loc[common, name]
+        differs = (a != b).to_numpy() & ~(a.isna() & b.isna()).to_numpy()
+        if differs.any():
+            columns[name] = int(differs.sum())
+            changed |= differs
+    return len(added), len(removed), int(changed.sum()), columns
+
+
+def update(directory, state_dir='FL_State', out_dir='.', window_rows=settings.WINDOW_ROWS,
+           excluded_years=settings.EXCLUDED_BURN_YEARS, forest_code=settings.LONGLEAF_SLASH_PINE, drop_low=True,
+           cut_bins=settings.CUT_BINS, bs_labels=settings.BS_LABELS, backend=settings.RASTER_BACKEND, workers=None,
+           render=True):
+    '''
+    Bring the pixel table, the per-age summary, the regressions and the figures of a scene up to date.
+
+    The first call builds everything and writes the state. A relative state_dir is placed inside the scene directory.
+    Returns the pixel table, the per-age summary, the regression results (in-sample, from every pixel) and a report
+    of what changed: the layers, the bands, the rows added, removed and changed, the changes per column and the
+    figures drawn and kept.
+    '''
+    state_path = os.path.join(directory, state_dir)
+    layers = open_layers(directory, backend=backend)
+    height, width = next(iter(layers.values())).shape
+    params = {'excluded_years': sorted(excluded_years), 'forest_code': forest_code, 'drop_low': drop_low,
+              'cut_bins': list(cut_bins), 'bs_labels': list(bs_labels)}
+    description = _state_description(directory, layers, window_rows, params)
+    bands = [(row0, min(row0 + window_rows, height)) for row0 in range(0, height, window_rows)]
+
+    state = None
+    try:
+        with open(os.path.join(state_path, STATE_FILE)) as f:
+            state = json.load(f)
+        if state['description'] != json.loads(json.dumps(description)):
+            state = None
+        else:
+            generation, folders = state['generation'], {'table': state['table'], 'cells': state['cells']}
+    except (OSError, ValueError, KeyError):
+        state = None
+
+    fingerprints = {name: _file_fingerprint(layer.path) for name, layer in layers.items()}
+    report = {'full_rebuild': state is None, 'layers_changed': [], 'bands_changed': 0, 'rows_added': 0,
+              'rows_removed': 0, 'rows_changed': 0, 'columns_changed': {}}
+
+    #1. Layers and bands which changed
+    with stage('detect_changes') as s:
+        if state is None:
+            digests = {name: [None] * len(bands) for name in layers}
+            changed = set(range(len(bands)))
+            report['layers_changed'] = list(layers)
+        else:
+            digests = state['bands']
+            changed = set()
+            for name, layer in layers.items():
+                if fingerprints[name] == state['fingerprints'][name]:
+                    continue
+                report['layers_changed'].append(name)
+                for i, (row0, row1) in enumerate(bands):
+                    digest = band_digest(layer.read_rows(row0, row1))
+                    if digest != digests[name][i]:
+                        changed.add(i)
+        s.rows_out = len(changed)
+    report['bands_changed'] = len(changed)
+
+    if state is None:
+        FL_Data, cells = None, None
+    else:
+        FL_Data = load_table(os.path.join(state_path, folders['table']))
+        cells = load_table(os.path.join(state_path, folders['cells']), mmap=False)
+        cells = cells.set_index(BY + [X])
+
+    #2 and 3. Clean the changed bands again and update the cell sums
+    if changed:
+        year_lut = burn_year_lut(excluded_years)
+        type_lut = forest_lut(forest_code)
+        nodata = layer_nodata(layers)
+        index = FL_Data.index.to_numpy() if FL_Data is not None else np.empty(0, dtype=np.int64)
+        pieces, previous, delta = [], 0, None
+        with stage('update_bands', rows_in=len(changed) * window_rows * width) as s:
+            for i in sorted(changed):
+                row0, row1 = bands[i]
+                for start, window in iter_windows(layers, window_rows, rows=(row0, row1)):
+                    for name in layers:
+                        digests[name][i] = band_digest(window[name])
+                    new = filter_window(start, window, year_lut, type_lut, drop_low, cut_bins, bs_labels, nodata)
+                lo, hi = np.searchsorted(index, [row0 * width, row1 * width])
+                if FL_Data is not None:
+                    old = FL_Data.iloc[lo:hi]
+                    added, removed, rows_changed, columns = _changed_rows(old, new)
+                    report['rows_added'] += added
+                    report['rows_removed'] += removed
+                    report['rows_changed'] += rows_changed
+                    for name, count in columns.items():
+                        report['columns_changed'][name] = report['columns_changed'].get(name, 0) + count
+                    pieces.append(FL_Data.iloc[previous:lo])
+                    band_delta = cell_sums(new).sub(cell_sums(old), fill_value=0)
+                    delta = band_delta if delta is None else delta.add(band_delta, fill_value=0)
+                else:
+                    report['rows_added'] += len(new)
+                pieces.append(new)
+                previous = hi
+            if FL_Data is not None:
+                pieces.append(FL_Data.iloc[previous:])
+            FL_Data = pd.concat(pieces)
+            s.rows_out = len(FL_Data)
+
+        with stage('update_statistics', rows_in=len(FL_Data)):
+            if cells is None:
+                cells = cell_sums(FL_Data)
+            else:
+                #Only the cells which really changed are touched, so the others keep their exact sums
+                delta = delta[(delta != 0).any(axis=1)]
+                cells = cells.add(delta, fill_value=0)
+                cells = cells[cells['count'] > 0]
+
+    Age_Summary = summary_from_cells(cells)
+    Reg_Results = batch_regression_from_summary(Age_Summary, by=BY, responses=RESPONSES, x=X)
+
+    #4. Figures whose data changed
+    figures = dict(state['figures']) if state is not None else {}
+    report['figures_drawn'], report['figures_kept'] = [], []
+    if render:
+        tasks = figure_tasks(FL_Data, Age_Summary, out_dir) + diagnostic_tasks(FL_Data, Reg_Results, out_dir)
+        todo = []
+        with stage('figure_digests', rows_in=len(FL_Data)):
+            for task in tasks:
+                digest = task_digest(task)
+                paths = [arg for arg in task[2] if isinstance(arg, str) and arg.endswith('.png')]
+                if figures.get(task[0]) == digest and all(os.path.exists(path) for path in paths):
+                    report['figures_kept'].append(task[0])
+                else:
+                    todo.append(task)
+                    figures[task[0]] = digest
+        _render(todo, workers)
+        report['figures_drawn'] = [task[0] for task in todo]
+
+    if changed or state is None or report['layers_changed'] or report['figures_drawn']:
+        with stage('save_state', rows_in=len(FL_Data)):
+            #The state file only names the new folders once both are written, so a failed write keeps the old state
+            if changed:
+                generation = generation + 1 if state is not None else 0
+                folders = {'table': '%s_%d' % (TABLE_FOLDER, generation), 'cells': '%s_%d' % (CELLS_FOLDER, generation)}
+                save_table(FL_Data, os.path.join(state_path, folders['table']))
+                save_table(cells.reset_index(), os.path.join(state_path, folders['cells']))
+            state = {'description': description, 'fingerprints': fingerprints, 'bands': digests, 'figures': figures,
+                     'generation': generation}
+            state.update(folders)
+            with open(os.path.join(state_path, STATE_FILE + '.tmp'), 'w') as f:
+                json.dump(state, f)
+            os.replace(os.path.join(state_path, STATE_FILE + '.tmp'), os.path.join(state_path, STATE_FILE))
+            _remove_stale(state_path, folders)
+    return FL_Data, Age_Summary, Reg_Results, report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Update the pixel table, statistics and figures of a scene after '
+                                                 'some of its layers changed.')
+    parser.add_argument('directory', help='folder with the eight TIFFs')
+    parser.add_argument('--state-dir', default='FL_State', help='state folder, relative to the scene folder')
+    parser.add_argument('--out-dir', default='.', help='folder for the figures')
+    parser.add_argument('--window-rows', type=int, default=settings.WINDOW_ROWS, help='raster rows in each band')
+    parser.add_argument('--workers', type=int, default=None, help='processes drawing the figures')
+    parser.add_argument('--backend', choices=['auto'] + list(BACKENDS), default=settings.RASTER_BACKEND,
+                        help='raster reader')
+    parser.add_argument('--no-figures', action='store_true', help='only update the table and the statistics')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    FL_Data, Age_Summary, Reg_Results, report = update(args.directory, args.state_dir, args.out_dir,
+                                                       args.window_rows, backend=args.backend, workers=args.workers,
+                                                       render=not args.no_figures)
+    print(json.dumps(report, indent=1))
+    Age_Summary.to_csv(os.path.join(args.out_dir, 'Age_Summary.csv'), index=False)
+    Reg_Results.to_csv(os.path.join(args.out_dir, 'Regressions.csv'), index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+'''
+Lightweight instrumentation of the pipeline stages.
+
+Every stage of the pipeline (decoding and flattening each window, each filter, Burn_Severity, the severity bins, the
+forest relabelling, the regressions and each figure) runs inside stage(). Nothing is measured until a StageRecorder
+is started. While one is active, every call records its wall time, CPU time, rows in and out, the change in resident
+memory and the peak resident memory. Each record is logged as one JSON line on the 'fl_carbon.stages' logger, and
+summary() adds the records up per stage. The filters also report how many pixels they dropped and why (record_drops),
+which drop_summary() lists per stage and reason.
+
+A recorder can also run cProfile or tracemalloc on chosen stages. from_environment() reads these options from
+environment variables, so a run can be profiled without editing the analysis script:
+
+    FL_PROFILE=filter_agb_loss,regression_quadratic  stages to run under cProfile
+    FL_TRACEMALLOC=gather                             stages to trace Python allocations for
+    FL_PROFILE_DIR=profiles                           write <stage>.prof files here instead of printing the top calls
+'''
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+LOGGER = logging.getLogger('fl_carbon.stages')
+
+#Lines of cProfile and tracemalloc output printed per stage
+TOP_LINES = 20
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+_active = None
+
+
+def current_rss_mb():
+    '''Resident memory of this process in MB, or None where it cannot be read.'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / (1 << 20)
+    except OSError:
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / (1 << 20)
+
+
+def peak_rss_mb():
+    '''Peak resident memory of this process in MB, since the last reset where the system allows one.'''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on macOS and in KB elsewhere
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def reset_peak_rss():
+    '''Reset the peak resident memory of this process. Only Linux can do this, elsewhere it returns False.'''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _count(rows):
+    if rows is None:
+        return None
+    if isinstance(rows, np.ndarray) and rows.dtype == bool:
+        return int(np.count_nonzero(rows))
+    return int(rows)
+
+
+class StageRecord:
+    '''
+    Measurements of one call of a stage.
+
+    rows_in, and rows_out set inside the with block, are row counts or boolean masks of the rows. Masks are only
+    counted when the stage is recorded, rows_in when the stage starts and rows_out when it ends.
+    '''
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = _count(rows_in)
+        self.rows_out = None
+        self.wall_s = self.cpu_s = 0.0
+        self.rss_delta_mb = self.peak_rss_mb = None
+
+    def as_dict(self):
+        return {'stage': self.name, 'wall_s': self.wall_s, 'cpu_s': self.cpu_s, 'rows_in': self.rows_in,
+                'rows_out': self.rows_out, 'rss_delta_mb': self.rss_delta_mb, 'peak_rss_mb': self.peak_rss_mb}
+
+
+class _NullStage:
+    '''Stand-in used when no recorder is active. It accepts rows_out and does nothing else.'''
+
+    #Assignments are dropped so a mask handed to rows_out is not kept alive
+    rows_out = property(lambda self: None, lambda self, value: None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class StageRecorder:
+    '''
+    Collects a StageRecord for every stage call while it is active.
+
+    profile and trace_memory are collections of stage names to run under cProfile and tracemalloc. A stage that
+    runs once per window accumulates one profile over all its calls. With track_peak, the peak resident memory is
+    reset at the start of each stage (Linux only), so peak_rss_mb is the peak of that stage rather than of the run.
+    '''
+
+    def __init__(self, profile=(), trace_memory=(), profile_dir=None, track_peak=True):
+        self.records = []
+        self.profile = set(profile)
+        self.trace_memory = set(trace_memory)
+        self.profile_dir = profile_dir
+        self.track_peak = track_peak
+        self.peak_rss_reset = track_peak and reset_peak_rss()
+        self._profiles = {}
+        self._allocations = {}
+        self.drops = {}
+        self._drops_lock = threading.Lock()
+        #Stages can run on several threads at once, each thread has its own stack of open stages
+        self._local = threading.local()
+
+    @property
+    def _open(self):
+        if not hasattr(self._local, 'open'):
+            self._local.open = []
+        return self._local.open
+
+    @classmethod
+    def from_environment(cls, environ=None):
+        '''A recorder with the FL_PROFILE, FL_TRACEMALLOC and FL_PROFILE_DIR options of the environment.'''
+        environ = os.environ if environ is None else environ
+
+        def names(key):
+            return [name.strip() for name in environ.get(key, '').split(',') if name.strip()]
+        return cls(profile=names('FL_PROFILE'), trace_memory=names('FL_TRACEMALLOC'),
+                   profile_dir=environ.get('FL_PROFILE_DIR') or None)
+
+    def _fold_peak(self):
+        #A nested stage resets the peak, so the open stages take the peak so far first
+        peak = peak_rss_mb()
+        for record in self._open:
+            record.peak_rss_mb = max(record.peak_rss_mb or 0.0, peak)
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        record = StageRecord(name, rows_in)
+        profiler = self._profiles.setdefault(name, cProfile.Profile()) if name in self.profile else None
+        snapshot = None
+        if name in self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            snapshot = tracemalloc.take_snapshot()
+        if self.track_peak:
+            self._fold_peak()
+            self.peak_rss_reset = reset_peak_rss() and self.peak_rss_reset
+        self._open.append(record)
+        rss = current_rss_mb()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record.wall_s = time.perf_counter() - wall
+            record.cpu_s = time.process_time() - cpu
+            after = current_rss_mb()
+            if rss is not None and after is not None:
+                record.rss_delta_mb = after - rss
+            if self.track_peak:
+                self._fold_peak()
+            self._open.pop()
+            if snapshot is not None:
+                self._add_allocations(name, tracemalloc.take_snapshot().compare_to(snapshot, 'lineno'))
+            record.rows_out = _count(record.rows_out)
+            self.records.append(record)
+            if LOGGER.isEnabledFor(logging.INFO):
+                LOGGER.info(json.dumps(record.as_dict()))
+
+    def _add_allocations(self, name, differences):
+        totals = self._allocations.setdefault(name, {})
+        for stat in differences:
+            frame = stat.traceback[0]
+            key = '%s:%d' % (frame.filename, frame.lineno)
+            size, count = totals.get(key, (0, 0))
+            totals[key] = (size + stat.size_diff, count + stat.count_diff)
+
+    def add_drops(self, name, counts):
+        '''Add the pixels a stage dropped, a dict from reason to count.'''
+        with self._drops_lock:
+            for reason, count in counts.items():
+                if count:
+                    self.drops[(name, reason)] = self.drops.get((name, reason), 0) + count
+
+    def drop_summary(self):
+        '''One row per stage and reason with the pixels dropped, in the order they were first dropped.'''
+        rows = [{'stage': name, 'reason': reason, 'pixels': count} for (name, reason), count in self.drops.items()]
+        return pd.DataFrame(rows, columns=['stage', 'reason', 'pixels'])
+
+    def add_records(self, records):
+        '''Add records measured elsewhere, for example in a worker process.'''
+        self.records.extend(records)
+
+    def summary(self):
+        '''
+        One row per stage in the order the stages first ran: the number of calls, the total wall and CPU time, rows
+        in and out, the total change in resident memory and the highest peak.
+        '''
+        columns = ['calls', 'wall_s', 'cpu_s', 'rows_in', 'rows_out', 'rss_delta_mb', 'peak_rss_mb']
+        if not self.records:
+            return pd.DataFrame(columns=columns)
+        table = pd.DataFrame([record.as_dict() for record in self.records])
+        table[['rows_in', 'rows_out', 'rss_delta_mb', 'peak_rss_mb']] = \
+            table[['rows_in', 'rows_out', 'rss_delta_mb', 'peak_rss_mb']].astype(np.float64)
+        grouped = table.groupby('stage', sort=False)
+        summary = grouped[['wall_s', 'cpu_s']].sum()
+        summary.insert(0, 'calls', grouped.size())
+        for column in ['rows_in', 'rows_out', 'rss_delta_mb']:
+            summary[column] = grouped[column].sum(min_count=1)
+        summary['peak_rss_mb'] = grouped['peak_rss_mb'].max()
+        return summary[columns]
+
+    def report(self, stream=None):
+        '''Write the profiles and the allocation traces of the chosen stages, then the summary table.'''
+        stream = stream or sys.stdout
+        for name, profiler in self._profiles.items():
+            if self.profile_dir:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                path = os.path.join(self.profile_dir, '%s.prof' % name)
+                profiler.dump_stats(path)
+                stream.write('Profile of %s written to %s\n' % (name, path))
+            else:
+                text = io.StringIO()
+                pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(TOP_LINES)
+                stream.write('Profile of %s:\n%s\n' % (name, text.getvalue()))
+        for name, totals in self._allocations.items():
+            stream.write('Largest allocations in %s:\n' % name)
+            top = sorted(totals.items(), key=lambda item: -abs(item[1][0]))[:TOP_LINES]
+            for key, (size, count) in top:
+                stream.write('  %s: %+.1f KB in %+d blocks\n' % (key, size / 1024, count))
+        stream.write(self.summary().to_string(float_format=lambda v: '%.3f' % v) + '\n')
+        if self.drops:
+            stream.write('Pixels dropped:\n' + self.drop_summary().to_string(index=False) + '\n')
+
+
+def active_recorder():
+    '''The recorder stages are reported to, or None.'''
+    return _active
+
+
+def start_recording(recorder=None):
+    '''Make recorder (a new StageRecorder by default) the active one and return it.'''
+    global _active
+    _active = recorder if recorder is not None else StageRecorder()
+    return _active
+
+
+def stop_recording():
+    '''Stop recording stages and return the recorder that was active.'''
+    global _active
+    recorder, _active = _active, None
+    return recorder
+
+
+@contextmanager
+def recording(recorder=None):
+    '''Record every stage run inside the with block.'''
+    previous = _active
+    recorder = start_recording(recorder)
+    try:
+        yield recorder
+    finally:
+        if previous is None:
+            stop_recording()
+        else:
+            start_recording(previous)
+
+
+def record_drops(record, reasons):
+    '''
+    Report the pixels a stage dropped, by reason, to the active recorder.
+
+    record is the record of the stage, from the with statement. reasons is either one reason for every pixel the stage
+    dropped (rows_in - rows_out), or a dict from reason to a count or a mask of the pixels dropped for it.
+    '''
+    if _active is None or not isinstance(record, StageRecord):
+        return
+    if isinstance(reasons, str):
+        reasons = {reasons: record.rows_in - record.rows_out}
+    _active.add_drops(record.name, {reason: _count(count) for reason, count in reasons.items()})
+
+
+def stage(name, rows_in=None):
+    '''Context manager around one stage. Costs next to nothing when no recorder is active.'''
+    if _active is None:
+        return _NULL_STAGE
+    return _active.stage(name, rows_in)
@@ -0,0 +1,322 @@
+'''
+Lazy, chunked execution of the Part 1 cleaning and the Part 3 group statistics.
+
+The streaming reader keeps the raster read small, but the cleaned table itself still has to fit in memory before the
+counts, per-age summaries and regressions are computed from it. In lazy mode the table is never built. A LazyScene
+splits the scene into chunks of rows, and each result asked of it (severity counts, an age summary, a regression)
+is only a description of a reduction. compute() then runs one task per chunk: the chunk is read and cleaned, and
+every reduction turns it into a small partial result (counts, sums, sufficient statistics). The partials are added
+up as the tasks finish and only the final, small results are materialised.
+
+Chunks run in parallel on a pool of threads (the default, NumPy and the TIFF decoder release the GIL for most of
+the work) or processes. Peak memory is about one chunk per worker, whatever the size of the scene.
+
+    scene = LazyScene('data/florida', chunk_rows=4096)
+    counts, summary, results = compute(scene.severity_counts(), scene.age_summary(), scene.regression(),
+                                       scheduler='threads', workers=8)
+
+Group columns of the statistics must be categoricals (Severity_Label, Forest_Type), so every chunk numbers the groups
+the same way. With the PIL backend, compressed layers cannot be read by window and are decoded whole by every chunk,
+so use the tifffile or rasterio backend (readers.py) for compressed inputs.
+'''
+
+import abc
+import argparse
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from . import settings
+from .instrument import stage
+from .filters import burn_year_lut, forest_lut
+from .raster import filter_window, iter_windows, open_layers
+from .readers import BACKENDS
+from .regression import MODELS, RESPONSES, _group_codes, _results_table, add_moments, group_moments
+from .validity import layer_nodata
+
+#Raster rows in each chunk task
+CHUNK_ROWS = 4096
+
+#Burn_Scar_Age is centred on this value before the regression sums are collected, to keep the sums of x^4 well
+#conditioned. The mean used by batch_regression is not known until the whole scene has been read.
+AGE_SHIFT = 10.0
+
+
+class LazyScene:
+    '''
+    A scene on disk with the settings of the Part 1 cleaning, split into chunks of rows.
+
+    The layers are opened once on each thread (or worker process) which reads chunks, not once per chunk. Open layers
+    are not pickled with the scene, a process opens its own.
+    '''
+
+    def __init__(self, directory, chunk_rows=CHUNK_ROWS, window_rows=settings.WINDOW_ROWS,
+                 excluded_years=settings.EXCLUDED_BURN_YEARS, forest_code=settings.LONGLEAF_SLASH_PINE, drop_low=True,
+                 cut_bins=settings.CUT_BINS, bs_labels=settings.BS_LABELS, rows=None, backend=settings.RASTER_BACKEND):
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.window_rows = min(window_rows, chunk_rows)
+        self.backend = backend
+        self.year_lut = burn_year_lut(excluded_years)
+        self.type_lut = forest_lut(forest_code)
+        self.options = {'drop_low': drop_low, 'cut_bins': cut_bins, 'bs_labels': bs_labels}
+        self._local = threading.local()
+        height = next(iter(self.layers().values())).shape[0]
+        first, last = rows or (0, height)
+        self.rows = (first, min(last, height))
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def layers(self):
+        '''The open layers of the scene, opened the first time the calling thread asks for them.'''
+        #A forked worker inherits the handles of the parent, and reads through them would share its file offsets
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.pid = os.getpid()
+            self._local.layers = open_layers(self.directory, backend=self.backend)
+            self._local.nodata = layer_nodata(self._local.layers)
+        return self._local.layers
+
+    def chunks(self):
+        '''(first row, last row) of every chunk, in order.'''
+        first, last = self.rows
+        return [(row0, min(row0 + self.chunk_rows, last)) for row0 in range(first, last, self.chunk_rows)]
+
+    def read_chunk(self, rows):
+        '''The cleaned pixel table of one chunk, with the rows without a severity label dropped.'''
+        layers = self.layers()
+        parts = [filter_window(start, window, self.year_lut, self.type_lut, nodata=self._local.nodata, **self.options)
+                 for start, window in iter_windows(layers, self.window_rows, rows)]
+        FL_Data = pd.concat(parts)
+        return FL_Data[FL_Data['Severity_Label'].notna()]
+
+    def severity_counts(self):
+        return SeverityCounts(self)
+
+    def age_summary(self, by=('Severity_Label',), x='Burn_Scar_Age', responses=RESPONSES):
+        return AgeSummary(self, by, x, responses)
+
+    def regression(self, by=('Severity_Label',), responses=RESPONSES, x='Burn_Scar_Age', models=MODELS,
+                   test_size=None, random_state=0):
+        return Regression(self, by, responses, x, models, test_size, random_state)
+
+
+class Reduction(abc.ABC):
+    '''
+    A result computed chunk by chunk: partial() turns one chunk into a small partial result, combine() adds two
+    partials together and finalize() turns the total into the result.
+    '''
+
+    def __init__(self, scene):
+        self.scene = scene
+
+    @abc.abstractmethod
+    def partial(self, FL_Data, chunk):
+        '''The partial result of the cleaned table of one chunk.'''
+
+    @abc.abstractmethod
+    def combine(self, a, b):
+        '''Two partial results added together.'''
+
+    def finalize(self, total):
+        return total
+
+
+class SeverityCounts(Reduction):
+    '''Number of pixels for each Severity_Label.'''
+
+    def partial(self, FL_Data, chunk):
+        return FL_Data['Severity_Label'].value_counts(sort=False)
+
+    def combine(self, a, b):
+        return a.add(b, fill_value=0).astype(np.int64)
+
+
+def _check_categorical(FL_Data, by):
+    for name in by:
+        if not isinstance(FL_Data[name].dtype, pd.CategoricalDtype):
+            raise ValueError('Lazy group statistics need categorical group columns, %s is %s'
+                             % (name, FL_Data[name].dtype))
+
+
+class AgeSummary(Reduction):
+    '''
+    The age_summary table: pixel count, mean and ddof=0 variance of every response, per group and value of x.
+
+    Each chunk gives counts, means and sums of squared deviations, which are merged with the parallel variance
+    formula of Chan et al., so no precision is lost to large sums of squares.
+    '''
+
+    def __init__(self, scene, by, x, responses):
+        super().__init__(scene)
+        self.by, self.x, self.responses = list(by), x, list(responses)
+
+    def partial(self, FL_Data, chunk):
+        keys = self.by + [self.x]
+        data = FL_Data[keys].copy()
+        for response in self.responses:
+            data[response] = FL_Data[response].to_numpy(dtype=np.float64)
+        grouped = data.groupby(keys, observed=True, sort=False)[self.responses]
+        means = grouped.mean()
+        m2 = grouped.var(ddof=0).mul(grouped.size(), axis=0)
+        return grouped.size().rename('count'), means, m2
+
+    def combine(self, a, b):
+        (n_a, mean_a, m2_a), (n_b, mean_b, m2_b) = a, b
+        index = n_a.index.union(n_b.index)
+        n_a, n_b = n_a.reindex(index, fill_value=0), n_b.reindex(index, fill_value=0)
+        mean_a, mean_b = mean_a.reindex(index, fill_value=0.0), mean_b.reindex(index, fill_value=0.0)
+        m2_a, m2_b = m2_a.reindex(index, fill_value=0.0), m2_b.reindex(index, fill_value=0.0)
+        n = n_a + n_b
+        weight = (n_b / n.where(n > 0, 1)).to_numpy()[:, None]
+        delta = mean_b - mean_a
+        mean = mean_a + delta * weight
+        m2 = m2_a + m2_b + delta ** 2 * (n_a.to_numpy()[:, None] * weight)
+        return n, mean, m2
+
+    def finalize(self, total):
+        n, mean, m2 = total
+        variances = m2.div(n, axis=0)
+        summary = pd.concat([n, mean.add_suffix('_mean'), variances.add_suffix('_var')], axis=1).sort_index()
+        return summary.reset_index()
+
+
+class Regression(Reduction):
+    '''
+    The batch_regression table, from the sufficient statistics of every chunk added together.
+
+    With test_size, rows are held out at random with a generator seeded by random_state and the chunk, so the split
+    is the same on every run but not the same rows as batch_regression would hold out.
+    '''
+
+    def __init__(self, scene, by, responses, x, models, test_size, random_state, shift=AGE_SHIFT):
+        super().__init__(scene)
+        self.by, self.responses, self.x, self.models = list(by), list(responses), x, dict(models)
+        self.test_size, self.random_state, self.shift = test_size, random_state, shift
+
+    def partial(self, FL_Data, chunk):
+        _check_categorical(FL_Data, self.by)
+        codes, groups = _group_codes(FL_Data, self.by)
+        Y = FL_Data[self.responses].to_numpy(dtype=np.float64)
+        xc = FL_Data[self.x].to_numpy(dtype=np.float64) - self.shift
+        degree = max(self.models.values())
+        full = group_moments(xc, Y, codes, len(groups), degree)
+        if not self.test_size:
+            return groups, full, full, full
+        held_out = np.random.default_rng([self.random_state, chunk[0]]).random(len(codes)) < self.test_size
+        train = group_moments(xc, Y, np.where(held_out, -1, codes), len(groups), degree)
+        test = group_moments(xc, Y, np.where(held_out, codes, -1), len(groups), degree)
+        return groups, full, train, test
+
+    def combine(self, a, b):
+        return (a[0],) + tuple(add_moments(x, y) for x, y in zip(a[1:], b[1:]))
+
+    def finalize(self, total):
+        groups, full, train, test = total
+        if not self.test_size:
+            train = test = full
+        return _results_table(groups, full, train, test, self.models, self.responses, self.shift)
+
+
+#The scene of a worker process, passed once when the process starts so its layers stay open between chunks
+_worker_scene = None
+
+
+def _set_worker_scene(scene):
+    global _worker_scene
+    _worker_scene = scene
+
+
+def _run_chunk(task):
+    '''Read and clean one chunk and compute every partial result from it. Runs on a worker.'''
+    scene, chunk, reductions = task
+    scene = scene if scene is not None else _worker_scene
+    with stage('lazy_chunk', rows_in=(chunk[1] - chunk[0])) as s:
+        FL_Data = scene.read_chunk(chunk)
+        s.rows_out = len(FL_Data)
+        return [reduction.partial(FL_Data, chunk) for reduction in reductions]
+
+
+def compute(*reductions, scheduler='threads', workers=None):
+    '''
+    Compute the results of one or more reductions of the same scene in a single pass over its chunks.
+
+    scheduler is 'threads', 'processes' or 'sync' (one chunk after another in this process). Returns one result per
+    reduction, in order.
+    '''
+    if not reductions:
+        return []
+    scene = reductions[0].scene
+    if any(reduction.scene is not scene for reduction in reductions):
+        raise ValueError('All reductions computed together must come from the same LazyScene')
+    tasks = [(scene, chunk, reductions) for chunk in scene.chunks()]
+    if not tasks:
+        raise ValueError('No raster rows were read from %s' % scene.directory)
+
+    totals = None
+
+    def add(partials):
+        nonlocal totals
+        if totals is None:
+            totals = partials
+        else:
+            totals = [reduction.combine(a, b) for reduction, a, b in zip(reductions, totals, partials)]
+
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if scheduler == 'sync' or workers == 1:
+        for task in tasks:
+            add(_run_chunk(task))
+    elif scheduler in ('threads', 'processes'):
+        if scheduler == 'threads':
+            executor = ThreadPoolExecutor(max_workers=workers)
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_set_worker_scene, initargs=(scene,))
+            tasks = [(None, chunk, reductions) for _, chunk, reductions in tasks]
+        with executor as pool:
+            #Partials are added in the order they finish, so only a few are held at once
+            for future in as_completed([pool.submit(_run_chunk, task) for task in tasks]):
+                add(future.result())
+    else:
+        raise ValueError("scheduler must be 'threads', 'processes' or 'sync', not %r" % scheduler)
+
+    with stage('lazy_finalize'):
+        return [reduction.finalize(total) for reduction, total in zip(reductions, totals)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compute the severity counts, age summary and regressions of a scene '
+                                                 'chunk by chunk, without building the pixel table.')
+    parser.add_argument('directory', help='folder with the eight TIFFs')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='raster rows in each chunk task')
+    parser.add_argument('--scheduler', choices=['threads', 'processes', 'sync'], default='threads')
+    parser.add_argument('--workers', type=int, default=None, help='defaults to the number of cores')
+    parser.add_argument('--backend', choices=['auto'] + list(BACKENDS), default=settings.RASTER_BACKEND,
+                        help='raster reader')
+    parser.add_argument('--test-size', type=float, default=0.4, help='share of pixels held out to test the models')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the held out pixels')
+    parser.add_argument('--out-prefix', default='Lazy_', help='prefix of the CSV files written')
+    args = parser.parse_args(argv)
+
+    scene = LazyScene(args.directory, chunk_rows=args.chunk_rows, backend=args.backend)
+    counts, summary, results = compute(scene.severity_counts(), scene.age_summary(),
+                                       scene.regression(test_size=args.test_size, random_state=args.seed),
+                                       scheduler=args.scheduler, workers=args.workers)
+    print(counts)
+    counts.rename('count').to_csv(args.out_prefix + 'Severity_Counts.csv')
+    summary.to_csv(args.out_prefix + 'Age_Summary.csv', index=False)
+    results.to_csv(args.out_prefix + 'Regressions.csv', index=False)
+    print('Wrote %sSeverity_Counts.csv, %sAge_Summary.csv and %sRegressions.csv'
+          % (args.out_prefix, args.out_prefix, args.out_prefix))
+
+
+if __name__ == '__main__':
+    main()
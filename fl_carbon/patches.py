@@ -0,0 +1,286 @@
+'''
+Burn patches: contiguous fire events and their statistics.
+
+Every pixel of the pixel table is analysed on its own, although the pixels of one fire share its date, its weather
+and mostly its severity. Here the Burn_Year raster is split into patches, groups of touching pixels which burned in
+the same year, so the analysis can also run with one row per fire event:
+
+    FL_Data, Patches = label_patches('.', FL_Data, erode=1)
+    Events = patch_table(FL_Data, Patches)
+    Event_Results = event_regression(Events)
+
+label_patches walks the Burn_Year layer in bands of rows like the streaming reader. Each band is labelled with
+scipy.ndimage, one burn year at a time, and the labels of touching pixels on either side of a band boundary are
+joined afterwards as the connected components of a small graph, so only one band of the layer is in memory at once.
+Every patch gets its area, its perimeter and the share of its pixels on the edge. The pixel table gets a Patch_ID
+column. With erode, pixels within that many pixels of the patch edge are dropped from the table, a cleaner way to
+leave out the edge pixels than the AGB loss filter.
+
+patch_table then averages the pixels of the table kept in each patch, and event_regression fits the recovery models
+to that table, with one row per fire instead of one per pixel.
+'''
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import ndimage, sparse
+from scipy.sparse.csgraph import connected_components
+
+from . import settings
+from .instrument import stage
+from .raster import read_pixel_table
+from .readers import BACKENDS, open_layer
+from .regression import MODELS, RESPONSES, batch_regression
+from .table import severity_label_column
+
+#Burn_Year code of pixels which did not burn
+NO_FIRE = 0
+
+#Value given to the pixels around the scene, so the scene border counts as a patch edge
+OUTSIDE = -1
+
+#Columns of the pixel table averaged over each patch
+PATCH_MEANS = ['Burn_Severity', 'AGB_2010', 'NEP_2010', 'NEP_Change']
+
+
+def _label_band(years, structure):
+    '''
+    Label the patches of one band. Returns the labels (from 1) and the burn year code of each.
+
+    The burned pixels are labelled in one pass. Only the few groups which hold more than one burn year, fires of
+    different years side by side, are split again year by year, inside their bounding box.
+    '''
+    labels, n = ndimage.label(years != NO_FIRE, structure)
+    if n == 0:
+        return labels, np.empty(0, dtype=np.int64)
+    low = np.full(n + 1, np.iinfo(years.dtype).max, dtype=years.dtype)
+    high = np.full(n + 1, -1, dtype=years.dtype)
+    np.minimum.at(low, labels.ravel(), years.ravel())
+    np.maximum.at(high, labels.ravel(), years.ravel())
+    codes = list(low[1:])
+    mixed = np.flatnonzero(low[1:] != high[1:])
+    if len(mixed):
+        boxes = ndimage.find_objects(labels)
+        for k in mixed:
+            box = labels[boxes[k]]
+            group = box == k + 1
+            sub = years[boxes[k]]
+            for i, code in enumerate(np.unique(sub[group])):
+                patch, m = ndimage.label(group & (sub == code), structure)
+                #The first patch keeps the number of the group, the others get new numbers
+                numbers = np.concatenate([[0, k + 1], len(codes) + 1 + np.arange(m - 1)]) if i == 0 else \
+                    np.concatenate([[0], len(codes) + 1 + np.arange(m)])
+                box[patch > 0] = numbers[patch[patch > 0]]
+                if i == 0:
+                    codes[k] = code
+                    m -= 1
+                codes.extend([code] * m)
+    return labels, np.array(codes, dtype=np.int64)
+
+
+def _band_pairs(above, below, years_above, years_below, connectivity):
+    '''Labels of touching pixels of the same year across a band boundary, as (above, below) pairs.'''
+    pairs = [(above, below, years_above == years_below)]
+    if connectivity == 8:
+        pairs.append((above[:-1], below[1:], years_above[:-1] == years_below[1:]))
+        pairs.append((above[1:], below[:-1], years_above[1:] == years_below[:-1]))
+    a = np.concatenate([x[same & (x >= 0) & (y >= 0)] for x, y, same in pairs])
+    b = np.concatenate([y[same & (x >= 0) & (y >= 0)] for x, y, same in pairs])
+    return a, b
+
+
+def label_patches(directory, FL_Data, window_rows=settings.WINDOW_ROWS, connectivity=4, erode=0,
+                  backend=settings.RASTER_BACKEND):
+    '''
+    Find the burn patches of a scene and the patch of every pixel of the pixel table.
+
+    connectivity is 4 (edges) or 8 (edges and corners). With erode, pixels of the table with a pixel of another
+    burn year, an unburned pixel or the scene border within erode pixels (diagonals included) are dropped.
+
+    Returns the pixel table with a Patch_ID column, and a table of the patches: Patch_ID, Burn_Year, Date, Pixels,
+    Area_ha, Perimeter_m, Edge_Pixels, Edge_Fraction and the coordinates of the centre, Centroid_X and Centroid_Y.
+    Area and perimeter count every burned pixel, not only the ones kept in the pixel table.
+    '''
+    if connectivity not in (4, 8):
+        raise ValueError('connectivity must be 4 or 8, not %r' % connectivity)
+    layer = open_layer(os.path.join(directory, settings.LAYER_FILES['Burn_Year']), backend)
+    height, width = layer.shape
+    structure = ndimage.generate_binary_structure(2, 1 if connectivity == 4 else 2)
+    halo = max(erode, 1)
+
+    index = FL_Data.index.to_numpy()
+    order = None if FL_Data.index.is_monotonic_increasing else np.argsort(index, kind='stable')
+    flat = index if order is None else index[order]
+    node = np.empty(len(flat), dtype=np.int64)
+    interior = np.ones(len(flat), dtype=bool)
+
+    codes, firsts, areas, faces, edges, row_sums, col_sums = [], [], [], [], [], [], []
+    pair_a, pair_b = [], []
+    base = 0
+    last = None
+    with stage('patch_label', rows_in=height * width) as s:
+        for row0 in range(0, height, window_rows):
+            row1 = min(row0 + window_rows, height)
+            #The band with halo rows above and below it, and the outside value around the scene
+            top, bottom = max(row0 - halo, 0), min(row1 + halo, height)
+            ext = np.full((row1 - row0 + 2 * halo, width + 2 * halo), OUTSIDE, dtype=np.int32)
+            ext[halo - (row0 - top):halo + (row1 - row0) + (bottom - row1), halo:halo + width] = \
+                layer.read_rows(top, bottom)
+            n = row1 - row0
+            years = ext[halo:halo + n, halo:halo + width]
+            if years.min() < 0:
+                raise ValueError('Burn_Year holds negative codes')
+
+            labels, band_codes = _label_band(years, structure)
+            local = labels.ravel()
+            size = len(band_codes) + 1
+
+            #Sides of each burned pixel which touch a pixel of another year, unburned or outside the scene
+            side = np.zeros(years.shape, dtype=np.int8)
+            for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+                side += ext[halo + dr:halo + dr + n, halo + dc:halo + dc + width] != years
+            side[years == NO_FIRE] = 0
+
+            rows = np.broadcast_to(np.arange(row0, row1, dtype=np.float64)[:, None], years.shape).ravel()
+            cols = np.broadcast_to(np.arange(width, dtype=np.float64)[None, :], years.shape).ravel()
+            codes.append(band_codes)
+            first = np.full(size, np.iinfo(np.int64).max)
+            np.minimum.at(first, local, np.arange(row0 * width, row1 * width))
+            firsts.append(first[1:])
+            areas.append(np.bincount(local, minlength=size)[1:])
+            faces.append(np.bincount(local, weights=side.ravel(), minlength=size)[1:])
+            edges.append(np.bincount(local, weights=(side.ravel() > 0), minlength=size)[1:])
+            row_sums.append(np.bincount(local, weights=rows, minlength=size)[1:])
+            col_sums.append(np.bincount(local, weights=cols, minlength=size)[1:])
+
+            #Provisional patch numbers over the whole scene, from 0, and -1 for unburned pixels
+            numbered = np.where(labels > 0, labels.astype(np.int64) + base - 1, -1)
+            if last is not None:
+                a, b = _band_pairs(last[0], numbered[0], last[1], years[0], connectivity)
+                pair_a.append(a)
+                pair_b.append(b)
+            last = (numbered[-1].copy(), years[-1].copy())
+
+            lo, hi = np.searchsorted(flat, [row0 * width, row1 * width])
+            r, c = np.divmod(flat[lo:hi] - row0 * width, width)
+            node[lo:hi] = numbered[r, c]
+            if erode:
+                same = (ndimage.minimum_filter(ext, size=2 * erode + 1, mode='nearest') ==
+                        ndimage.maximum_filter(ext, size=2 * erode + 1, mode='nearest'))
+                interior[lo:hi] = same[halo + r, halo + c]
+            base += len(band_codes)
+        s.rows_out = base
+
+    with stage('patch_join', rows_in=base) as s:
+        a = np.concatenate(pair_a) if pair_a else np.empty(0, dtype=np.int64)
+        b = np.concatenate(pair_b) if pair_b else np.empty(0, dtype=np.int64)
+        graph = sparse.coo_matrix((np.ones(len(a), dtype=np.int8), (a, b)), shape=(base, base))
+        n_patches, patch = connected_components(graph, directed=False)
+        #Patches are numbered in the order of their first pixel, so the numbers do not depend on the window size
+        first = np.full(n_patches, np.iinfo(np.int64).max)
+        np.minimum.at(first, patch, np.concatenate(firsts))
+        rank = np.empty(n_patches, dtype=np.int64)
+        rank[np.argsort(first, kind='stable')] = np.arange(n_patches)
+        patch = rank[patch]
+        s.rows_out = n_patches
+
+        def total(parts):
+            return np.bincount(patch, weights=np.concatenate(parts), minlength=n_patches)
+
+        pixels = total(areas)
+        year = np.zeros(n_patches, dtype=np.int64)
+        year[patch] = np.concatenate(codes)
+        gt = layer.geotransform or (0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
+        Patches = pd.DataFrame({
+            'Patch_ID': np.arange(n_patches, dtype=np.int32),
+            'Burn_Year': year.astype(np.int16),
+            'Date': (year + settings.BURN_YEAR_ORIGIN).astype(np.int16),
+            'Pixels': pixels.astype(np.int64),
+            'Area_ha': pixels * abs(gt[1] * gt[5]) / 1e4 if layer.geotransform else np.nan,
+            'Perimeter_m': total(faces) * abs(gt[1]) if layer.geotransform else np.nan,
+            'Edge_Pixels': total(edges).astype(np.int64),
+            'Edge_Fraction': total(edges) / pixels,
+            'Centroid_X': gt[0] + (total(col_sums) / pixels + 0.5) * gt[1],
+            'Centroid_Y': gt[3] + (total(row_sums) / pixels + 0.5) * gt[5],
+        })
+
+        patch_id = np.where(node >= 0, patch[np.maximum(node, 0)], -1).astype(np.int32)
+        if order is not None:
+            unsorted = np.empty_like(patch_id)
+            unsorted[order] = patch_id
+            patch_id = unsorted
+            keep = np.empty_like(interior)
+            keep[order] = interior
+            interior = keep
+        FL_Data = FL_Data.assign(Patch_ID=patch_id)
+        if erode:
+            FL_Data = FL_Data[interior]
+    return FL_Data, Patches
+
+
+def patch_table(FL_Data, Patches, columns=PATCH_MEANS, cut_bins=settings.CUT_BINS, bs_labels=settings.BS_LABELS):
+    '''
+    One row per fire event: the patch statistics and the mean of every column over the pixels of the patch kept in
+    the pixel table.
+
+    Table_Pixels is the number of those pixels and Burn_Scar_Age the age of the patch. Severity_Label is the
+    severity bin of the mean Burn_Severity. Patches without any pixels in the table are left out.
+    '''
+    with stage('patch_table', rows_in=len(FL_Data)) as s:
+        data = FL_Data[list(columns)].astype(np.float64)
+        grouped = data.groupby(FL_Data['Patch_ID'].to_numpy(), sort=True)
+        means = grouped.mean()
+        means.insert(0, 'Table_Pixels', grouped.size())
+        means.insert(1, 'Burn_Scar_Age', FL_Data['Burn_Scar_Age'].groupby(FL_Data['Patch_ID'].to_numpy()).first())
+        Events = Patches.join(means, on='Patch_ID', how='inner')
+        if 'Burn_Severity' in Events:
+            Events['Severity_Label'] = severity_label_column(Events['Burn_Severity'].to_numpy(), cut_bins, bs_labels)
+        s.rows_out = len(Events)
+    return Events.reset_index(drop=True)
+
+
+def event_regression(Events, by=('Severity_Label',), responses=RESPONSES, x='Burn_Scar_Age', models=MODELS,
+                     min_pixels=1, test_size=None, random_state=None):
+    '''
+    Fit the recovery models to the fire events of patch_table, one row per event.
+
+    Events with fewer than min_pixels pixels in the pixel table are left out, so small slivers do not count as much
+    as whole fires. The results table is the same as batch_regression's, with n the number of events.
+    '''
+    Events = Events[Events['Table_Pixels'] >= min_pixels]
+    return batch_regression(Events, by=by, responses=responses, x=x, models=models, test_size=test_size,
+                            random_state=random_state)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Label the burn patches of a scene and fit the recovery models '
+                                                 'with one row per fire event.')
+    parser.add_argument('directory', help='folder with the eight TIFFs')
+    parser.add_argument('--connectivity', type=int, choices=[4, 8], default=4, help='pixels touching by edges (4) '
+                                                                                     'or also by corners (8)')
+    parser.add_argument('--erode', type=int, default=0, help='drop pixels this close to the edge of their patch')
+    parser.add_argument('--min-pixels', type=int, default=1, help='smallest event used in the regressions')
+    parser.add_argument('--backend', choices=['auto'] + list(BACKENDS), default=settings.RASTER_BACKEND,
+                        help='raster reader')
+    parser.add_argument('--out-prefix', default='', help='prefix of the CSV files written')
+    args = parser.parse_args(argv)
+
+    FL_Data = read_pixel_table(args.directory, backend=args.backend)
+    FL_Data = FL_Data[FL_Data['Severity_Label'].notna()]
+    FL_Data, Patches = label_patches(args.directory, FL_Data, connectivity=args.connectivity, erode=args.erode,
+                                     backend=args.backend)
+    Events = patch_table(FL_Data, Patches)
+    results = event_regression(Events, min_pixels=args.min_pixels)
+    print('%d patches, %d with pixels in the table' % (len(Patches), len(Events)))
+    print(results.to_string(index=False))
+    Patches.to_csv(args.out_prefix + 'Patches.csv', index=False)
+    Events.to_csv(args.out_prefix + 'Fire_Events.csv', index=False)
+    results.to_csv(args.out_prefix + 'Event_Regressions.csv', index=False)
+    print('Wrote %sPatches.csv, %sFire_Events.csv and %sEvent_Regressions.csv'
+          % (args.out_prefix, args.out_prefix, args.out_prefix))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+'''
+Headless rendering of the figures.
+
+Every figure is a pure function of the cleaned table (or of the per-age summary and the regression results). Each
+one draws on its own matplotlib Figure without pyplot, so nothing depends on an inline notebook backend. The
+figure is saved and released straight away. render_figures and render_diagnostics draw the figures concurrently in
+worker processes. Each figure is a stage named figure:<file>, and the stages measured in the workers are handed back
+to the active recorder.
+
+Scatter layers with more than max_points markers are drawn as density plots instead, so a large scene does not
+draw hundreds of thousands of markers. Hexbins are used for AGB vs NEP and 2D histograms for the burn scar age panels.
+'''
+
+import hashlib
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from matplotlib.colors import LinearSegmentedColormap
+from matplotlib.figure import Figure
+
+from . import instrument
+from .classify import category_mask
+from .regression import predict
+
+#Scatter layers with more points than this are density binned
+MAX_POINTS = 50000
+
+AGE_TICKS = range(0, 20)
+AGE_LABEL = 'Burn Scar Age (Years)'
+AGB_LABEL = 'Aboveground Biomass at 2010 (Kg-C per M-2)'
+NEP_LABEL = 'Net Ecosystem Productivity at 2010 (g-C per M-2)'
+RESPONSE_LABELS = {'AGB_2010': ('AGB', AGB_LABEL), 'NEP_2010': ('NEP', NEP_LABEL)}
+
+
+def _severities(data):
+    '''Severity labels which have pixels, in category order.'''
+    counts = data['Severity_Label'].value_counts(sort=False)
+    return [label for label in data['Severity_Label'].cat.categories if counts.get(label, 0) > 0]
+
+
+def _colors(labels):
+    return dict(zip(labels, sns.color_palette('muted', len(labels))))
+
+
+def _density_cmap(color):
+    return LinearSegmentedColormap.from_list('density', ['white', color])
+
+
+def _save(fig, path):
+    fig.tight_layout()
+    fig.savefig(path)
+    #Drop the artists so the memory is released even if a reference to the figure is kept
+    fig.clear()
+    return path
+
+
+def histogram_severity(data, path):
+    '''Bar chart of the number of pixels for each fire date and severity label.'''
+    labels = _severities(data)
+    colors = _colors(labels)
+    counts = data.groupby(['Date', 'Severity_Label'], observed=True).size().unstack(fill_value=0)
+    positions = np.arange(len(counts.index))
+    width = 0.8 / max(len(labels), 1)
+
+    fig = Figure()
+    ax = fig.add_subplot()
+    for i, label in enumerate(labels):
+        offset = (i - (len(labels) - 1) / 2) * width
+        ax.bar(positions + offset, counts.get(label, 0), width, color=colors[label], label=label)
+    ax.set_xticks(positions)
+    ax.set_xticklabels(counts.index, rotation=45)
+    ax.set_xlabel('Burn Severity')
+    ax.set_ylabel('Frequency')
+    ax.set_title('Pixel Frequencies for Burn Severity Categories')
+    ax.legend(title='Severiy Label')
+    return _save(fig, path)
+
+
+def scatter_agb_nep(data, path, max_points=MAX_POINTS):
+    '''Scatterplot of AGB and NEP at 2010 to examine multicollinearity, or one hexbin panel per label if large.'''
+    labels = _severities(data)
+    colors = _colors(labels)
+    title = 'Multicollinearity of AGB 2010 and NEP 2010'
+
+    if len(data) <= max_points:
+        fig = Figure()
+        ax = fig.add_subplot()
+        for label in labels:
+            group = data[category_mask(data['Severity_Label'], label)]
+            ax.scatter(group['AGB_2010'], group['NEP_2010'], s=12, color=colors[label], edgecolors='white',
+                       linewidths=.1, label=label, rasterized=True)
+        ax.set_title(title)
+        ax.set_xlabel(AGB_LABEL)
+        ax.set_ylabel(NEP_LABEL)
+        ax.legend(title='Severiy Label')
+        return _save(fig, path)
+
+    fig = Figure(figsize=(4.8 * len(labels), 4.8))
+    axes = fig.subplots(1, len(labels), sharex=True, sharey=True, squeeze=False)[0]
+    for ax, label in zip(axes, labels):
+        group = data[category_mask(data['Severity_Label'], label)]
+        ax.hexbin(group['AGB_2010'], group['NEP_2010'], gridsize=60, bins='log', mincnt=1,
+                  cmap=_density_cmap(colors[label]))
+        ax.set_title('%s (%s)' % (title, label))
+        ax.set_xlabel(AGB_LABEL)
+    axes[0].set_ylabel(NEP_LABEL)
+    return _save(fig, path)
+
+
+def facet_raw(data, response, path, max_points=MAX_POINTS):
+    '''One panel per severity label of every pixel's response against burn scar age.'''
+    labels = _severities(data)
+    colors = _colors(labels)
+    short, ylabel = RESPONSE_LABELS[response]
+
+    fig = Figure(figsize=(4 * len(labels), 4))
+    axes = fig.subplots(1, len(labels), sharex=True, sharey=True, squeeze=False)[0]
+    for ax, label in zip(axes, labels):
+        group = data[category_mask(data['Severity_Label'], label)]
+        x = group['Burn_Scar_Age'].to_numpy()
+        y = group[response].to_numpy()
+        if len(group) <= max_points:
+            ax.scatter(x, y, s=12, color=colors[label], alpha=.8, rasterized=True)
+        else:
+            #Ages are whole years, so each column of the histogram is one age
+            ax.hist2d(x, y, bins=[np.arange(-0.5, 20.5), 100], cmin=1, cmap=_density_cmap(colors[label]))
+        ax.set_xlim(0, 20)
+        ax.set_xticks(AGE_TICKS)
+        ax.set_title('%s after %s Burns' % (short, label))
+        ax.set_xlabel(AGE_LABEL)
+    axes[0].set_ylabel(ylabel)
+    return _save(fig, path)
+
+
+def facet_mean(summary, response, path):
+    '''One panel per severity label of the mean response at each burn scar age, drawn from age_summary.'''
+    labels = _severities(summary)
+    colors = _colors(labels)
+    short, ylabel = RESPONSE_LABELS[response]
+
+    fig = Figure(figsize=(4 * len(labels), 4))
+    axes = fig.subplots(1, len(labels), sharex=True, sharey=True, squeeze=False)[0]
+    for ax, label in zip(axes, labels):
+        group = summary[summary['Severity_Label'] == label]
+        ax.scatter(group['Burn_Scar_Age'], group[response + '_mean'], s=40, color=colors[label])
+        ax.set_xlim(0, 20)
+        ax.set_xticks(AGE_TICKS)
+        ax.set_title('Mean %s after %s Burns' % (short, label))
+        ax.set_xlabel(AGE_LABEL)
+    axes[0].set_ylabel(ylabel)
+    return _save(fig, path)
+
+
+def regression_diagnostics(data, row, scatter_path, residual_path, max_points=MAX_POINTS):
+    '''
+    The two diagnostic figures of one fitted model: true against predicted values, and a histogram of residuals.
+
+    row is one row of the batch_regression results, and data holds the pixels of its group.
+    '''
+    y = data[row['response']].to_numpy(dtype=np.float64)
+    predictions = predict(row, data['Burn_Scar_Age'].to_numpy(dtype=np.float64))
+
+    fig = Figure()
+    ax = fig.add_subplot()
+    if len(y) <= max_points:
+        ax.scatter(y, predictions, rasterized=True)
+    else:
+        ax.hexbin(y, predictions, gridsize=60, bins='log', mincnt=1)
+    ax.set_title('Scatterplot of True and Predicted Y-Values')
+    ax.set_xlabel('True Y-Values')
+    ax.set_ylabel('Predicted Y-Values')
+    _save(fig, scatter_path)
+
+    #In this case, not normally distributed so linear regression in probably not the best choice.
+    fig = Figure()
+    ax = fig.add_subplot()
+    ax.hist(y - predictions, bins=50)
+    ax.set_title('Residuals of True and Predicted Y-Values')
+    ax.set_xlabel('Residual Value')
+    ax.set_ylabel('Frequency')
+    _save(fig, residual_path)
+    return scatter_path, residual_path
+
+
+def _run_task(task):
+    name, func, args = task
+    with instrument.stage('figure:' + name, rows_in=len(args[0])):
+        return func(*args)
+
+
+def _run_worker_task(task):
+    #The forked worker has its own copy of the recorder, so its new records go back with the result
+    recorder = instrument.active_recorder()
+    if recorder is None:
+        return _run_task(task), []
+    mark = len(recorder.records)
+    return _run_task(task), recorder.records[mark:]
+
+
+def _render(tasks, workers):
+    '''
+    Run (name, function, args) figure tasks on a pool of worker processes, or in this process when workers is 1.
+
+    Workers are forked so the analysis script does not need a __main__ guard. Where fork is not available (Windows)
+    the figures are drawn in this process.
+    '''
+    workers = min(workers or os.cpu_count() or 1, max(len(tasks), 1))
+    if workers == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        return [_run_task(task) for task in tasks]
+    with multiprocessing.get_context('fork').Pool(processes=workers) as pool:
+        results = pool.map(_run_worker_task, tasks, chunksize=1)
+    recorder = instrument.active_recorder()
+    if recorder is not None:
+        for _, records in results:
+            recorder.add_records(records)
+    return [result for result, _ in results]
+
+
+def figure_tasks(FL_Data, Age_Summary, out_dir='.', max_points=MAX_POINTS):
+    '''
+    The (name, function, args) tasks of the Part 2 figures of the analysis.
+
+    Each task only receives the columns its figure needs.
+    '''
+    def out(name):
+        return os.path.join(out_dir, name)
+
+    return [
+        ('Histogram_Severity', histogram_severity, (FL_Data[['Date', 'Severity_Label']],
+                                                    out('Histogram_Severity.png'))),
+        ('Scatterplot_AGB_NEP', scatter_agb_nep, (FL_Data[['AGB_2010', 'NEP_2010', 'Severity_Label']],
+                                                  out('Scatterplot_AGB_NEP.png'), max_points)),
+        ('FacetGrid_AGB_Raw', facet_raw, (FL_Data[['Burn_Scar_Age', 'AGB_2010', 'Severity_Label']], 'AGB_2010',
+                                          out('FacetGrid_AGB_Raw.png'), max_points)),
+        ('FacetGrid_AGB_Mean', facet_mean, (Age_Summary, 'AGB_2010', out('FacetGrid_AGB_Mean.png'))),
+        ('FacetGrid_NEP_Raw', facet_raw, (FL_Data[['Burn_Scar_Age', 'NEP_2010', 'Severity_Label']], 'NEP_2010',
+                                          out('FacetGrid_NEP_Raw.png'), max_points)),
+        ('FacetGrid_NEP_Mean', facet_mean, (Age_Summary, 'NEP_2010', out('FacetGrid_NEP_Mean.png'))),
+    ]
+
+
+def diagnostic_tasks(FL_Data, Reg_Results, out_dir='.', max_points=MAX_POINTS):
+    '''The (name, function, args) tasks of the diagnostic figures of every fitted model in Reg_Results.'''
+    tasks = []
+    for _, row in Reg_Results.iterrows():
+        if np.isnan(row['intercept']):
+            continue
+        rows = category_mask(FL_Data['Severity_Label'], row['Severity_Label'])
+        data = FL_Data.loc[rows, ['Burn_Scar_Age', row['response']]]
+        name = 'Diagnostics_%s_%s_%s' % (row['Severity_Label'], row['response'], row['model'])
+        prefix = os.path.join(out_dir, name)
+        tasks.append((name, regression_diagnostics, (data, row, prefix + '_Scatter.png', prefix + '_Residuals.png',
+                                                     max_points)))
+    return tasks
+
+
+def task_digest(task):
+    '''
+    Digest of everything a figure task draws from: its function, the data it receives and its other arguments.
+
+    Two tasks with the same digest draw the same figure, so an unchanged figure does not need to be drawn again.
+    The numbers of a results row are compared to 10 significant digits, so rounding noise is not a change.
+    '''
+    name, func, args = task
+    digest = hashlib.sha1(('%s:%s' % (name, func.__name__)).encode('utf-8'))
+    for arg in args:
+        if isinstance(arg, pd.DataFrame):
+            digest.update(pd.util.hash_pandas_object(arg, index=True).to_numpy().tobytes())
+            digest.update(repr(list(arg.columns)).encode('utf-8'))
+        elif isinstance(arg, pd.Series):
+            digest.update(repr([(key, '%.10g' % value if isinstance(value, float) else value)
+                                for key, value in arg.items()]).encode('utf-8'))
+        else:
+            digest.update(repr(arg).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def render_figures(FL_Data, Age_Summary, out_dir='.', workers=None, max_points=MAX_POINTS):
+    '''Render the Part 2 figures of the analysis and return the paths written.'''
+    return _render(figure_tasks(FL_Data, Age_Summary, out_dir, max_points), workers)
+
+
+def render_diagnostics(FL_Data, Reg_Results, out_dir='.', workers=None, max_points=MAX_POINTS):
+    '''
+    Render the diagnostic figures of every fitted model in a batch_regression table grouped by Severity_Label.
+
+    Files are named Diagnostics_<severity>_<response>_<model>_Scatter.png and ..._Residuals.png.
+    '''
+    return _render(diagnostic_tasks(FL_Data, Reg_Results, out_dir, max_points), workers)
@@ -0,0 +1,106 @@
+'''
+Windowed reading of the eight co-registered raster layers.
+
+Instead of opening every TIFF with np.asarray(Image.open(...)) and stacking the whole scene, the layers are walked
+together in bands of rows. The burn-year, AGB-loss and forest-type filters are applied to each band, so only the
+surviving pixels are kept and peak memory follows the window size rather than the scene size. The filters
+themselves live in filters.py, and the raster backends (PIL, tifffile, rasterio) in readers.py.
+'''
+
+import os
+
+import pandas as pd
+
+from . import settings
+from .filters import burn_year_lut, forest_lut, select_pixels
+from .instrument import stage
+from .readers import open_layer
+from .table import build_frame
+from .validity import layer_nodata
+
+
+def open_layers(directory, layer_files=None, backend=settings.RASTER_BACKEND):
+    '''
+    Open every layer in a scene directory and check they share one grid.
+
+    The layers must have the same size and, where they are georeferenced, the same geotransform and coordinate
+    system. A layer without georeferencing is only checked by size.
+    '''
+    layer_files = layer_files or settings.LAYER_FILES
+    layers = {name: open_layer(os.path.join(directory, fname), backend) for name, fname in layer_files.items()}
+    shapes = {layer.shape for layer in layers.values()}
+    if len(shapes) != 1:
+        raise ValueError('Raster layers in %s are not the same size: %s' % (directory, sorted(shapes)))
+    for attribute in ('geotransform', 'crs'):
+        values = {name: getattr(layer, attribute) for name, layer in layers.items()}
+        known = {value for value in values.values() if value is not None}
+        if len(known) > 1:
+            raise ValueError('Raster layers in %s do not share one %s: %s' % (directory, attribute, values))
+    return layers
+
+
+def scene_grid(layers):
+    '''Shape, geotransform and coordinate system shared by the layers of a scene (None where not georeferenced).'''
+    def shared(attribute):
+        return next((getattr(layer, attribute) for layer in layers.values()
+                     if getattr(layer, attribute) is not None), None)
+    return {'shape': next(iter(layers.values())).shape, 'geotransform': shared('geotransform'), 'crs': shared('crs')}
+
+
+def iter_windows(layers, window_rows=settings.WINDOW_ROWS, rows=None):
+    '''
+    Yield (first flat pixel index, {column: flat array}) for each band of rows across all layers.
+
+    rows=(first, last) limits the walk to a horizontal strip of the scene, for example one tile of a large mosaic.
+    '''
+    height, width = next(iter(layers.values())).shape
+    first, last = rows or (0, height)
+    last = min(last, height)
+    for row0 in range(first, last, window_rows):
+        row1 = min(row0 + window_rows, last)
+        with stage('decode') as s:
+            arrays = {name: layer.read_rows(row0, row1) for name, layer in layers.items()}
+            s.rows_out = (row1 - row0) * width
+        with stage('flatten', rows_in=(row1 - row0) * width):
+            window = {name: arr.ravel() for name, arr in arrays.items()}
+        del arrays
+        yield row0 * width, window
+
+
+def filter_window(start, window, year_lut, type_lut, drop_low=True, cut_bins=settings.CUT_BINS,
+                  bs_labels=settings.BS_LABELS, nodata=None):
+    '''
+    Build the pixel table for one window from the pixels the analysis uses.
+
+    The filters run on the raw arrays, so only the surviving rows become a dataframe. The index is the flat pixel
+    index in the full scene, the same index the original whole-scene frame had. nodata maps layer names to their
+    nodata value, see validity.layer_nodata.
+    '''
+    idx, change = select_pixels(window, year_lut, type_lut, drop_low, cut_bins, nodata=nodata)
+    return build_frame(start, window, idx, change, cut_bins, bs_labels)
+
+
+def stream_pixels(directory, window_rows=settings.WINDOW_ROWS, excluded_years=settings.EXCLUDED_BURN_YEARS,
+                  forest_code=settings.LONGLEAF_SLASH_PINE, drop_low=True, cut_bins=settings.CUT_BINS,
+                  bs_labels=settings.BS_LABELS, rows=None, backend=settings.RASTER_BACKEND):
+    '''Yield the filtered pixel table of a scene one window at a time.'''
+    layers = open_layers(directory, backend=backend)
+    year_lut = burn_year_lut(excluded_years)
+    type_lut = forest_lut(forest_code)
+    nodata = layer_nodata(layers)
+    for start, window in iter_windows(layers, window_rows, rows):
+        yield filter_window(start, window, year_lut, type_lut, drop_low, cut_bins, bs_labels, nodata)
+
+
+def read_pixel_table(directory, window_rows=settings.WINDOW_ROWS, excluded_years=settings.EXCLUDED_BURN_YEARS,
+                     forest_code=settings.LONGLEAF_SLASH_PINE, drop_low=True, cut_bins=settings.CUT_BINS,
+                     bs_labels=settings.BS_LABELS, rows=None, backend=settings.RASTER_BACKEND):
+    '''Stream a scene and concatenate the surviving pixels into one DataFrame.'''
+    parts = list(stream_pixels(directory, window_rows, excluded_years, forest_code, drop_low, cut_bins, bs_labels,
+                               rows, backend))
+    if not parts:
+        raise ValueError('No raster rows were read from %s' % directory)
+    with stage('concat') as s:
+        FL_Data = pd.concat(parts)
+        s.rows_out = len(FL_Data)
+    return FL_Data
@@ -0,0 +1,275 @@
+'''
+Raster reader backends.
+
+Every layer is opened through one small interface: shape, dtype, geotransform, crs and nodata, and read_rows(row0,
+row1) which returns a band of rows as a 2D array. Three backends implement it:
+
+- 'rasterio' reads windows through GDAL, which decodes the tiles of a window on several threads (GDAL_NUM_THREADS).
+- 'tifffile' reads only the strips or tiles that overlap a window and decompresses them on a thread pool.
+- 'pil' is the original reader. Uncompressed layers are read window by window. Compressed layers are decoded whole,
+  once, on one thread.
+
+'auto' picks the first backend that is installed, in that order. rasterio and tifffile are optional dependencies,
+PIL is always there. The GeoTIFF georeferencing tags are read by every backend, so open_layers can check that all
+eight layers share one grid and the pixel coordinates can be turned into map coordinates.
+'''
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+#The zip bomb check refuses large scenes on open. Only one window is decoded at a time, so it is safe to turn it off.
+Image.MAX_IMAGE_PIXELS = None
+
+#Bytes per pixel for the single band image modes the dataset uses
+MODE_ITEMSIZE = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'I;16L': 2, 'I;16B': 2, 'I;16S': 2, 'I': 4, 'F': 4}
+
+#GeoTIFF tags
+MODEL_PIXEL_SCALE = 33550
+MODEL_TIEPOINT = 33922
+MODEL_TRANSFORMATION = 34264
+GEO_KEY_DIRECTORY = 34735
+GDAL_NODATA = 42113
+
+#GeoKeys holding the EPSG code of a projected or geographic coordinate system, and the user-defined code
+PROJECTED_CS_TYPE = 3072
+GEOGRAPHIC_TYPE = 2048
+USER_DEFINED = 32767
+
+#Threads decoding the tiles of one window
+DECODE_THREADS = os.cpu_count() or 1
+
+
+def geotransform_from_tags(tags):
+    '''
+    GDAL style geotransform (x origin, pixel width, row rotation, y origin, column rotation, pixel height) from
+    a dict of GeoTIFF tag values, or None for a raster without georeferencing.
+    '''
+    if MODEL_TRANSFORMATION in tags:
+        m = [float(v) for v in tags[MODEL_TRANSFORMATION]]
+        return (m[3], m[0], m[1], m[7], m[4], m[5])
+    if MODEL_PIXEL_SCALE in tags and MODEL_TIEPOINT in tags:
+        sx, sy = [float(v) for v in tags[MODEL_PIXEL_SCALE][:2]]
+        i, j, _, x, y, _ = [float(v) for v in tags[MODEL_TIEPOINT][:6]]
+        return (x - i * sx, sx, 0.0, y + j * sy, 0.0, -sy)
+    return None
+
+
+def crs_from_tags(tags):
+    ''''EPSG:<code>' from the GeoKey directory, the raw key directory for user-defined systems, or None.'''
+    keys = tags.get(GEO_KEY_DIRECTORY)
+    if keys is None:
+        return None
+    keys = [int(v) for v in keys]
+    entries = {keys[i]: keys[i + 3] for i in range(4, 4 + 4 * keys[3], 4) if keys[i + 1] == 0}
+    for key in (PROJECTED_CS_TYPE, GEOGRAPHIC_TYPE):
+        if key in entries and entries[key] != USER_DEFINED:
+            return 'EPSG:%d' % entries[key]
+    return 'GEOKEYS:' + ','.join(str(v) for v in keys)
+
+
+def nodata_from_tags(tags):
+    '''The GDAL nodata value of the layer as a float, or None.'''
+    value = tags.get(GDAL_NODATA)
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode('ascii')
+    value = str(value).strip().strip('\x00')
+    return float(value) if value else None
+
+
+class PILLayer:
+    '''
+    One raster layer opened lazily with PIL.
+
+    Uncompressed TIFFs are read window by window by pointing PIL's raw decoder at the byte offset of the first
+    requested row. Compressed layers cannot be entered part way, so they are decoded once and sliced.
+    '''
+
+    backend = 'pil'
+
+    def __init__(self, path):
+        self.path = path
+        with Image.open(path) as im:
+            self.width, self.height = im.size
+            self.mode = im.mode
+            self.windowed = all(t[0] == 'raw' and t[3][2] == 1 for t in im.tile) and self.mode in MODE_ITEMSIZE
+            tags = dict(getattr(im, 'tag_v2', {}))
+        self.geotransform = geotransform_from_tags(tags)
+        self.crs = crs_from_tags(tags)
+        self.nodata = nodata_from_tags(tags)
+        self._full = None
+        self._lock = threading.Lock()
+
+    @property
+    def shape(self):
+        return (self.height, self.width)
+
+    def read_rows(self, row0, row1):
+        '''Return rows row0 up to (not including) row1 as a 2D array.'''
+        if not self.windowed:
+            with self._lock:
+                if self._full is None:
+                    self._full = np.asarray(Image.open(self.path))
+            return self._full[row0:row1]
+
+        im = Image.open(self.path)
+        itemsize = MODE_ITEMSIZE[self.mode]
+        tiles = []
+        for tile in im.tile:
+            x0, y0, x1, y1 = tile[1]
+            if y1 <= row0 or y0 >= row1:
+                continue
+            #Skip whole rows inside the tile so the decoder starts at the first row of the window
+            stride = tile[3][1] or (x1 - x0) * itemsize
+            top = max(y0, row0)
+            bottom = min(y1, row1)
+            offset = tile[2] + (top - y0) * stride
+            tiles.append(_make_tile(tile, (x0, top - row0, x1, bottom - row0), offset))
+        im.tile = tiles
+        im._size = (self.width, row1 - row0)
+        arr = np.asarray(im)
+        im.close()
+        return arr
+
+
+def _make_tile(tile, extents, offset):
+    #Newer versions of Pillow store tiles as namedtuples, older ones as plain tuples
+    if hasattr(tile, '_replace'):
+        return tile._replace(extents=extents, offset=offset)
+    return (tile[0], extents, offset, tile[3])
+
+
+class TifffileLayer:
+    '''
+    One raster layer read with tifffile.
+
+    Only the strips or tiles that overlap the requested rows are read from disk. They are decompressed on a pool of
+    threads (zlib and most codecs release the GIL) and copied into the window.
+    '''
+
+    backend = 'tifffile'
+    windowed = True
+
+    def __init__(self, path, threads=DECODE_THREADS):
+        import tifffile
+        self.path = path
+        self._file = tifffile.TiffFile(path)
+        self._page = self._file.pages[0]
+        if self._page.samplesperpixel != 1:
+            raise ValueError('%s has %d bands, expected one' % (path, self._page.samplesperpixel))
+        self.height, self.width = self._page.shape[:2]
+        self.dtype = self._page.dtype
+        tags = {tag.code: tag.value for tag in self._page.tags.values()}
+        self.geotransform = geotransform_from_tags(tags)
+        self.crs = crs_from_tags(tags)
+        self.nodata = nodata_from_tags(tags)
+        self.threads = threads
+        self._lock = threading.Lock()
+
+    @property
+    def shape(self):
+        return (self.height, self.width)
+
+    def read_rows(self, row0, row1):
+        '''Return rows row0 up to (not including) row1 as a 2D array.'''
+        page = self._page
+        chunk_rows, chunk_cols = page.chunks[-2:] if page.is_tiled else (page.chunks[0], self.width)
+        across = -(-self.width // chunk_cols)
+        first, last = row0 // chunk_rows, (row1 - 1) // chunk_rows
+        indices = [r * across + c for r in range(first, last + 1) for c in range(across)]
+
+        #Reading is serial on the one file handle, decoding runs on the threads
+        with self._lock:
+            fh = self._file.filehandle
+            segments = list(fh.read_segments([page.dataoffsets[i] for i in indices],
+                                             [page.databytecounts[i] for i in indices], indices=indices,
+                                             sort=True))
+        out = np.empty((row1 - row0, self.width), dtype=self.dtype)
+
+        def decode(segment):
+            data, index = segment
+            tile, (_, _, y, x, _), _ = page.decode(data, index)
+            tile = tile.reshape(tile.shape[-3], tile.shape[-2])
+            top, bottom = max(y, row0), min(y + tile.shape[0], row1, self.height)
+            right = min(x + tile.shape[1], self.width)
+            out[top - row0:bottom - row0, x:right] = tile[top - y:bottom - y, :right - x]
+
+        if self.threads > 1 and len(segments) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.threads, len(segments))) as pool:
+                list(pool.map(decode, segments))
+        else:
+            for segment in segments:
+                decode(segment)
+        return out
+
+    def close(self):
+        self._file.close()
+
+
+class RasterioLayer:
+    '''
+    One raster layer read through GDAL with rasterio.
+
+    Windows are read with dataset.read(window=...), so GDAL only decodes the blocks it needs, on GDAL_NUM_THREADS
+    threads.
+    '''
+
+    backend = 'rasterio'
+    windowed = True
+
+    def __init__(self, path, threads=DECODE_THREADS):
+        import rasterio
+        from rasterio.windows import Window
+        self.path = path
+        self._window = Window
+        self._dataset = rasterio.open(path, num_threads=str(threads))
+        if self._dataset.count != 1:
+            raise ValueError('%s has %d bands, expected one' % (path, self._dataset.count))
+        self.height, self.width = self._dataset.height, self._dataset.width
+        self.dtype = np.dtype(self._dataset.dtypes[0])
+        self.geotransform = tuple(self._dataset.transform.to_gdal()) if self._dataset.transform else None
+        self.crs = self._dataset.crs.to_string() if self._dataset.crs else None
+        self.nodata = self._dataset.nodata
+        self._lock = threading.Lock()
+
+    @property
+    def shape(self):
+        return (self.height, self.width)
+
+    def read_rows(self, row0, row1):
+        '''Return rows row0 up to (not including) row1 as a 2D array.'''
+        #GDAL dataset handles are not safe to share between threads
+        with self._lock:
+            return self._dataset.read(1, window=self._window(0, row0, self.width, row1 - row0))
+
+    def close(self):
+        self._dataset.close()
+
+
+BACKENDS = {'rasterio': RasterioLayer, 'tifffile': TifffileLayer, 'pil': PILLayer}
+
+
+def available_backends():
+    '''Names of the backends that can be used here, in the order 'auto' tries them.'''
+    names = []
+    for name, module in (('rasterio', 'rasterio'), ('tifffile', 'tifffile')):
+        try:
+            __import__(module)
+        except ImportError:
+            continue
+        names.append(name)
+    return names + ['pil']
+
+
+def open_layer(path, backend='auto'):
+    '''Open one raster layer with the named backend, or the first one installed for 'auto'.'''
+    if backend == 'auto':
+        backend = available_backends()[0]
+    if backend not in BACKENDS:
+        raise ValueError('Unknown raster backend %r, expected one of %s' % (backend, ', '.join(BACKENDS)))
+    return BACKENDS[backend](path)
@@ -0,0 +1,297 @@
+'''
+Batch regression engine for the recovery models.
+
+LinReg and QuadReg used to re-import sklearn, split the data and fit one LinearRegression per call, once for every
+severity group and response. Here the linear and quadratic fits for every group and response come from grouped
+sufficient statistics (the sums of x^k and x^k * y), collected in one scan of the data. Each model is then a tiny
+closed-form solve of the normal equations.
+
+Burn_Scar_Age only takes about 19 values, so the pixels of each group can also be collapsed once into a per-age
+table of counts, means and variances (age_summary). The same sums, and so the same OLS fits and F-tests, can be
+rebuilt from that small table, and the mean-by-age plots can be drawn from it too.
+'''
+
+import numpy as np
+import pandas as pd
+
+from .instrument import stage
+
+#Severity groups and response variables the analysis reports on
+SEVERITIES = ['Moderate', 'Severe']
+RESPONSES = ['AGB_2010', 'NEP_2010']
+MODELS = {'linear': 1, 'quadratic': 2}
+
+#Groups with fewer rows than this are reported with NaN results
+MIN_ROWS = 5
+
+#Smallest eigenvalue of the normal equations, scaled to a unit diagonal, below which x has too few distinct values
+#for the model. Rounding in the sums leaves singular matrices at about 1e-14, real fits are many orders above.
+RANK_TOL = 1e-10
+
+RESULT_COLUMNS = ['response', 'model', 'n', 'intercept', 'coef_x1', 'coef_x2', 'rmse', 'r2', 'F', 'p']
+
+
+def group_moments(x, Y, codes, n_groups, degree=2, weights=None, Y_var=None):
+    '''
+    Sufficient statistics of polynomial regressions of every column of Y on x, for each group.
+
+    codes holds the group number of every row (-1 rows are ignored). Returns a dict with, per group, the row count
+    n, sx[k] = sum(x^k) for k up to 2*degree, sxy[r, k] = sum(x^k * y_r) for k up to degree, sy2[r] = sum(y_r^2)
+    and sy[r] = sum(y_r).
+
+    For a per-age summary, each row stands for weights pixels with mean Y and variance Y_var (ddof=0), which gives
+    exactly the same sums as the pixels themselves.
+    '''
+    keep = codes >= 0
+    codes = codes[keep]
+    x = np.asarray(x, dtype=np.float64)[keep]
+    Y = np.asarray(Y, dtype=np.float64)[keep]
+    w = np.ones_like(x) if weights is None else np.asarray(weights, dtype=np.float64)[keep]
+
+    sx = np.empty((n_groups, 2 * degree + 1))
+    sxy = np.empty((n_groups, Y.shape[1], degree + 1))
+    sy2 = np.empty((n_groups, Y.shape[1]))
+    power = w
+    for k in range(2 * degree + 1):
+        sx[:, k] = np.bincount(codes, weights=power, minlength=n_groups)
+        if k <= degree:
+            for r in range(Y.shape[1]):
+                sxy[:, r, k] = np.bincount(codes, weights=power * Y[:, r], minlength=n_groups)
+        power = power * x
+    for r in range(Y.shape[1]):
+        square = Y[:, r] * Y[:, r]
+        if Y_var is not None:
+            square = square + np.asarray(Y_var, dtype=np.float64)[keep][:, r]
+        sy2[:, r] = np.bincount(codes, weights=w * square, minlength=n_groups)
+    return {'n': sx[:, 0].copy(), 'sx': sx, 'sxy': sxy, 'sy2': sy2, 'sy': sxy[:, :, 0].copy()}
+
+
+def add_moments(a, b):
+    '''Sufficient statistics of two sets of rows together, for example two chunks of a scene.'''
+    return {key: a[key] + b[key] for key in a}
+
+
+def solve_moments(fit, degree):
+    '''
+    Least squares coefficients of a polynomial of the given degree for every group and response.
+
+    Returns an array of shape (groups, responses, degree + 1) with the intercept first. Groups which are too small,
+    or where x does not take enough distinct values, get NaN.
+    '''
+    d = degree + 1
+    A = np.empty((len(fit['n']), d, d))
+    for i in range(d):
+        A[:, i, :] = fit['sx'][:, i:i + d]
+    b = fit['sxy'][:, :, :d]
+
+    coefs = np.full(b.shape, np.nan)
+    ok = fit['n'] >= max(MIN_ROWS, d + 1)
+    if ok.any():
+        #matrix_rank misses a group with one value of x over many pixels, the rounding of its sums looks like rank.
+        #A zero on the diagonal (every x equal to the shift) is singular outright.
+        diagonal = np.diagonal(A[ok], axis1=1, axis2=2)
+        usable = (diagonal > 0).all(axis=1)
+        scale = 1 / np.sqrt(np.where(usable[:, None], diagonal, 1))
+        smallest = np.linalg.eigvalsh(A[ok] * scale[:, :, None] * scale[:, None, :])[:, 0]
+        ok[ok] = usable & (smallest > RANK_TOL)
+    if ok.any():
+        coefs[ok] = np.linalg.solve(A[ok][:, None, :, :], b[ok][..., None])[..., 0]
+    return coefs
+
+
+def residual_sum_of_squares(fit, coefs):
+    '''Sum of squared residuals of the fitted coefficients, computed from the sufficient statistics alone.'''
+    d = coefs.shape[-1]
+    A = np.empty((len(fit['n']), d, d))
+    for i in range(d):
+        A[:, i, :] = fit['sx'][:, i:i + d]
+    #sum((y - X b)^2) = sum(y^2) - 2 b.X'y + b.X'X.b
+    cross = np.einsum('grk,grk->gr', coefs, fit['sxy'][:, :, :d])
+    quad = np.einsum('grk,gkl,grl->gr', coefs, A, coefs)
+    return fit['sy2'] - 2 * cross + quad
+
+
+def total_sum_of_squares(fit):
+    n = fit['n'][:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return fit['sy2'] - fit['sy'] ** 2 / n
+
+
+def _group_codes(df, by):
+    '''Integer group number of every row, and a frame with the group keys in order.'''
+    if not by:
+        return np.zeros(len(df), dtype=np.int64), pd.DataFrame(index=[0])
+    keys = []
+    for name in by:
+        column = df[name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            keys.append((column.cat.codes.to_numpy(), column.cat.categories))
+        else:
+            codes, uniques = pd.factorize(column, sort=True)
+            keys.append((codes, uniques))
+    codes = np.zeros(len(df), dtype=np.int64)
+    valid = np.ones(len(df), dtype=bool)
+    for column_codes, categories in keys:
+        valid &= column_codes >= 0
+        codes = codes * len(categories) + column_codes
+    codes[~valid] = -1
+    index = pd.MultiIndex.from_product([categories for _, categories in keys], names=by)
+    return codes, index.to_frame(index=False)
+
+
+def batch_regression(FL_Data, by=('Severity_Label',), responses=RESPONSES, x='Burn_Scar_Age', models=MODELS,
+                     test_size=None, random_state=None, aggregate=False):
+    '''
+    Fit linear and quadratic models of every response on x, for every group of the by columns, in one pass.
+
+    by can name any mix of columns, for example Severity_Label and Forest_Type, or a scene column. Returns a tidy
+    table with one row per group, response and model: the intercept and coefficients, the RMSE and R-squared, and
+    the F-score and p-value against an intercept only model.
+
+    With test_size, each row is randomly held out with that probability. The models are fit on the remaining rows,
+    and RMSE and R-squared are reported on the held out rows, like the train/test split in LinReg and QuadReg.
+    Otherwise they are the in-sample values. The F-test always uses every row of the group.
+
+    With aggregate=True the pixels are first collapsed into a per-age summary and the models are fit from it. The
+    results are the same as the in-sample fit, and a held out test set is not possible.
+    '''
+    by = list(by)
+    if aggregate:
+        if test_size:
+            raise ValueError('test_size needs the individual pixels and cannot be used with aggregate=True')
+        summary = age_summary(FL_Data, by, x, responses)
+        return batch_regression_from_summary(summary, by, responses, x, models)
+
+    with stage('regression_moments', rows_in=len(FL_Data)):
+        codes, groups = _group_codes(FL_Data, by)
+        Y = FL_Data[list(responses)].to_numpy(dtype=np.float64)
+        xv = FL_Data[x].to_numpy(dtype=np.float64)
+        #Centring x keeps the sums of x^4 well conditioned. The coefficients are shifted back below.
+        shift = np.nanmean(xv) if len(xv) else 0.0
+        xc = xv - shift
+        degree = max(models.values())
+
+        full = group_moments(xc, Y, codes, len(groups), degree)
+        if test_size:
+            held_out = np.random.default_rng(random_state).random(len(codes)) < test_size
+            train = group_moments(xc, Y, np.where(held_out, -1, codes), len(groups), degree)
+            test = group_moments(xc, Y, np.where(held_out, codes, -1), len(groups), degree)
+        else:
+            train = test = full
+    return _results_table(groups, full, train, test, models, responses, shift)
+
+
+def age_summary(FL_Data, by=('Severity_Label',), x='Burn_Scar_Age', responses=RESPONSES):
+    '''
+    Collapse the pixels of every group into one row per value of x.
+
+    Each row has the pixel count and, for every response, the mean (<response>_mean) and the variance with ddof=0
+    (<response>_var). The table has a few dozen rows however many pixels went in.
+    '''
+    with stage('age_summary', rows_in=len(FL_Data)) as s:
+        summary = _age_summary(FL_Data, list(by) + [x], responses)
+        s.rows_out = len(summary)
+    return summary
+
+
+def _age_summary(FL_Data, keys, responses):
+    #The float32 carbon columns are summed in float64 so the rebuilt sums match the pixel level ones
+    data = FL_Data[keys].copy()
+    for response in responses:
+        data[response] = FL_Data[response].to_numpy(dtype=np.float64)
+    grouped = data.groupby(keys, observed=True, sort=True)[list(responses)]
+    means = grouped.mean().add_suffix('_mean')
+    variances = grouped.var(ddof=0).add_suffix('_var')
+    summary = pd.concat([grouped.size().rename('count'), means, variances], axis=1)
+    return summary.reset_index()
+
+
+def batch_regression_from_summary(summary, by=('Severity_Label',), responses=RESPONSES, x='Burn_Scar_Age',
+                                  models=MODELS):
+    '''Fit the same models as batch_regression from a per-age summary made by age_summary.'''
+    by = list(by)
+    with stage('regression_moments', rows_in=len(summary)):
+        codes, groups = _group_codes(summary, by)
+        counts = summary['count'].to_numpy(dtype=np.float64)
+        Y = summary[[r + '_mean' for r in responses]].to_numpy(dtype=np.float64)
+        Y_var = summary[[r + '_var' for r in responses]].to_numpy(dtype=np.float64)
+        xv = summary[x].to_numpy(dtype=np.float64)
+        shift = np.average(xv, weights=counts) if counts.sum() else 0.0
+        full = group_moments(xv - shift, Y, codes, len(groups), max(models.values()), weights=counts, Y_var=Y_var)
+    return _results_table(groups, full, full, full, models, responses, shift)
+
+
+def _results_table(groups, full, train, test, models, responses, shift):
+    '''Solve every model from the sums and lay the results out as a tidy table.'''
+    #scipy is imported here so building the pixel table does not pay for it
+    from scipy.special import fdtrc
+    frames = []
+    for model, model_degree in models.items():
+        #One stage per model covers every group and response, they are solved together
+        with stage('regression_%s' % model), np.errstate(divide='ignore', invalid='ignore'):
+            coefs = solve_moments(train, model_degree)
+            sse = residual_sum_of_squares(test, coefs)
+            rmse = np.sqrt(np.maximum(sse, 0) / test['n'][:, None])
+            r2 = 1 - sse / total_sum_of_squares(test)
+
+            #Overall F-test of the model on every row of the group
+            full_coefs = coefs if test is full else solve_moments(full, model_degree)
+            full_sse = residual_sum_of_squares(full, full_coefs)
+            dfd = full['n'][:, None] - model_degree - 1
+            F = ((total_sum_of_squares(full) - full_sse) / model_degree) / (full_sse / dfd)
+            p = fdtrc(model_degree, dfd, F)
+
+        coefs = _unshift(coefs, shift)
+        for r, response in enumerate(responses):
+            frame = groups.copy()
+            frame['_group'] = np.arange(len(groups))
+            frame['response'] = response
+            frame['model'] = model
+            frame['n'] = full['n'].astype(np.int64)
+            frame['intercept'] = coefs[:, r, 0]
+            frame['coef_x1'] = coefs[:, r, 1]
+            frame['coef_x2'] = coefs[:, r, 2] if model_degree > 1 else np.nan
+            frame['rmse'] = rmse[:, r]
+            frame['r2'] = r2[:, r]
+            frame['F'] = F[:, r]
+            frame['p'] = p[:, r]
+            frames.append(frame)
+
+    #Rows are ordered by group, then response and model in the order they were asked for
+    result = pd.concat(frames, ignore_index=True)
+    result['_response'] = result['response'].map({name: i for i, name in enumerate(responses)})
+    result['_model'] = result['model'].map({name: i for i, name in enumerate(models)})
+    result = result.sort_values(['_group', '_response', '_model'], kind='stable')
+    return result.drop(columns=['_group', '_response', '_model']).reset_index(drop=True)
+
+
+def _unshift(coefs, shift):
+    '''Turn coefficients of a polynomial in (x - shift) back into coefficients of a polynomial in x.'''
+    out = np.zeros(coefs.shape[:-1] + (3,))
+    out[..., :coefs.shape[-1]] = coefs
+    a, b, c = out[..., 0].copy(), out[..., 1].copy(), out[..., 2].copy()
+    out[..., 0] = a - b * shift + c * shift ** 2
+    out[..., 1] = b - 2 * c * shift
+    return out
+
+
+def predict(row, x):
+    '''Predicted values of one row of the results table at x.'''
+    coef_x2 = 0.0 if pd.isna(row['coef_x2']) else row['coef_x2']
+    return row['intercept'] + row['coef_x1'] * x + coef_x2 * x ** 2
+
+
+def regression_table(FL_Data, severities=SEVERITIES, responses=RESPONSES, x='Burn_Scar_Age', test_size=0.4,
+                     random_state=None, aggregate=False):
+    '''
+    Run the linear and quadratic regressions and the F-test for every severity group and response.
+
+    Returns one row per (severity, response, model), with the severity in a 'severity' column. With aggregate=True
+    the fits come from the per-age summary and report in-sample RMSE and R-squared.
+    '''
+    result = batch_regression(FL_Data, by=['Severity_Label'], responses=responses, x=x,
+                              test_size=None if aggregate else test_size, random_state=random_state,
+                              aggregate=aggregate)
+    result = result[result['Severity_Label'].isin(severities)].rename(columns={'Severity_Label': 'severity'})
+    result['severity'] = result['severity'].astype(str)
+    return result.reset_index(drop=True)[['severity'] + RESULT_COLUMNS]
@@ -0,0 +1,274 @@
+'''
+Bootstrap and repeated K-fold resampling of the recovery models.
+
+One train/test split gives one RMSE and one R-squared, which change with the split and come without any idea of
+their spread. Here the linear and quadratic fits of every group and response are repeated over B bootstrap samples
+or R repeats of a K-fold split, and the coefficients and scores of every replicate are kept, so each can be reported
+with a confidence interval.
+
+Like batch_regression, a fit only needs the sums of x^k, x^k * y and y^2 of its rows. Every pixel's terms are
+computed once into a feature matrix F, with the pixels sorted by group. A replicate is a vector of weights over the
+pixels of a group (how many times each pixel is drawn, or whether it is in the training folds), so the sums of a
+block of replicates are one matrix product W @ F. The scores are computed on the pixels left out: those never drawn
+in a bootstrap sample (out of bag), or the test fold.
+
+F is written once to a .npy file and every worker process memory-maps the same read-only copy. Workers are forked,
+as in plots.py, so the analysis script does not need a __main__ guard; where fork is not available (Windows) the
+blocks run in this process. Replicates are handed out in fixed blocks, each with its own seed spawned from
+random_state, so the results do not depend on the number of workers.
+
+    summary, replicates = resample_regression(FL_Data, method='bootstrap', replicates=1000, random_state=0)
+'''
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from . import settings
+from . import instrument
+from .instrument import stage
+from .raster import read_pixel_table
+from .readers import BACKENDS
+from .regression import (MODELS, RESPONSES, _group_codes, _unshift, batch_regression, residual_sum_of_squares,
+                         solve_moments, total_sum_of_squares)
+
+#Bootstrap replicates computed together in one task
+BLOCK = 16
+
+#Statistics reported for every replicate
+STATISTICS = ['intercept', 'coef_x1', 'coef_x2', 'rmse', 'r2']
+
+FEATURE_FILE = 'features.npy'
+
+
+def feature_matrix(x, Y, degree):
+    '''
+    Per-pixel terms of the sufficient statistics: x^k for k up to 2*degree, x^k * y_r for k up to degree and y_r^2.
+
+    The sums of the columns over a set of pixels are the sums group_moments would return for them.
+    '''
+    powers = [np.ones_like(x)]
+    for _ in range(2 * degree):
+        powers.append(powers[-1] * x)
+    columns = powers + [powers[k] * Y[:, r] for r in range(Y.shape[1]) for k in range(degree + 1)]
+    columns += [Y[:, r] * Y[:, r] for r in range(Y.shape[1])]
+    return np.column_stack(columns)
+
+
+def _moments(sums, responses, degree):
+    '''Turn feature sums of shape (fits, columns) into the moments dict used by regression.py.'''
+    n_x = 2 * degree + 1
+    sx = sums[:, :n_x]
+    sxy = sums[:, n_x:n_x + responses * (degree + 1)].reshape(-1, responses, degree + 1)
+    sy2 = sums[:, n_x + responses * (degree + 1):]
+    return {'n': sx[:, 0].copy(), 'sx': sx, 'sxy': sxy, 'sy2': sy2, 'sy': sxy[:, :, 0].copy()}
+
+
+def _bootstrap_weights(rng, size, count):
+    '''count bootstrap samples of size pixels: how many times each pixel was drawn.'''
+    return np.stack([np.bincount(rng.integers(0, size, size), minlength=size) for _ in range(count)]).astype(np.float64)
+
+
+def _kfold_weights(rng, size, folds):
+    '''One row per fold, 1 for the pixels in that fold, from a random split into folds of (nearly) equal size.'''
+    fold = np.empty(size, dtype=np.int64)
+    fold[rng.permutation(size)] = np.arange(size) % folds
+    return (fold[None, :] == np.arange(folds)[:, None]).astype(np.float64)
+
+
+def _run_block(task):
+    '''Sums of the training and left out pixels of one block of replicates, for every group. Runs on a worker.'''
+    source, offsets, method, count, folds, seed = task
+    F = np.load(source, mmap_mode='r') if isinstance(source, str) else source
+    rng = np.random.default_rng(seed)
+    groups = len(offsets) - 1
+    train = np.zeros((count, groups, F.shape[1]))
+    test = np.zeros((count, groups, F.shape[1]))
+    with stage('resample_block', rows_in=count * (offsets[-1] - offsets[0])):
+        for g in range(groups):
+            size = offsets[g + 1] - offsets[g]
+            if size == 0:
+                continue
+            Fg = np.asarray(F[offsets[g]:offsets[g + 1]])
+            if method == 'bootstrap':
+                drawn = _bootstrap_weights(rng, size, count)
+                train[:, g] = drawn @ Fg
+                test[:, g] = (drawn == 0).astype(np.float64) @ Fg
+            else:
+                in_fold = _kfold_weights(rng, size, folds)
+                test[:, g] = in_fold @ Fg
+                train[:, g] = Fg.sum(axis=0) - test[:, g]
+    return train, test
+
+
+def _run_worker_block(task):
+    #The forked worker has its own copy of the recorder, so its new records go back with the result
+    recorder = instrument.active_recorder()
+    if recorder is None:
+        return _run_block(task), []
+    mark = len(recorder.records)
+    return _run_block(task), recorder.records[mark:]
+
+
+def _tasks(source, offsets, method, replicates, folds, random_state):
+    #Bootstrap replicates go in blocks of BLOCK, each repeat of a K-fold split is one task of folds replicates
+    if method == 'bootstrap':
+        counts = [min(BLOCK, replicates - start) for start in range(0, replicates, BLOCK)]
+    else:
+        counts = [folds] * replicates
+    seeds = np.random.SeedSequence(random_state).spawn(len(counts))
+    return [(source, offsets, method, count, folds, seed) for count, seed in zip(counts, seeds)]
+
+
+def _run(tasks, scheduler, workers):
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if scheduler == 'sync' or workers == 1:
+        return [_run_block(task) for task in tasks]
+    if scheduler not in ('threads', 'processes'):
+        raise ValueError("scheduler must be 'processes', 'threads' or 'sync', not %r" % scheduler)
+    if scheduler == 'threads':
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(_run_block, tasks))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        results = list(pool.map(_run_worker_block, tasks))
+    recorder = instrument.active_recorder()
+    if recorder is not None:
+        for _, records in results:
+            recorder.add_records(records)
+    return [block for block, _ in results]
+
+
+def resample_regression(FL_Data, by=('Severity_Label',), responses=RESPONSES, x='Burn_Scar_Age', models=MODELS,
+                        method='bootstrap', replicates=1000, folds=5, random_state=0, confidence=0.95,
+                        scheduler='processes', workers=None):
+    '''
+    Refit the models of batch_regression on resampled pixels and summarise the spread of the results.
+
+    method is 'bootstrap', with replicates samples of every group drawn with replacement, or 'kfold', with
+    replicates repeats of a split of every group into folds. The fits use the bootstrap sample or the training
+    folds, RMSE and R-squared are computed on the pixels left out.
+
+    Returns two tables. The summary has one row per group, response, model and statistic (intercept, coef_x1,
+    coef_x2, rmse, r2): the estimate on every pixel (in-sample for the scores), the mean and standard deviation over
+    the replicates and the percentile confidence interval (low, high). The replicates table holds every replicate.
+    '''
+    if method not in ('bootstrap', 'kfold'):
+        raise ValueError("method must be 'bootstrap' or 'kfold', not %r" % method)
+    by, responses = list(by), list(responses)
+    degree = max(models.values())
+    if scheduler == 'processes' and 'fork' not in multiprocessing.get_all_start_methods():
+        scheduler = 'sync'
+
+    with stage('resample_features', rows_in=len(FL_Data)) as s:
+        codes, groups = _group_codes(FL_Data, by)
+        Y = FL_Data[responses].to_numpy(dtype=np.float64)
+        xv = FL_Data[x].to_numpy(dtype=np.float64)
+        codes = np.where(np.isnan(xv) | np.isnan(Y).any(axis=1), -1, codes)
+        order = np.argsort(codes, kind='stable')
+        order = order[codes[order] >= 0]
+        offsets = np.searchsorted(codes[order], np.arange(len(groups) + 1))
+        #Centring x keeps the sums of x^4 well conditioned, as in batch_regression
+        shift = xv[order].mean() if len(order) else 0.0
+        F = feature_matrix(xv[order] - shift, Y[order], degree)
+        s.rows_out = len(F)
+
+    folder = None
+    try:
+        source = F
+        if scheduler == 'processes':
+            folder = tempfile.mkdtemp(prefix='fl_resample_')
+            source = os.path.join(folder, FEATURE_FILE)
+            np.save(source, F)
+            del F
+        with stage('resample', rows_in=len(order)):
+            blocks = _run(_tasks(source, offsets, method, replicates, folds, random_state), scheduler, workers)
+    finally:
+        if folder:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    with stage('resample_solve'):
+        train = np.concatenate([block[0] for block in blocks])
+        test = np.concatenate([block[1] for block in blocks])
+        n_replicates = len(train)
+        train_fit = _moments(train.reshape(-1, train.shape[-1]), len(responses), degree)
+        test_fit = _moments(test.reshape(-1, test.shape[-1]), len(responses), degree)
+        frames = []
+        for model, model_degree in models.items():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                coefs = solve_moments(train_fit, model_degree)
+                sse = residual_sum_of_squares(test_fit, coefs)
+                rmse = np.sqrt(np.maximum(sse, 0) / test_fit['n'][:, None])
+                r2 = 1 - sse / total_sum_of_squares(test_fit)
+            coefs = _unshift(coefs, shift)
+            shape = (n_replicates, len(groups), len(responses))
+            for r, response in enumerate(responses):
+                frame = pd.concat([groups] * n_replicates, ignore_index=True)
+                frame.insert(0, 'replicate', np.repeat(np.arange(n_replicates), len(groups)))
+                frame['response'] = response
+                frame['model'] = model
+                frame['n_train'] = train_fit['n']
+                frame['n_test'] = test_fit['n']
+                frame['intercept'] = coefs[:, r, 0]
+                frame['coef_x1'] = coefs[:, r, 1]
+                frame['coef_x2'] = coefs[:, r, 2] if model_degree > 1 else np.nan
+                frame['rmse'] = rmse.reshape(shape)[:, :, r].ravel()
+                frame['r2'] = r2.reshape(shape)[:, :, r].ravel()
+                frames.append(frame)
+        replicates_table = pd.concat(frames, ignore_index=True)
+        replicates_table = replicates_table.sort_values(['replicate'], kind='stable').reset_index(drop=True)
+
+    estimate = batch_regression(FL_Data, by=by, responses=responses, x=x, models=models)
+    return summarise(replicates_table, estimate, by, confidence), replicates_table
+
+
+def summarise(replicates_table, estimate, by=('Severity_Label',), confidence=0.95):
+    '''Mean, standard deviation and percentile interval of every statistic over the replicates.'''
+    keys = list(by) + ['response', 'model']
+    tail = (1 - confidence) / 2
+    long = replicates_table.melt(id_vars=keys + ['replicate'], value_vars=STATISTICS, var_name='statistic')
+    grouped = long.groupby(keys + ['statistic'], observed=True, sort=False)['value']
+    summary = pd.concat([grouped.mean().rename('mean'), grouped.std().rename('sd'),
+                         grouped.quantile(tail).rename('low'), grouped.quantile(1 - tail).rename('high')], axis=1)
+    point = estimate.melt(id_vars=keys, value_vars=STATISTICS, var_name='statistic', value_name='estimate')
+    summary = point.join(summary, on=keys + ['statistic'], how='right')
+    #Rows follow the groups, responses and models of batch_regression, then the statistics in order
+    summary['_statistic'] = summary['statistic'].map({name: i for i, name in enumerate(STATISTICS)})
+    summary = summary.sort_values(keys + ['_statistic'], kind='stable')
+    return summary.drop(columns='_statistic').reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bootstrap or repeated K-fold confidence intervals of the recovery '
+                                                 'models.')
+    parser.add_argument('directory', help='folder with the eight TIFFs')
+    parser.add_argument('--method', choices=['bootstrap', 'kfold'], default='bootstrap')
+    parser.add_argument('--replicates', type=int, default=1000, help='bootstrap samples or repeats of the K-fold split')
+    parser.add_argument('--folds', type=int, default=5, help='folds of the K-fold split')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the resampling')
+    parser.add_argument('--confidence', type=float, default=0.95, help='level of the confidence intervals')
+    parser.add_argument('--scheduler', choices=['processes', 'threads', 'sync'], default='processes')
+    parser.add_argument('--workers', type=int, default=None, help='defaults to the number of cores')
+    parser.add_argument('--backend', choices=['auto'] + list(BACKENDS), default=settings.RASTER_BACKEND,
+                        help='raster reader')
+    parser.add_argument('--out-prefix', default='', help='prefix of the CSV files written')
+    args = parser.parse_args(argv)
+
+    FL_Data = read_pixel_table(args.directory, backend=args.backend)
+    FL_Data = FL_Data[FL_Data['Severity_Label'].notna()]
+    summary, replicates = resample_regression(FL_Data, method=args.method, replicates=args.replicates,
+                                              folds=args.folds, random_state=args.seed, confidence=args.confidence,
+                                              scheduler=args.scheduler, workers=args.workers)
+    print(summary.to_string(index=False))
+    summary.to_csv(args.out_prefix + 'Resampled_Summary.csv', index=False)
+    replicates.to_csv(args.out_prefix + 'Resampled_Replicates.csv', index=False)
+    print('Wrote %sResampled_Summary.csv and %sResampled_Replicates.csv' % (args.out_prefix, args.out_prefix))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+'''
+Run the fire recovery pipeline over many scenes on a process pool.
+
+The analysis script works on one folder of eight rasters. Here a manifest lists any number of scene folders, or
+strips of rows of one large mosaic, and each one goes through the Part 1 table build and the regression stage in
+its own worker process. The results are merged into one summary table in manifest order.
+
+The manifest is a CSV file:
+
+    scene,directory,row_start,row_end
+    apalachicola,data/apalachicola,,
+    osceola_north,data/osceola,0,4096
+    osceola_south,data/osceola,4096,8192
+
+row_start and row_end are optional. Relative directories are relative to the manifest file.
+
+Run from the repository folder with:
+
+    python -m fl_carbon.scenes manifest.csv --workers 8 --out summary.csv
+'''
+
+import argparse
+import multiprocessing
+import os
+
+import pandas as pd
+
+from . import settings
+from .cache import cached_pixel_table
+from .raster import read_pixel_table
+from .readers import BACKENDS
+from .regression import regression_table
+
+
+def read_manifest(path):
+    '''Read a scene manifest into a list of dicts with scene, directory and rows.'''
+    manifest = pd.read_csv(path, dtype={'scene': str, 'directory': str})
+    base = os.path.dirname(os.path.abspath(path))
+    entries = []
+    for record in manifest.to_dict('records'):
+        rows = None
+        if pd.notna(record.get('row_start', None)) and pd.notna(record.get('row_end', None)):
+            rows = (int(record['row_start']), int(record['row_end']))
+        entries.append({'scene': record['scene'], 'directory': os.path.join(base, record['directory']), 'rows': rows})
+    return entries
+
+
+def process_scene(task):
+    '''
+    Build the pixel table of one scene and run its regressions.
+
+    Runs inside a worker process, so it takes one picklable (entry, options) tuple.
+    '''
+    entry, options = task
+    settings_used = {'window_rows': options['window_rows'], 'excluded_years': options['excluded_years'],
+                     'forest_code': options['forest_code'], 'rows': entry['rows'], 'backend': options['backend']}
+    if options['cache_dir']:
+        FL_Data = cached_pixel_table(entry['directory'], cache_dir=options['cache_dir'], **settings_used)
+    else:
+        FL_Data = read_pixel_table(entry['directory'], **settings_used)
+    table = regression_table(FL_Data, random_state=options['random_state'], aggregate=options['aggregate'])
+    table.insert(0, 'scene', entry['scene'])
+    table.insert(1, 'pixels', len(FL_Data))
+    return table
+
+
+def run_scenes(entries, workers=None, window_rows=settings.WINDOW_ROWS, excluded_years=settings.EXCLUDED_BURN_YEARS,
+               forest_code=settings.LONGLEAF_SLASH_PINE, random_state=0, cache_dir=None, aggregate=False,
+               backend=settings.RASTER_BACKEND):
+    '''
+    Process every scene on a pool of worker processes and merge the results.
+
+    Each worker handles one scene and is then replaced, so memory held by a large scene is returned to the system
+    before the next one starts. Results come back in manifest order, and the train/test splits use a fixed seed, so
+    the summary is the same from run to run. With a cache_dir, each scene reuses its cached pixel table. With
+    aggregate=True the regressions are fit from per-age summaries instead of the pixels.
+    '''
+    options = {'window_rows': window_rows, 'excluded_years': excluded_years, 'forest_code': forest_code,
+               'random_state': random_state, 'cache_dir': cache_dir, 'aggregate': aggregate, 'backend': backend}
+    tasks = [(entry, options) for entry in entries]
+    workers = min(workers or os.cpu_count() or 1, max(len(tasks), 1))
+    with multiprocessing.Pool(processes=workers, maxtasksperchild=1) as pool:
+        tables = list(pool.imap(process_scene, tasks, chunksize=1))
+    return pd.concat(tables, ignore_index=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the carbon recovery analysis over many scenes.')
+    parser.add_argument('manifest', help='CSV file with scene, directory and optional row_start, row_end columns')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to the number of cores')
+    parser.add_argument('--window-rows', type=int, default=settings.WINDOW_ROWS, help='raster rows read at once')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the train/test splits')
+    parser.add_argument('--cache-dir', default=None, help='cache folder for the cleaned tables, inside each scene')
+    parser.add_argument('--aggregate', action='store_true', help='fit the regressions from per-age summaries')
+    parser.add_argument('--backend', choices=['auto'] + list(BACKENDS), default=settings.RASTER_BACKEND,
+                        help='raster reader')
+    parser.add_argument('--out', default='Scene_Summary.csv', help='where to write the summary table')
+    args = parser.parse_args(argv)
+
+    summary = run_scenes(read_manifest(args.manifest), workers=args.workers, window_rows=args.window_rows,
+                         random_state=args.seed, cache_dir=args.cache_dir,
+                         aggregate=args.aggregate, backend=args.backend)
+    summary.to_csv(args.out, index=False)
+    print('Wrote %d rows for %d scenes to %s' % (len(summary), summary['scene'].nunique(), args.out))
+
+
+if __name__ == '__main__':
+    main()
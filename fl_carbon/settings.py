@@ -0,0 +1,59 @@
+'''
+Shared settings for the Florida fire study.
+
+These are the values that used to live inline in Full_Carbon_Analysis_Script_Python_File.py. Keeping them here
+lets the raster reader, the filters and the analysis script agree on file names, column order and filter choices.
+'''
+
+#Each column of the pixel table and the TIFF it is read from. The order matches the original vstack.
+#AGB = Aboveground Biomass
+#NEP = Net Ecosystem Productivity
+#Forest Type = Numeric Code for Forest Type
+#Burn Year = # of Years after 1970 when the area was burned
+LAYER_FILES = {
+    'AGB_1990': 'Smaller_FL_agb_1990.tif',
+    'AGB_2000': 'Smaller_FL_agb_2000.tif',
+    'AGB_2010': 'Smaller_FL_agb_2010.tif',
+    'Forest_Type': 'Smaller_FL_forest_group_NAFD.tif',
+    'NEP_1990': 'Smaller_FL_nep_1990.tif',
+    'NEP_2000': 'Smaller_FL_nep_2000.tif',
+    'NEP_2010': 'Smaller_FL_nep_2010.tif',
+    'Burn_Year': 'Smaller_FL_years_disturb_MTSB.tif',
+}
+
+COLUMNS = list(LAYER_FILES)
+
+#Burn_Year counts years after this one
+BURN_YEAR_ORIGIN = 1970
+
+#The AGB and NEP columns of each epoch, in time order. Burn_Severity and NEP_Change compare the epochs on either side
+#of each fire, so more epochs (for example annual layers) can be added here along with their files above.
+#A fire before the first epoch has no pre-fire AGB, so its severity is NaN and the pixel is dropped. (The original
+#script gave such fires the 1990 - 2000 severity. The Apalachicola layer has none apart from the excluded 1986.)
+AGB_EPOCHS = {1990: 'AGB_1990', 2000: 'AGB_2000', 2010: 'AGB_2010'}
+NEP_EPOCHS = {1990: 'NEP_1990', 2000: 'NEP_2000', 2010: 'NEP_2010'}
+EPOCH_YEARS = sorted(AGB_EPOCHS)
+
+#Burn_Year values outside of 1991 - 2009: 0 (No fire), 16 (1986), 20 (1990), and 40 (2010).
+EXCLUDED_BURN_YEARS = (0, 16, 20, 40)
+
+#NAFD code for Longleaf/Slash Pine, the forest type kept for the analysis.
+LONGLEAF_SLASH_PINE = 140
+
+#Severity bins, based on the percent of aboveground biomass lost.
+BS_LABELS = ['Low', 'Moderate', 'Severe']
+CUT_BINS = [0, 30, 70, 100]
+
+#NAFD forest group names and their numeric codes.
+FOREST_TYPE_LIST = ['White/Red/Jack Pine', 'Spruce/Fir', 'Longleaf/Slash Pine', 'Loblolly/Shortleaf Pine', 'Pinyon/Juniper', 'Oak/Pine', 'Oak/Hickory', 'Oak/Gum/Cypress', 'Elm/Ash/Cottonwood', 'Maple/Beech/Birch', 'Tropical Hardwoods', 'Exotic Hardwoods']
+CODE_LIST = [100, 120, 140, 160, 180, 400, 500, 600, 700, 800, 980, 990]
+
+#Nodata values of layers whose TIFFs have no GDAL_NODATA tag, for example {'Forest_Type': 0}. Tagged values are read
+#from the files (see validity.py).
+NODATA = {}
+
+#Number of raster rows read at once by the streaming reader.
+WINDOW_ROWS = 512
+
+#Raster reader: 'auto' uses rasterio or tifffile when installed and PIL otherwise (see readers.py).
+RASTER_BACKEND = 'auto'
@@ -0,0 +1,196 @@
+'''
+Spatial queries over the pixel table.
+
+The index of FL_Data is the flat pixel index in the full scene, so every cleaned pixel still knows its raster row
+and column: row = index // width and col = index % width. With the grid of the scene (raster.scene_grid) these become
+map coordinates, so a sub-area such as one ranger district or a buffer around a fire perimeter can be cut out of the
+cleaned table instead of clipping the rasters again and rerunning the script.
+
+SpatialIndex sorts the pixels of the table by square blocks of the raster. All blocks of one block row sit next to
+each other in that order, so the pixels under a bounding box are a few contiguous slices, one per block row, and
+only those are tested against the box or the polygon:
+
+    grid = read_grid('.')
+    index = SpatialIndex(FL_Data, grid)
+    subset = index.within(district, Severity_Label='Severe', Forest_Type='Longleaf/Slash Pine')
+
+Coordinates are those of the rasters' coordinate system (grid['crs']). A pixel belongs to a box or polygon when its
+centre does. Rasters without georeferencing are queried in pixel units, x being the column and y the row.
+'''
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from . import settings
+from .classify import category_mask
+from .instrument import stage
+from .raster import open_layers, scene_grid
+
+#Side of the square blocks of the index, in pixels
+BLOCK_SIZE = 256
+
+#Geotransform used for rasters without georeferencing: one unit per pixel, y growing downwards
+PIXEL_GEOTRANSFORM = (0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
+
+
+def read_grid(directory, backend=settings.RASTER_BACKEND):
+    '''Shape, geotransform and coordinate system of the scene in directory. Only the TIFF headers are read.'''
+    return scene_grid(open_layers(directory, backend=backend))
+
+
+def _geotransform(grid):
+    gt = grid.get('geotransform') or PIXEL_GEOTRANSFORM
+    if gt[2] != 0 or gt[4] != 0:
+        raise ValueError('Rotated rasters are not supported, the geotransform is %s' % (gt,))
+    return gt
+
+
+def pixel_coordinates(FL_Data, grid):
+    '''
+    Raster row and column and the map coordinates of the pixel centre of every row of the pixel table.
+
+    Returns a DataFrame with the index of FL_Data and the columns Row, Col, X and Y.
+    '''
+    gt = _geotransform(grid)
+    rows, cols = np.divmod(FL_Data.index.to_numpy(), grid['shape'][1])
+    return pd.DataFrame({'Row': rows.astype(np.int32), 'Col': cols.astype(np.int32),
+                         'X': gt[0] + (cols + 0.5) * gt[1], 'Y': gt[3] + (rows + 0.5) * gt[5]},
+                        index=FL_Data.index)
+
+
+def polygon_rings(polygon):
+    '''
+    The rings of a polygon as a list of polygons, each a list of rings of (x, y) vertices, the exterior first.
+
+    polygon is a list of (x, y) vertices, a GeoJSON Polygon or MultiPolygon (a dict, or any object with
+    __geo_interface__ such as a shapely geometry) or a GeoJSON Feature or FeatureCollection of them.
+    '''
+    if hasattr(polygon, '__geo_interface__'):
+        polygon = polygon.__geo_interface__
+    if not isinstance(polygon, dict):
+        return [[np.asarray(polygon, dtype=np.float64)]]
+    kind = polygon.get('type')
+    if kind == 'FeatureCollection':
+        return [part for feature in polygon['features'] for part in polygon_rings(feature)]
+    if kind == 'Feature':
+        return polygon_rings(polygon['geometry'])
+    if kind == 'Polygon':
+        return [[np.asarray(ring, dtype=np.float64)[:, :2] for ring in polygon['coordinates']]]
+    if kind == 'MultiPolygon':
+        return [[np.asarray(ring, dtype=np.float64)[:, :2] for ring in part] for part in polygon['coordinates']]
+    raise ValueError('Expected a Polygon or MultiPolygon, got %r' % kind)
+
+
+def read_geojson(path):
+    '''Read a GeoJSON file, for example a district boundary exported from TerrSet or QGIS.'''
+    with open(path) as f:
+        return json.load(f)
+
+
+def _contains(rings, x, y):
+    #Inside the exterior ring and outside every hole. matplotlib is already needed for the figures.
+    from matplotlib.path import Path
+    points = np.column_stack([x, y])
+    inside = Path(rings[0]).contains_points(points)
+    for hole in rings[1:]:
+        inside &= ~Path(hole).contains_points(points)
+    return inside
+
+
+class SpatialIndex:
+    '''
+    Block index of the pixels of a pixel table, for bounding box and polygon queries.
+
+    The index holds the positions of the rows of FL_Data, so build a new one after rows are dropped or reordered.
+    It takes 16 bytes per pixel.
+    '''
+
+    def __init__(self, FL_Data, grid, block_size=BLOCK_SIZE):
+        self.FL_Data = FL_Data
+        self.grid = grid
+        self.gt = _geotransform(grid)
+        self.block_size = block_size
+        height, width = grid['shape']
+        self.blocks_across = -(-width // block_size)
+        blocks_down = -(-height // block_size)
+        with stage('spatial_index', rows_in=len(FL_Data)):
+            rows, cols = np.divmod(FL_Data.index.to_numpy(), width)
+            block = (rows // block_size) * self.blocks_across + cols // block_size
+            self.order = np.argsort(block, kind='stable')
+            self.rows = rows[self.order].astype(np.int32)
+            self.cols = cols[self.order].astype(np.int32)
+            counts = np.bincount(block, minlength=blocks_down * self.blocks_across)
+            self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    @classmethod
+    def from_scene(cls, FL_Data, directory, backend=settings.RASTER_BACKEND, block_size=BLOCK_SIZE):
+        '''Index FL_Data with the grid of the scene it was read from.'''
+        return cls(FL_Data, read_grid(directory, backend), block_size)
+
+    def _pixel_range(self, origin, size, low, high, length):
+        #First and last pixel whose centre lies between low and high along one axis
+        a, b = (low - origin) / size - 0.5, (high - origin) / size - 0.5
+        a, b = min(a, b), max(a, b)
+        return max(int(np.ceil(a)), 0), min(int(np.floor(b)), length - 1)
+
+    def _candidates(self, xmin, ymin, xmax, ymax):
+        '''Positions in index order, rows and columns of the pixels whose centre is inside the box.'''
+        height, width = self.grid['shape']
+        c0, c1 = self._pixel_range(self.gt[0], self.gt[1], xmin, xmax, width)
+        r0, r1 = self._pixel_range(self.gt[3], self.gt[5], ymin, ymax, height)
+        if c0 > c1 or r0 > r1:
+            return np.empty(0, dtype=np.int64)
+        b = self.block_size
+        slices = [np.arange(self.offsets[br * self.blocks_across + c0 // b],
+                            self.offsets[br * self.blocks_across + c1 // b + 1])
+                  for br in range(r0 // b, r1 // b + 1)]
+        found = np.concatenate(slices)
+        rows, cols = self.rows[found], self.cols[found]
+        return found[(rows >= r0) & (rows <= r1) & (cols >= c0) & (cols <= c1)]
+
+    def _where(self, found, equals):
+        #Keep the candidates whose columns hold the requested values. Categoricals are compared by code.
+        for name, values in equals.items():
+            values = [values] if np.isscalar(values) or values is None else list(values)
+            column = self.FL_Data[name]
+            positions = self.order[found]
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                found = found[category_mask(column.iloc[positions], values)]
+            else:
+                found = found[np.isin(column.to_numpy()[positions], values)]
+        return found
+
+    def _rows(self, found):
+        return self.FL_Data.iloc[np.sort(self.order[found])]
+
+    def bbox(self, xmin, ymin, xmax, ymax, **equals):
+        '''
+        Rows of the pixel table with their pixel centre inside the box, in the order of the table.
+
+        Keyword arguments keep only the rows where a column holds a value, or one of a list of values, for example
+        Severity_Label='Severe'.
+        '''
+        with stage('spatial_query') as s:
+            found = self._where(self._candidates(xmin, ymin, xmax, ymax), equals)
+            s.rows_out = len(found)
+            return self._rows(found)
+
+    def within(self, polygon, **equals):
+        '''
+        Rows of the pixel table with their pixel centre inside the polygon, in the order of the table.
+
+        polygon is anything polygon_rings accepts. Keyword arguments filter the rows as in bbox().
+        '''
+        with stage('spatial_query') as s:
+            parts = []
+            for rings in polygon_rings(polygon):
+                (xmin, ymin), (xmax, ymax) = rings[0].min(axis=0), rings[0].max(axis=0)
+                found = self._where(self._candidates(xmin, ymin, xmax, ymax), equals)
+                x = self.gt[0] + (self.cols[found] + 0.5) * self.gt[1]
+                y = self.gt[3] + (self.rows[found] + 0.5) * self.gt[5]
+                parts.append(found[_contains(rings, x, y)])
+            found = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+            s.rows_out = len(found)
+            return self._rows(found)
@@ -0,0 +1,115 @@
+'''
+Stratified analysis over every forest type and severity class.
+
+The script keeps only Longleaf/Slash Pine and drops the Low severity pixels before anything is fit, so results for
+Oak/Pine or Loblolly/Shortleaf Pine meant changing the filters and running everything again. Here the table is
+cleaned once with every forest type and every severity class kept (stratified_table), and stratified_analysis then
+goes over it once. The forest type, severity and burn scar age codes of every pixel are combined into one integer
+cell number, and np.bincount adds up the count, sum and sum of squares of each response in every cell. From these:
+
+- Counts, the pixels of every forest type x severity stratum,
+- Summary, the count, mean and variance of every response at every burn scar age of every stratum, the same layout
+  as age_summary(FL_Data, by=['Forest_Type', 'Severity_Label']),
+- Results, the linear and quadratic fits of every stratum (batch_regression_from_summary, in-sample).
+
+The original Longleaf-only result is then a selection on the output:
+
+    Counts, Summary, Results = stratified_analysis(stratified_table('.'))
+    select_stratum(Results, forest_type='Longleaf/Slash Pine', severity=['Moderate', 'Severe'])
+
+Pixels whose forest code is not in the code table, or whose severity is outside the bins, are in no stratum.
+'''
+
+import numpy as np
+import pandas as pd
+
+from . import settings
+from .classify import category_mask
+from .instrument import stage
+from .regression import MODELS, RESPONSES, _group_codes, batch_regression_from_summary
+
+#Columns of the strata
+STRATA = ['Forest_Type', 'Severity_Label']
+
+
+def stratified_table(directory, cache_dir='FL_Cache', window_rows=settings.WINDOW_ROWS,
+                     excluded_years=settings.EXCLUDED_BURN_YEARS, cut_bins=settings.CUT_BINS,
+                     bs_labels=settings.BS_LABELS, backend=settings.RASTER_BACKEND):
+    '''
+    The pixel table of a scene with every forest type and severity class kept, read through the cache.
+
+    The burn year and AGB loss filters still apply. Without cache_dir the rasters are read directly.
+    '''
+    options = {'window_rows': window_rows, 'excluded_years': excluded_years, 'forest_code': None, 'drop_low': False,
+               'cut_bins': cut_bins, 'bs_labels': bs_labels, 'backend': backend}
+    if cache_dir is None:
+        from .raster import read_pixel_table
+        return read_pixel_table(directory, **options)
+    from .cache import cached_pixel_table
+    return cached_pixel_table(directory, cache_dir=cache_dir, **options)
+
+
+def _stratum_cells(FL_Data, by, x, responses):
+    '''Per-age summary of every stratum from one bincount pass over integer cell numbers.'''
+    codes, groups = _group_codes(FL_Data, by)
+    age_codes, ages = pd.factorize(FL_Data[x], sort=True)
+    n_cells = len(groups) * len(ages)
+    #Pixels in no stratum, or without an age, go to one extra cell which is cut off below
+    cells = np.where((codes >= 0) & (age_codes >= 0), codes * len(ages) + age_codes, n_cells)
+
+    count = np.bincount(cells, minlength=n_cells + 1)[:n_cells]
+    kept = np.flatnonzero(count)
+    summary = groups.iloc[kept // len(ages)].reset_index(drop=True)
+    for name in by:
+        column = FL_Data[name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            summary[name] = pd.Categorical(summary[name], categories=column.cat.categories,
+                                           ordered=column.cat.ordered)
+    summary[x] = ages[kept % len(ages)]
+    summary['count'] = count[kept]
+    n = count[kept].astype(np.float64)
+    means, variances = {}, {}
+    for response in responses:
+        values = FL_Data[response].to_numpy(dtype=np.float64)
+        sums = np.bincount(cells, weights=values, minlength=n_cells + 1)[kept]
+        squares = np.bincount(cells, weights=values * values, minlength=n_cells + 1)[kept]
+        means[response + '_mean'] = sums / n
+        variances[response + '_var'] = np.maximum(squares / n - (sums / n) ** 2, 0)
+    for name, values in list(means.items()) + list(variances.items()):
+        summary[name] = values
+    return summary
+
+
+def stratified_analysis(FL_Data, by=STRATA, x='Burn_Scar_Age', responses=RESPONSES, models=MODELS):
+    '''
+    Counts, per-age summary and regression fits of every stratum of the by columns, from one pass over FL_Data.
+
+    Returns (Counts, Summary, Results). Strata without pixels are left out of all three. The fits report in-sample
+    RMSE and R-squared; batch_regression(FL_Data, by=STRATA, test_size=...) gives held out scores instead.
+    '''
+    by = list(by)
+    with stage('strata_summary', rows_in=len(FL_Data)) as s:
+        Summary = _stratum_cells(FL_Data, by, x, responses)
+        s.rows_out = len(Summary)
+    Counts = Summary.groupby(by, observed=True, sort=True)['count'].sum().reset_index()
+    Results = batch_regression_from_summary(Summary, by, responses, x, models)
+    Results = Results[Results['n'] > 0].reset_index(drop=True)
+    return Counts, Summary, Results
+
+
+def select_stratum(table, forest_type=None, severity=None):
+    '''
+    Rows of a Counts, Summary or Results table of one forest type and severity, or of lists of them.
+
+    None keeps every value of that column.
+    '''
+    keep = np.ones(len(table), dtype=bool)
+    for name, values in (('Forest_Type', forest_type), ('Severity_Label', severity)):
+        if values is None:
+            continue
+        column = table[name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            keep &= category_mask(column, values)
+        else:
+            keep &= column.isin([values] if np.isscalar(values) else list(values)).to_numpy()
+    return table[keep].reset_index(drop=True)
@@ -0,0 +1,344 @@
+'''
+Synthetic scenes of the eight co-registered layers, for benchmarks.
+
+The layers are written strip by strip as uncompressed striped TIFFs, so a scene of a gigapixel never has to fit in
+memory. The values follow the real layers closely enough for the filters to keep a realistic share of pixels:
+
+- Forest_Type comes in square stands of one NAFD code, mostly Longleaf/Slash Pine, with a few non-forest stands
+  (code 0, no biomass).
+- Burn_Year comes from round fire scars, each with one year and a mean severity. Most pixels never burn.
+- AGB grows a little every decade and loses the burned fraction of its biomass in the decade of the fire, so the
+  AGB-loss filter and the severity bins see the same kind of values as in the Apalachicola scene.
+- NEP dips after severe fires and recovers with the age of the burn scar.
+
+The scenes are georeferenced like the real layers: 30 m pixels in the Albers equal area projection (EPSG:5070).
+compress_scene rewrites a scene as internally tiled, deflate compressed GeoTIFFs with tifffile, to benchmark the
+decoders on inputs like the ORNL downloads.
+
+Write a scene from the repository folder with:
+
+    python -m fl_carbon.synthetic scene_dir --megapixels 100 [--compression zlib]
+'''
+
+import argparse
+import json
+import os
+import shutil
+import struct
+import tempfile
+
+import numpy as np
+
+from . import settings
+
+#Side of the square forest stands, in pixels
+STAND_SIZE = 64
+
+#Share of the scene inside fire scars, and the range of scar radii in pixels
+BURNED_FRACTION = 0.15
+FIRE_RADIUS = (8, 60)
+
+#Pixels per strip of the written TIFFs
+STRIP_PIXELS = 1 << 20
+
+#Description of the scene, written next to the TIFFs so a benchmark can reuse it
+SCENE_FILE = 'synthetic.json'
+
+#TIFF field types and the layer dtypes the writer supports
+SHORT, LONG, DOUBLE, LONG8 = 3, 4, 12, 16
+SAMPLE_FORMAT = {'u': 1, 'i': 2, 'f': 3}
+
+#Grid of the synthetic scenes: 30 m pixels of NAD83 / Conus Albers, with the top left corner in north Florida
+PIXEL_SIZE = 30.0
+ORIGIN = (840000.0, 930000.0)
+EPSG = 5070
+
+#Side of the tiles of compressed scenes
+TILE_SIZE = 256
+
+LAYER_DTYPES = {'AGB_1990': np.float32, 'AGB_2000': np.float32, 'AGB_2010': np.float32, 'Forest_Type': np.uint16,
+                'NEP_1990': np.float32, 'NEP_2000': np.float32, 'NEP_2010': np.float32, 'Burn_Year': np.uint8}
+
+
+class StripTiffWriter:
+    '''
+    Minimal writer of a single band, uncompressed, striped, little-endian TIFF.
+
+    Strips are appended in order with write_rows and the directory is written at the end by close. Files that
+    would pass 4 GB are written as BigTIFF.
+    '''
+
+    def __init__(self, path, width, height, dtype, rows_per_strip, geotags=None):
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.width, self.height, self.rows_per_strip = width, height, rows_per_strip
+        self.geotags = geotags or []
+        self.bigtiff = width * height * self.dtype.itemsize > (1 << 32) - (1 << 24)
+        self.offsets, self.counts = [], []
+        self.rows_written = 0
+        self.f = open(path, 'wb')
+        if self.bigtiff:
+            self.f.write(struct.pack('<2sHHHQ', b'II', 43, 8, 0, 0))
+        else:
+            self.f.write(struct.pack('<2sHI', b'II', 42, 0))
+
+    def write_rows(self, rows):
+        '''Append a whole strip of rows, or the last, shorter strip.'''
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        if rows.shape[1] != self.width:
+            raise ValueError('Expected rows of %d pixels, got %d' % (self.width, rows.shape[1]))
+        self.offsets.append(self.f.tell())
+        self.counts.append(rows.nbytes)
+        self.f.write(rows.tobytes())
+        self.rows_written += rows.shape[0]
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError('Wrote %d of %d rows' % (self.rows_written, self.height))
+        long_type = LONG8 if self.bigtiff else LONG
+        entries = [
+            (256, LONG, [self.width]),
+            (257, LONG, [self.height]),
+            (258, SHORT, [self.dtype.itemsize * 8]),
+            (259, SHORT, [1]),
+            (262, SHORT, [1]),
+            (273, long_type, self.offsets),
+            (277, SHORT, [1]),
+            (278, LONG, [self.rows_per_strip]),
+            (279, long_type, self.counts),
+            (284, SHORT, [1]),
+            (339, SHORT, [SAMPLE_FORMAT[self.dtype.kind]]),
+        ] + self.geotags
+        self._write_directory(entries)
+        self.f.close()
+
+    def _write_directory(self, entries):
+        if self.f.tell() % 2:
+            self.f.write(b'\0')
+        count_format, entry_format, value_size = ('<Q', '<HHQ', 8) if self.bigtiff else ('<H', '<HHI', 4)
+        packing = {SHORT: 'H', LONG: 'I', DOUBLE: 'd', LONG8: 'Q'}
+        ifd = self.f.tell()
+        #Values too long for their entry go after the directory
+        extra = ifd + struct.calcsize(count_format) + len(entries) * (struct.calcsize(entry_format) + value_size) \
+            + value_size
+        directory, overflow = [struct.pack(count_format, len(entries))], []
+        for tag, field_type, values in entries:
+            data = struct.pack('<%d%s' % (len(values), packing[field_type]), *values)
+            directory.append(struct.pack(entry_format, tag, field_type, len(values)))
+            if len(data) <= value_size:
+                directory.append(data.ljust(value_size, b'\0'))
+            else:
+                directory.append(struct.pack('<Q' if self.bigtiff else '<I', extra))
+                overflow.append(data)
+                extra += len(data)
+        directory.append(b'\0' * value_size)
+        self.f.write(b''.join(directory + overflow))
+        self.f.seek(8 if self.bigtiff else 4)
+        self.f.write(struct.pack('<Q' if self.bigtiff else '<I', ifd))
+
+
+def geotiff_tags(origin=ORIGIN, pixel_size=PIXEL_SIZE, epsg=EPSG):
+    '''(tag, type, values) of the GeoTIFF tags for a north-up grid in a projected coordinate system.'''
+    #GTModelType = projected, GTRasterType = pixel is area, ProjectedCSType = epsg
+    keys = [1, 1, 0, 3, 1024, 0, 1, 1, 1025, 0, 1, 1, 3072, 0, 1, epsg]
+    return [
+        (33550, DOUBLE, [pixel_size, pixel_size, 0.0]),
+        (33922, DOUBLE, [0.0, 0.0, 0.0, origin[0], origin[1], 0.0]),
+        (34735, SHORT, keys),
+    ]
+
+
+def scene_plan(rows, cols, seed=0):
+    '''
+    The coarse parts of a scene, drawn once for the whole scene: the forest code of every stand and the fire scars.
+
+    Fire years follow the real layer: mostly the 1990s and 2000s, with a few older fires.
+    '''
+    rng = np.random.default_rng(seed)
+    codes = np.array([0] + list(settings.CODE_LIST), dtype=np.uint16)
+    weights = np.where(codes == settings.LONGLEAF_SLASH_PINE, 12.0, 1.0)
+    weights[0] = 0.5
+    stands = rng.choice(codes, (rows // STAND_SIZE + 1, cols // STAND_SIZE + 1), p=weights / weights.sum())
+
+    mean_area = np.pi * np.mean(np.square(np.arange(*FIRE_RADIUS)))
+    n_fires = max(1, int(round(BURNED_FRACTION * rows * cols / mean_area)))
+    #The real layer only has fires in 1986, 1990 and 1991 - 2010
+    years = np.array([16, 20] + list(range(21, 41)))
+    year_weights = np.where(years > 20, 1.0, 0.1)
+    fires = {
+        'row': rng.uniform(0, rows, n_fires),
+        'col': rng.uniform(0, cols, n_fires),
+        'radius': rng.uniform(*FIRE_RADIUS, n_fires),
+        'year': rng.choice(years, n_fires, p=year_weights / year_weights.sum()).astype(np.uint8),
+        #Mean share of biomass lost in the scar
+        'severity': rng.beta(2.0, 2.5, n_fires),
+    }
+    #Later fires are drawn over earlier ones, as the layer keeps the most recent disturbance
+    order = np.argsort(fires['year'], kind='stable')
+    fires = {key: values[order] for key, values in fires.items()}
+    return {'rows': rows, 'cols': cols, 'seed': seed, 'stands': stands, 'fires': fires}
+
+
+def _burn_strip(plan, row0, row1):
+    '''Burn_Year and severity of every pixel of rows row0 up to row1.'''
+    cols = plan['cols']
+    years = np.zeros((row1 - row0, cols), dtype=np.uint8)
+    severity = np.zeros((row1 - row0, cols), dtype=np.float32)
+    fires = plan['fires']
+    hit = np.flatnonzero((fires['row'] + fires['radius'] > row0) & (fires['row'] - fires['radius'] < row1))
+    for i in hit:
+        r, c, radius = fires['row'][i], fires['col'][i], fires['radius'][i]
+        top, bottom = max(int(r - radius), row0), min(int(r + radius) + 1, row1)
+        left, right = max(int(c - radius), 0), min(int(c + radius) + 1, cols)
+        yy, xx = np.ogrid[top:bottom, left:right]
+        inside = (yy - r) ** 2 + (xx - c) ** 2 <= radius ** 2
+        years[top - row0:bottom - row0, left:right][inside] = fires['year'][i]
+        severity[top - row0:bottom - row0, left:right][inside] = fires['severity'][i]
+    return years, severity
+
+
+def scene_strip(plan, row0, row1):
+    '''All eight layers of rows row0 up to row1, as 2D arrays.'''
+    rng = np.random.default_rng([plan['seed'], row0])
+    shape = (row1 - row0, plan['cols'])
+    stand_rows = np.arange(row0, row1) // STAND_SIZE
+    stand_cols = np.arange(plan['cols']) // STAND_SIZE
+    forest = plan['stands'][stand_rows[:, None], stand_cols[None, :]]
+    years, severity = _burn_strip(plan, row0, row1)
+    burned = years > 0
+    #Each pixel loses a share of biomass scattered around the mean severity of its scar
+    loss = np.where(burned, np.clip(severity + rng.normal(0, 0.15, shape), 0.0, 0.99), 0.0).astype(np.float32)
+    age = (40 - years.astype(np.float32))
+    regrowth = 1 + 0.04 * np.minimum(age, 20)
+
+    agb_1990 = rng.gamma(4.0, 2.0, shape).astype(np.float32)
+    agb_1990[forest == 0] = 0
+    growth_00 = rng.uniform(0.95, 1.15, shape).astype(np.float32)
+    growth_10 = rng.uniform(0.95, 1.15, shape).astype(np.float32)
+    early = burned & (years <= 30)
+    late = burned & (years > 30)
+    agb_2000 = agb_1990 * np.where(early, (1 - loss) * np.minimum(regrowth, 1 + 0.04 * (age - 10)), growth_00)
+    agb_2010 = agb_2000 * np.where(late, (1 - loss) * regrowth, growth_10)
+
+    nep = [rng.normal(100, 60, shape).astype(np.float32) for _ in range(3)]
+    #Productivity drops after a severe fire and recovers as the scar ages
+    dip = np.where(burned, 150 * loss * np.exp(-np.minimum(age, 20) / 5), 0).astype(np.float32)
+    nep[1] -= np.where(early, dip * np.exp(-np.maximum(age - 10, 0) / 5), 0).astype(np.float32)
+    nep[2] -= dip
+    for layer in nep:
+        layer[forest == 0] = 0
+
+    return {
+        'AGB_1990': agb_1990,
+        'AGB_2000': agb_2000.astype(np.float32),
+        'AGB_2010': agb_2010.astype(np.float32),
+        'Forest_Type': forest,
+        'NEP_1990': nep[0],
+        'NEP_2000': nep[1],
+        'NEP_2010': nep[2],
+        'Burn_Year': years,
+    }
+
+
+def scene_shape(megapixels):
+    '''Rows and columns of a square scene of about this many megapixels.'''
+    side = max(1, int(round(np.sqrt(megapixels * 1e6))))
+    return side, side
+
+
+def write_scene(directory, rows, cols, seed=0, layer_files=None):
+    '''
+    Write a synthetic scene of rows x cols pixels to directory and return its description.
+
+    Strips are generated and written one at a time, so memory use follows the strip size.
+    '''
+    layer_files = layer_files or settings.LAYER_FILES
+    os.makedirs(directory, exist_ok=True)
+    plan = scene_plan(rows, cols, seed)
+    rows_per_strip = max(1, min(rows, STRIP_PIXELS // cols))
+    writers = {name: StripTiffWriter(os.path.join(directory, fname), cols, rows, LAYER_DTYPES[name], rows_per_strip,
+                                     geotiff_tags())
+               for name, fname in layer_files.items()}
+    try:
+        for row0 in range(0, rows, rows_per_strip):
+            strip = scene_strip(plan, row0, min(row0 + rows_per_strip, rows))
+            for name, writer in writers.items():
+                writer.write_rows(strip[name])
+    finally:
+        for writer in writers.values():
+            if writer.rows_written == rows:
+                writer.close()
+            else:
+                writer.f.close()
+    description = {'rows': rows, 'cols': cols, 'seed': seed, 'fires': len(plan['fires']['year']),
+                   'compression': None, 'layer_files': dict(layer_files)}
+    _write_description(directory, description)
+    return description
+
+
+def _write_description(directory, description):
+    with open(os.path.join(directory, SCENE_FILE), 'w') as f:
+        json.dump(description, f, indent=1)
+
+
+def compress_scene(source, directory, compression='zlib', tile=TILE_SIZE):
+    '''
+    Rewrite the uncompressed scene in source as tiled, compressed GeoTIFFs in directory, with tifffile.
+
+    The source layers are memory-mapped and the tiles are compressed on several threads, so a large scene is
+    converted without reading it into memory.
+    '''
+    import tifffile
+    with open(os.path.join(source, SCENE_FILE)) as f:
+        description = json.load(f)
+    os.makedirs(directory, exist_ok=True)
+    extratags = [(tag, {SHORT: 'H', DOUBLE: 'd'}[field_type], len(values), values, True)
+                 for tag, field_type, values in geotiff_tags()]
+    for fname in description['layer_files'].values():
+        data = tifffile.memmap(os.path.join(source, fname), mode='r')
+        tifffile.imwrite(os.path.join(directory, fname), data, tile=(tile, tile), compression=compression,
+                         extratags=extratags, maxworkers=os.cpu_count(), bigtiff=data.nbytes > (1 << 32) - (1 << 24))
+        del data
+    description['compression'] = compression
+    _write_description(directory, description)
+    return description
+
+
+def ensure_scene(directory, rows, cols, seed=0, compression=None):
+    '''
+    Write the scene unless directory already holds one with the same size, seed and compression.
+
+    A compressed scene is written uncompressed to a temporary folder first, then compressed into directory.
+    '''
+    try:
+        with open(os.path.join(directory, SCENE_FILE)) as f:
+            description = json.load(f)
+        if (description['rows'], description['cols'], description['seed'], description['compression']) \
+                == (rows, cols, seed, compression):
+            return description
+    except (OSError, ValueError, KeyError):
+        pass
+    if not compression:
+        return write_scene(directory, rows, cols, seed)
+    source = tempfile.mkdtemp(prefix='fl_scene_')
+    try:
+        write_scene(source, rows, cols, seed)
+        return compress_scene(source, directory, compression)
+    finally:
+        shutil.rmtree(source, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic scene of the eight raster layers.')
+    parser.add_argument('directory', help='folder for the TIFFs')
+    parser.add_argument('--megapixels', type=float, default=1.0, help='size of the square scene')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random layers')
+    parser.add_argument('--compression', default=None, help='write tiled GeoTIFFs with this codec, e.g. zlib')
+    args = parser.parse_args(argv)
+
+    rows, cols = scene_shape(args.megapixels)
+    description = ensure_scene(args.directory, rows, cols, args.seed, args.compression)
+    print('Wrote a %(rows)d x %(cols)d scene with %(fires)d fires' % description)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''
+Column layout of the pixel table (FL_Data).
+
+np.vstack used to coerce all eight layers to one common dtype, so the uint8/uint16 codes were stored as floats and
+every derived column added another float64. Here the frame is built one column at a time: the carbon values stay
+float32, the codes keep their small integer types, and Forest_Type and Severity_Label are categoricals from the start.
+'''
+
+import numpy as np
+import pandas as pd
+
+from . import settings
+from .classify import attach_labels, forest_category_lut, forest_codes, severity_codes
+from .instrument import stage
+
+
+def carbon_columns():
+    '''The AGB and NEP columns of every epoch in settings, which are stored as float32.'''
+    return list(settings.AGB_EPOCHS.values()) + list(settings.NEP_EPOCHS.values())
+
+
+def forest_type_column(codes, lut=None, forest_type_list=None):
+    '''Forest_Type as a categorical of the descriptive names instead of the numeric code.'''
+    #The code table is read at call time, so a config file loaded after import is honoured
+    if lut is None:
+        lut = forest_category_lut(settings.CODE_LIST)
+    if forest_type_list is None:
+        forest_type_list = settings.FOREST_TYPE_LIST
+    return attach_labels(forest_codes(codes, lut), forest_type_list)
+
+
+def severity_label_column(burn_severity, cut_bins=settings.CUT_BINS, bs_labels=settings.BS_LABELS):
+    '''Severity_Label, the burn severity bin of each pixel. The bins are ordered, as pd.cut made them.'''
+    return attach_labels(severity_codes(np.asarray(burn_severity), cut_bins), bs_labels, ordered=True)
+
+
+def numeric_columns(window, idx, change):
+    '''
+    Gather the selected positions of every layer and add the derived numeric columns.
+
+    Forest_Type is still the raw code here and there is no Severity_Label yet, see build_frame.
+    '''
+    columns = {}
+    carbon = set(carbon_columns())
+    for name in settings.COLUMNS:
+        values = window[name][idx]
+        if name in carbon:
+            values = values.astype(np.float32, copy=False)
+        columns[name] = values
+
+    #Date of the fire and the age of the burn scar at the last epoch (2010)
+    burn_year = columns['Burn_Year'].astype(np.int16)
+    last_epoch = np.int16(settings.EPOCH_YEARS[-1] - settings.BURN_YEAR_ORIGIN)
+    columns['Date'] = burn_year + np.int16(settings.BURN_YEAR_ORIGIN)
+    columns['Burn_Scar_Age'] = (last_epoch - burn_year).astype(np.int8)
+
+    #Burn_Severity and NEP_Change between the epochs on either side of the fire, from select_pixels
+    columns['Burn_Severity'] = change['Burn_Severity'].astype(np.float32, copy=False)
+    columns['NEP_Change'] = change['NEP_Change'].astype(np.float32, copy=False)
+    return columns
+
+
+def build_frame(start, window, idx, change, cut_bins=settings.CUT_BINS, bs_labels=settings.BS_LABELS):
+    '''
+    Build the pixel table for the selected positions of one window.
+
+    The index is the flat pixel index of each pixel in the full scene.
+    '''
+    with stage('gather', rows_in=len(idx)):
+        columns = numeric_columns(window, idx, change)
+    #Both columns are integer codes until here, the names are attached as categories without touching any strings
+    with stage('forest_relabel', rows_in=len(idx)):
+        columns['Forest_Type'] = forest_type_column(columns['Forest_Type'])
+    with stage('severity_label', rows_in=len(idx)):
+        if 'Severity_Code' in change:
+            severity = change['Severity_Code']
+        else:
+            severity = severity_codes(columns['Burn_Severity'], cut_bins)
+        columns['Severity_Label'] = attach_labels(severity, bs_labels, ordered=True)
+    with stage('frame', rows_in=len(idx)):
+        return pd.DataFrame(columns, index=pd.Index(start + idx))
+
+
+def memory_per_pixel(df):
+    '''Bytes of memory used by each row of the pixel table, index and categories included.'''
+    if len(df) == 0:
+        return 0.0
+    return df.memory_usage(deep=True, index=True).sum() / len(df)
@@ -0,0 +1,85 @@
+'''
+Nodata and validity masks of the raster layers.
+
+The ORNL layers mark pixels without data with a nodata value (the GDAL_NODATA tag, see readers.py), and float
+layers can also hold NaN. Those pixels used to go through the filters and into Burn_Severity, where a missing or
+zero pre-fire AGB gave inf or NaN. pd.cut then left the label empty, and as the result of FL_Data.dropna() was never
+kept, the rows stayed in the table.
+
+Here the first stage of every window builds one validity bitmask over all the layers: bit i of a pixel is set when
+layer i is nodata (or NaN or infinite) there. Pixels with any bit set are dropped before any arithmetic is done on
+them, and the bits tell which layers were missing, so the drops can be reported per layer (see
+instrument.record_drops).
+
+Layers without a nodata tag can be given one in settings.NODATA, for example {'Forest_Type': 0}.
+'''
+
+import numpy as np
+
+from . import settings
+
+
+def layer_nodata(layers, overrides=None):
+    '''The nodata value of every layer, from its tags or from overrides (settings.NODATA by default), or None.'''
+    overrides = settings.NODATA if overrides is None else overrides
+    return {name: overrides.get(name, layer.nodata) for name, layer in layers.items()}
+
+
+def _bits_dtype(n_layers):
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if n_layers <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError('At most 64 layers can be masked, got %d' % n_layers)
+
+
+def _invalid(values, nodata):
+    '''Mask of the pixels of one layer which are nodata, NaN or infinite, or None when none can be.'''
+    mask = None
+    if values.dtype.kind == 'f':
+        mask = ~np.isfinite(values)
+    if nodata is not None and not np.isnan(nodata):
+        if values.dtype.kind in 'iu':
+            info = np.iinfo(values.dtype)
+            #A nodata value the layer's type cannot hold never matches
+            if nodata != int(nodata) or not info.min <= nodata <= info.max:
+                return mask
+            nodata = values.dtype.type(nodata)
+        elif values.dtype.kind == 'f':
+            nodata = values.dtype.type(nodata)
+        equal = values == nodata
+        mask = equal if mask is None else np.logical_or(mask, equal, out=mask)
+    return mask
+
+
+def validity_bits(window, nodata=None):
+    '''
+    Bitmask of the missing layers of every pixel of a window, bit i for the i-th layer of the window.
+
+    nodata maps layer names to their nodata value. Float layers are also checked for NaN and infinity. Returns None
+    when no pixel of the window can be missing, which is the case for integer layers without a nodata value.
+    '''
+    nodata = nodata or {}
+    columns = list(window)
+    bits = None
+    for i, name in enumerate(columns):
+        mask = _invalid(window[name], nodata.get(name))
+        if mask is None:
+            continue
+        if bits is None:
+            bits = np.zeros(len(mask), dtype=_bits_dtype(len(columns)))
+        if mask.any():
+            np.bitwise_or(bits, bits.dtype.type(1 << i), out=bits, where=mask)
+    return bits
+
+
+def missing_counts(bits, columns):
+    '''Pixels missing each layer, as {'nodata:<layer>': count}. A pixel missing several layers counts for each.'''
+    counts = {}
+    if bits is None:
+        return counts
+    missing = bits[bits != 0]
+    for i, name in enumerate(columns):
+        count = int(np.count_nonzero(missing & bits.dtype.type(1 << i)))
+        if count:
+            counts['nodata:' + name] = count
+    return counts
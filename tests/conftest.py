@@ -0,0 +1,32 @@
+'''
+Shared fixtures of the tests: a small synthetic scene (see synthetic.py) and its pixel table.
+
+Run from the repository folder with:
+
+    python -m pytest -q
+'''
+
+import pytest
+
+from fl_carbon.raster import read_pixel_table
+from fl_carbon.synthetic import write_scene
+
+#About a dozen fires, written in a fraction of a second
+ROWS, COLS, SEED = 512, 640, 1
+
+#Bands much smaller than the scene, so every streaming path crosses band boundaries
+WINDOW_ROWS = 64
+
+
+@pytest.fixture(scope='session')
+def scene(tmp_path_factory):
+    '''Folder of the synthetic scene. It is shared by the tests, so a test which changes it must copy it first.'''
+    directory = str(tmp_path_factory.mktemp('scene'))
+    write_scene(directory, ROWS, COLS, SEED)
+    return directory
+
+
+@pytest.fixture(scope='session')
+def FL_Data(scene):
+    '''The cleaned pixel table of the scene, with the settings of the analysis script.'''
+    return read_pixel_table(scene, WINDOW_ROWS)
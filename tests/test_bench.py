@@ -0,0 +1,86 @@
+'''The synthetic scenes of synthetic.py and the pipeline benchmark of bench.py.'''
+
+import copy
+import filecmp
+import json
+import os
+
+import numpy as np
+import pytest
+
+from fl_carbon import settings
+from fl_carbon.bench import benchmark_pipeline, compare_results
+from fl_carbon.raster import open_layers
+from fl_carbon.spatial import read_grid
+from fl_carbon.synthetic import EPSG, LAYER_DTYPES, ensure_scene, scene_shape, write_scene
+
+from .conftest import COLS, ROWS, SEED
+
+#Stages the benchmark must time separately
+STAGES = ['decode', 'flatten', 'filter_burn_year', 'filter_agb_loss', 'filter_forest_type', 'burn_severity',
+          'severity_label', 'forest_relabel', 'regression', 'plotting']
+
+
+def test_scene_is_reproducible(scene, tmp_path):
+    write_scene(str(tmp_path / 'again'), ROWS, COLS, SEED)
+    write_scene(str(tmp_path / 'other'), ROWS, COLS, SEED + 1)
+    for fname in settings.LAYER_FILES.values():
+        assert filecmp.cmp(os.path.join(scene, fname), str(tmp_path / 'again' / fname), shallow=False)
+    assert not filecmp.cmp(os.path.join(scene, settings.LAYER_FILES['Burn_Year']),
+                           str(tmp_path / 'other' / settings.LAYER_FILES['Burn_Year']), shallow=False)
+
+
+def test_scene_values_look_like_the_real_layers(scene):
+    layers = open_layers(scene)
+    data = {name: layer.read_rows(0, ROWS) for name, layer in layers.items()}
+    for name, values in data.items():
+        assert values.shape == (ROWS, COLS) and values.dtype == LAYER_DTYPES[name], name
+    assert set(np.unique(data['Burn_Year'])) <= {0, 16, 20} | set(range(21, 41))
+    assert 0.01 < np.mean(data['Burn_Year'] > 0) < 0.5
+    assert set(np.unique(data['Forest_Type'])) <= {0} | set(settings.CODE_LIST)
+    assert np.argmax(np.bincount(data['Forest_Type'].ravel())) == settings.LONGLEAF_SLASH_PINE
+    assert (data['AGB_1990'] >= 0).all() and np.isfinite(data['AGB_2010']).all()
+    assert read_grid(scene)['crs'] == 'EPSG:%d' % EPSG
+
+
+@pytest.fixture(scope='module')
+def result(tmp_path_factory):
+    scene_dir = str(tmp_path_factory.mktemp('bench_scene'))
+    return benchmark_pipeline(0.1, window_rows=64, scene_dir=scene_dir), scene_dir
+
+
+def test_pipeline_times_every_stage(result):
+    result, _ = result
+    #The results are plain JSON, without NaN
+    result = json.loads(json.dumps(result, allow_nan=False))
+    assert (result['scene']['rows'], result['scene']['cols']) == scene_shape(0.1)
+    assert result['rows_kept'] > 0
+    for name in STAGES:
+        stats = result['stages'][name]
+        assert stats['calls'] >= 1 and stats['wall_s'] >= 0, name
+        assert 'peak_rss_mb' in stats and 'cpu_s' in stats, name
+    assert result['stages']['decode']['rows_out'] == result['scene']['pixels']
+
+
+def test_scene_dir_is_reused(result):
+    result, scene_dir = result
+    path = os.path.join(scene_dir, settings.LAYER_FILES['Burn_Year'])
+    mtime = os.stat(path).st_mtime_ns
+    rows, cols = scene_shape(0.1)
+    ensure_scene(scene_dir, rows, cols, seed=0)
+    assert os.stat(path).st_mtime_ns == mtime
+    ensure_scene(scene_dir, rows, cols, seed=1)
+    assert os.stat(path).st_mtime_ns != mtime
+
+
+def test_compare_results_flags_slower_stages(result):
+    result, _ = result
+    table, slower = compare_results(result, result)
+    assert not slower and len(table) == len(result['stages'])
+    #A stage twice as slow as its baseline, by more than MIN_SECONDS
+    baseline = copy.deepcopy(result)
+    baseline['stages']['plotting']['wall_s'] = 0.5
+    result = copy.deepcopy(result)
+    result['stages']['plotting']['wall_s'] = 1.0
+    _, slower = compare_results(result, baseline)
+    assert slower == ['plotting']
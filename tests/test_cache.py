@@ -0,0 +1,76 @@
+'''The cache of cache.py: hits, misses after the inputs or the settings change, and saving over a table.'''
+
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from fl_carbon import cache, settings
+from fl_carbon.cache import cached_pixel_table, load_table, save_table
+
+from .conftest import WINDOW_ROWS
+
+
+@pytest.fixture
+def scene_copy(scene, tmp_path):
+    directory = str(tmp_path / 'scene')
+    shutil.copytree(scene, directory)
+    return directory
+
+
+def _read(directory, **params):
+    '''The cached table, and whether it was built rather than loaded.'''
+    built = []
+    read_pixel_table = cache.read_pixel_table
+
+    def counting_read(*args, **kwargs):
+        built.append(args)
+        return read_pixel_table(*args, **kwargs)
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(cache, 'read_pixel_table', counting_read)
+        FL_Data = cached_pixel_table(directory, window_rows=WINDOW_ROWS, **params)
+    return FL_Data, bool(built)
+
+
+def test_second_read_is_a_hit(scene_copy, FL_Data):
+    table, built = _read(scene_copy)
+    assert built
+    table, built = _read(scene_copy)
+    assert not built
+    pd.testing.assert_frame_equal(table.copy(), FL_Data)
+
+
+@pytest.mark.parametrize('change', ['mtime', 'size'])
+def test_changed_layer_is_a_miss(scene_copy, change):
+    _read(scene_copy)
+    path = os.path.join(scene_copy, settings.LAYER_FILES['AGB_2010'])
+    if change == 'mtime':
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    else:
+        #Bytes after the image data are never read, so only the size of the file changes
+        with open(path, 'ab') as f:
+            f.write(b'\0' * 16)
+    _, built = _read(scene_copy)
+    assert built
+    assert len(os.listdir(os.path.join(scene_copy, 'FL_Cache'))) == 2
+
+
+def test_changed_settings_are_a_miss(scene_copy, FL_Data):
+    _read(scene_copy)
+    table, built = _read(scene_copy, drop_low=False)
+    assert built
+    assert len(table) > len(FL_Data)
+    _, built = _read(scene_copy)
+    assert not built
+
+
+def test_save_table_overwrites(tmp_path, FL_Data):
+    path = str(tmp_path / 'table')
+    save_table(FL_Data, path)
+    smaller = FL_Data.iloc[::3]
+    save_table(smaller, path)
+    pd.testing.assert_frame_equal(load_table(path).copy(), smaller)
+    assert os.listdir(str(tmp_path)) == ['table']
@@ -0,0 +1,44 @@
+'''The integer codes of classify.py against the labels of pd.cut and Forest_Type.replace in the original script.'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fl_carbon import settings
+from fl_carbon.classify import NO_CATEGORY, forest_category_lut, forest_codes, severity_codes
+
+
+def _cut_codes(values):
+    return pd.cut(values, bins=settings.CUT_BINS, labels=settings.BS_LABELS).codes.astype(np.int8)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_severity_codes_match_pd_cut(dtype):
+    #Every bin edge, either side of them, negative values, values above 100, infinities and NaN
+    edges = np.array(settings.CUT_BINS, dtype=dtype)
+    values = np.concatenate([edges, np.nextafter(edges, dtype(-np.inf)), np.nextafter(edges, dtype(np.inf)),
+                             np.array([-50, -0.0, 15, 50, 99.9, 150, 1e6, np.inf, -np.inf, np.nan], dtype=dtype)])
+    codes = severity_codes(values)
+    assert codes.dtype == np.int8
+    np.testing.assert_array_equal(codes, _cut_codes(values))
+    #Closed on the right: 0 is in no bin, 30 and 70 end the first and second, 100 ends the last
+    np.testing.assert_array_equal(codes[:4], [NO_CATEGORY, 0, 1, 2])
+
+
+def test_severity_codes_of_random_values():
+    values = np.random.default_rng(0).uniform(-20, 120, 100000).astype(np.float32)
+    np.testing.assert_array_equal(severity_codes(values), _cut_codes(values))
+
+
+def test_forest_codes_match_replace():
+    codes = np.array(list(settings.CODE_LIST) + [0, 130, 65535], dtype=np.uint16)
+    names = pd.Series(codes).replace(dict(zip(settings.CODE_LIST, settings.FOREST_TYPE_LIST)))
+    #Codes missing from the table stay numbers after replace, and are in no category
+    position = {name: i for i, name in enumerate(settings.FOREST_TYPE_LIST)}
+    expected = names.map(lambda name: position.get(name, NO_CATEGORY)).to_numpy()
+    lut = forest_category_lut(settings.CODE_LIST)
+    np.testing.assert_array_equal(forest_codes(codes, lut), expected)
+    #Float and signed exports of the same codes, including values outside the table
+    np.testing.assert_array_equal(forest_codes(codes.astype(np.float32), lut), expected)
+    np.testing.assert_array_equal(forest_codes(np.array([-1, 140, 70000], dtype=np.int32), lut),
+                                  [NO_CATEGORY, settings.CODE_LIST.index(140), NO_CATEGORY])
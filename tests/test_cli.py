@@ -0,0 +1,84 @@
+'''The subcommands of cli.py, run through cli.main on a copy of the synthetic scene.'''
+
+import json
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from fl_carbon import cli, settings
+from fl_carbon.regression import batch_regression
+
+from .conftest import WINDOW_ROWS
+
+
+@pytest.fixture
+def scene_copy(scene, tmp_path, monkeypatch):
+    directory = str(tmp_path / 'scene')
+    shutil.copytree(scene, directory)
+    #apply_config writes the code table into settings, it is put back after the test
+    for name in ('CODE_LIST', 'FOREST_TYPE_LIST', 'NODATA'):
+        monkeypatch.setattr(settings, name, getattr(settings, name))
+    return directory
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / 'fl_config.json'
+    path.write_text(json.dumps({'window_rows': WINDOW_ROWS, 'forest_type': 'Longleaf/Slash Pine'}))
+    return str(path)
+
+
+def test_build_fills_the_cache(scene_copy, config, FL_Data, capsys):
+    cli.main(['--config', config, 'build', scene_copy])
+    out = capsys.readouterr().out
+    assert out.startswith('%d pixels' % len(FL_Data))
+    assert len(os.listdir(os.path.join(scene_copy, 'FL_Cache'))) == 1
+
+
+def test_regress_writes_the_regressions(scene_copy, config, FL_Data, tmp_path):
+    out_dir = str(tmp_path / 'results')
+    cli.main(['--config', config, 'regress', scene_copy, '--out-dir', out_dir, '--test-size', '0'])
+    results = pd.read_csv(os.path.join(out_dir, 'Regressions.csv'))
+    expected = batch_regression(FL_Data, by=['Severity_Label'], x='Burn_Scar_Age')
+    columns = ['n', 'intercept', 'coef_x1', 'rmse', 'r2']
+    pd.testing.assert_frame_equal(results[columns], expected[columns].reset_index(drop=True), check_dtype=False,
+                                  rtol=1e-9)
+    assert os.path.exists(os.path.join(out_dir, 'Age_Summary.csv'))
+
+
+def test_strata_writes_every_stratum(scene_copy, config, tmp_path):
+    out_dir = str(tmp_path / 'results')
+    cli.main(['--config', config, 'strata', scene_copy, '--out-dir', out_dir, '--no-cache'])
+    counts = pd.read_csv(os.path.join(out_dir, 'Strata_Counts.csv'))
+    #Every forest type and the Low class are kept, whatever the config says
+    assert counts['Forest_Type'].nunique() > 1
+    assert 'Low' in set(counts['Severity_Label'])
+    for name in ('Strata_Summary.csv', 'Strata_Regressions.csv'):
+        assert os.path.exists(os.path.join(out_dir, name))
+
+
+def test_export_writes_tables_and_rasters(scene_copy, config, tmp_path, capsys):
+    out_dir = str(tmp_path / 'results')
+    cli.main(['--config', config, 'export', scene_copy, '--out-dir', out_dir])
+    files = capsys.readouterr().out.split()
+    assert files and all(os.path.exists(path) for path in files)
+    assert any(path.endswith('.tif') for path in files)
+    assert os.path.exists(os.path.join(out_dir, 'Regressions.csv'))
+
+
+def test_timings_report_the_stages(scene_copy, config, capsys):
+    cli.main(['--config', config, '--timings', 'build', scene_copy, '--no-cache'])
+    out = capsys.readouterr().out
+    for name in ('decode', 'filter_burn_year', 'gather'):
+        assert name in out
+    assert 'Pixels dropped' in out
+
+
+def test_config_prints_the_config_in_use(config, capsys, monkeypatch):
+    for name in ('CODE_LIST', 'FOREST_TYPE_LIST', 'NODATA'):
+        monkeypatch.setattr(settings, name, getattr(settings, name))
+    cli.main(['--config', config, 'config'])
+    printed = json.loads(capsys.readouterr().out)
+    assert printed['window_rows'] == WINDOW_ROWS and printed['forest_type'] == 'Longleaf/Slash Pine'
@@ -0,0 +1,56 @@
+'''Validation of the config files of config.py.'''
+
+import json
+
+import pytest
+
+from fl_carbon import settings
+from fl_carbon.config import check_config, default_config, filter_arguments, forest_code, load_config
+
+
+def _config(**values):
+    return dict(default_config(), **values)
+
+
+def test_unknown_key_is_rejected(tmp_path):
+    path = tmp_path / 'fl_config.json'
+    path.write_text(json.dumps({'excluded_year': [0, 40]}))
+    with pytest.raises(ValueError, match='excluded_year'):
+        load_config(str(path))
+
+
+def test_file_values_replace_the_defaults(tmp_path):
+    path = tmp_path / 'fl_config.json'
+    path.write_text(json.dumps({'excluded_years': [0, 40], 'drop_low': False}))
+    config = load_config(str(path))
+    assert config['excluded_years'] == [0, 40] and not config['drop_low']
+    assert config['cut_bins'] == list(settings.CUT_BINS)
+    assert filter_arguments(config)['excluded_years'] == (0, 40)
+    assert load_config() == default_config()
+
+
+@pytest.mark.parametrize('forest_type, expected', [
+    ('Longleaf/Slash Pine', settings.LONGLEAF_SLASH_PINE),
+    (settings.LONGLEAF_SLASH_PINE, settings.LONGLEAF_SLASH_PINE),
+    (['Longleaf/Slash Pine', 160], [settings.LONGLEAF_SLASH_PINE, 160]),
+    (None, None),
+])
+def test_forest_type_by_name_or_code(forest_type, expected):
+    config = _config(forest_type=forest_type)
+    check_config(config)
+    assert forest_code(config) == expected
+
+
+def test_unknown_forest_type_name_is_rejected():
+    with pytest.raises(ValueError, match='Unknown forest type'):
+        check_config(_config(forest_type='Palm'))
+
+
+@pytest.mark.parametrize('values', [
+    {'cut_bins': [0, 50, 100]},
+    {'cut_bins': [0, 70, 30, 100]},
+    {'code_list': [140]},
+])
+def test_settings_which_do_not_fit_together_are_rejected(values):
+    with pytest.raises(ValueError):
+        check_config(_config(**values))
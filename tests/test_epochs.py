@@ -0,0 +1,61 @@
+'''The change-detection engine of epochs.py against a pixel by pixel loop over the epochs.'''
+
+import numpy as np
+
+from fl_carbon import settings
+from fl_carbon.bench import compare_filters
+from fl_carbon.epochs import epoch_change
+
+
+def _reference(agb, nep, burn_year, epoch_years):
+    severity = np.full(agb.shape[1], np.nan)
+    change = np.full(agb.shape[1], np.nan)
+    for i, code in enumerate(burn_year):
+        year = int(code) + settings.BURN_YEAR_ORIGIN
+        before = [e for e, epoch in enumerate(epoch_years) if epoch < year]
+        after = [e for e, epoch in enumerate(epoch_years) if epoch >= year]
+        if not before or not after:
+            continue
+        pre, post = before[-1], after[0]
+        if agb[pre, i] != 0:
+            severity[i] = (agb[pre, i] - agb[post, i]) / agb[pre, i] * 100
+        change[i] = nep[post, i] - nep[pre, i]
+    return severity, change
+
+
+def test_any_number_of_epochs():
+    rng = np.random.default_rng(0)
+    epoch_years = [1990, 1995, 2000, 2005, 2010]
+    n = 5000
+    agb = rng.gamma(4.0, 2.0, (len(epoch_years), n))
+    agb[:, :50] = 0
+    nep = rng.normal(100, 60, (len(epoch_years), n))
+    burn_year = rng.integers(0, 45, n).astype(np.uint8)
+    change = epoch_change(agb, nep, burn_year, epoch_years)
+    severity, nep_change = _reference(agb, nep, burn_year, epoch_years)
+    np.testing.assert_allclose(change['Burn_Severity'], severity, rtol=1e-12)
+    np.testing.assert_allclose(change['NEP_Change'], nep_change, rtol=1e-12)
+
+
+def test_decadal_layers_use_the_original_intervals():
+    rng = np.random.default_rng(1)
+    agb = rng.gamma(4.0, 2.0, (3, 1000)).astype(np.float32)
+    burn_year = rng.integers(21, 40, 1000).astype(np.uint8)
+    severity = epoch_change(agb, None, burn_year)['Burn_Severity']
+    early = burn_year.astype(np.int32) + settings.BURN_YEAR_ORIGIN <= 2000
+    original = np.where(early, (agb[0] - agb[1]) / agb[0] * 100, (agb[1] - agb[2]) / agb[1] * 100)
+    assert severity.dtype == np.float32
+    np.testing.assert_array_equal(severity, original)
+
+
+def test_fires_before_the_first_epoch_have_no_severity():
+    agb = np.array([[10.0, 10.0], [5.0, 5.0], [2.0, 2.0]])
+    change = epoch_change(agb, agb, np.array([15, 25], dtype=np.uint8))
+    assert np.isnan(change['Burn_Severity'][0]) and np.isnan(change['NEP_Change'][0])
+    assert change['Burn_Severity'][1] == 50
+
+
+def test_fused_filter_keeps_the_pixels_of_the_original_masks():
+    #Raises when the two paths differ by more than the fires before the first epoch
+    result = compare_filters(200000, repeat=1)
+    assert result['rows_kept'] > 0 and result['pre_epoch_dropped'] > 0
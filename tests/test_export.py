@@ -0,0 +1,99 @@
+'''GeoTIFF and table export of export.py, read back with tifffile.'''
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fl_carbon import settings
+from fl_carbon.export import CLASS_NODATA, GEO_TAGS, AnalysisResults, export_results
+from fl_carbon.regression import batch_regression, predict
+
+from .conftest import COLS, ROWS
+
+tifffile = pytest.importorskip('tifffile')
+
+
+@pytest.fixture(scope='module')
+def exported(scene, FL_Data, tmp_path_factory):
+    out_dir = str(tmp_path_factory.mktemp('results'))
+    Reg_Results = batch_regression(FL_Data)
+    results = export_results(scene, FL_Data, {'Regressions': Reg_Results}, out_dir=out_dir)
+    return results, out_dir
+
+
+def _read(out_dir, name):
+    with tifffile.TiffFile(os.path.join(out_dir, name + '.tif')) as tif:
+        page = tif.pages[0]
+        return page.asarray(), page.tags, json.loads(page.description)
+
+
+def test_rasters_hold_the_table_values(exported, FL_Data):
+    _, out_dir = exported
+    index = FL_Data.index.to_numpy()
+    outside = np.ones(ROWS * COLS, dtype=bool)
+    outside[index] = False
+    for name, column, labels in [('Severity_Class', 'Severity_Label', settings.BS_LABELS),
+                                 ('Forest_Class', 'Forest_Type', settings.FOREST_TYPE_LIST)]:
+        data, tags, description = _read(out_dir, name)
+        assert data.shape == (ROWS, COLS) and data.dtype == np.uint8
+        assert description['labels'] == labels
+        codes = pd.Categorical(FL_Data[column].astype(str), categories=labels).codes
+        np.testing.assert_array_equal(data.ravel()[index], codes)
+        assert (data.ravel()[outside] == CLASS_NODATA).all()
+        assert tags['GDAL_NODATA'].value == str(CLASS_NODATA)
+    age, _, _ = _read(out_dir, 'Burn_Scar_Age')
+    np.testing.assert_array_equal(age.ravel()[index], FL_Data['Burn_Scar_Age'])
+
+
+def test_residual_rasters(exported, FL_Data):
+    results, out_dir = exported
+    residual, _, _ = _read(out_dir, 'Residual_NEP_2010_quadratic')
+    age = FL_Data['Burn_Scar_Age'].to_numpy(dtype=np.float64)
+    expected = np.full(len(FL_Data), np.nan)
+    for label in ['Moderate', 'Severe']:
+        keep = (FL_Data['Severity_Label'] == label).to_numpy()
+        row = results.model('NEP_2010', 'quadratic', Severity_Label=label)
+        expected[keep] = FL_Data['NEP_2010'].to_numpy(dtype=np.float64)[keep] - predict(row, age[keep])
+    np.testing.assert_allclose(residual.ravel()[FL_Data.index.to_numpy()], expected, rtol=1e-5, atol=1e-3)
+    assert np.isnan(np.delete(residual.ravel(), FL_Data.index.to_numpy())).all()
+
+
+def test_rasters_keep_the_source_grid(scene, exported):
+    _, out_dir = exported
+    source = os.path.join(scene, settings.LAYER_FILES['Burn_Year'])
+    with tifffile.TiffFile(source) as a, tifffile.TiffFile(os.path.join(out_dir, 'Severity_Class.tif')) as b:
+        for code in GEO_TAGS:
+            if code in a.pages[0].tags:
+                assert np.array_equal(a.pages[0].tags[code].value, b.pages[0].tags[code].value)
+        assert b.pages[0].is_tiled
+
+
+def test_class_codes_do_not_depend_on_the_categories_kept(scene, FL_Data, exported, tmp_path):
+    #The script drops the unused severity categories, the command line does not
+    trimmed = FL_Data.copy()
+    trimmed['Severity_Label'] = trimmed['Severity_Label'].cat.remove_unused_categories()
+    export_results(scene, trimmed, {}, out_dir=str(tmp_path))
+    a, _, _ = _read(exported[1], 'Severity_Class')
+    b, _, _ = _read(str(tmp_path), 'Severity_Class')
+    np.testing.assert_array_equal(a, b)
+    legend = exported[0]['Legend']
+    assert list(legend[legend['product'] == 'Severity_Class']['label']) == settings.BS_LABELS
+
+
+def test_tables_round_trip(exported, tmp_path):
+    results = AnalysisResults({'Regressions': exported[0]['Regressions']})
+    paths = results.write_tables(str(tmp_path), 'csv')
+    pd.testing.assert_frame_equal(pd.read_csv(paths['Regressions']), results['Regressions'].astype({
+        'Severity_Label': str}), check_dtype=False)
+    with pytest.raises(KeyError):
+        results.model('NEP_2010', 'linear')
+
+
+def test_parquet_keeps_the_categoricals(exported, tmp_path):
+    pytest.importorskip('pyarrow')
+    results = AnalysisResults({'Regressions': exported[0]['Regressions']})
+    paths = results.write_tables(str(tmp_path), 'parquet')
+    pd.testing.assert_frame_equal(pd.read_parquet(paths['Regressions']), results['Regressions'])
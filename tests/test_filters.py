@@ -0,0 +1,57 @@
+'''The fused selection of filters.py against the chained dataframe masks of the original script.'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fl_carbon import settings
+from fl_carbon.filters import burn_year_lut, forest_lut, select_pixels
+
+
+def _layers(n, seed):
+    rng = np.random.default_rng(seed)
+    agb_1990 = rng.gamma(4.0, 2.0, n).astype(np.float32)
+    agb_2000 = (agb_1990 * rng.uniform(0.0, 1.3, n)).astype(np.float32)
+    agb_2010 = (agb_2000 * rng.uniform(0.0, 1.5, n)).astype(np.float32)
+    codes = np.array(settings.CODE_LIST, dtype=np.uint16)
+    weights = np.where(codes == settings.LONGLEAF_SLASH_PINE, 5.0, 1.0)
+    #The burn year codes of the Apalachicola layer, none of them before the first epoch apart from the excluded 1986
+    years = np.array([0, 16, 20] + list(range(21, 41)), dtype=np.uint8)
+    return {
+        'AGB_1990': agb_1990,
+        'AGB_2000': agb_2000,
+        'AGB_2010': agb_2010,
+        'Forest_Type': rng.choice(codes, n, p=weights / weights.sum()),
+        'NEP_1990': rng.normal(100, 60, n).astype(np.float32),
+        'NEP_2000': rng.normal(100, 60, n).astype(np.float32),
+        'NEP_2010': rng.normal(100, 60, n).astype(np.float32),
+        'Burn_Year': rng.choice(years, n),
+    }
+
+
+def _chained_masks(layers, drop_low=True):
+    FL_Data = pd.DataFrame({name: layers[name] for name in settings.COLUMNS})
+    FL_Data = FL_Data[(FL_Data.Burn_Year != 0) & (FL_Data.Burn_Year != 16) & (FL_Data.Burn_Year != 20) &
+                      (FL_Data.Burn_Year != 40)].copy()
+    FL_Data['Minus_90_00'] = FL_Data['AGB_1990'] - FL_Data['AGB_2000']
+    FL_Data['Minus_00_10'] = FL_Data['AGB_2000'] - FL_Data['AGB_2010']
+    FL_Data = FL_Data[(FL_Data.Minus_90_00 > 0) | (FL_Data.Minus_00_10 > 0)].copy()
+    FL_Data['Date'] = 1970 + FL_Data['Burn_Year'].astype(np.int32)
+    FL_Data['Burn_Severity'] = (FL_Data['AGB_1990'] - FL_Data['AGB_2000']) / FL_Data['AGB_1990'] * 100
+    FL_Data.loc[FL_Data.Date > 2000, 'Burn_Severity'] = (FL_Data['AGB_2000'] - FL_Data['AGB_2010']) / \
+        FL_Data['AGB_2000'] * 100
+    FL_Data['Severity_Label'] = pd.cut(FL_Data['Burn_Severity'], bins=settings.CUT_BINS, labels=settings.BS_LABELS)
+    FL_Data = FL_Data[FL_Data['Forest_Type'] == settings.LONGLEAF_SLASH_PINE]
+    if drop_low:
+        FL_Data = FL_Data[FL_Data['Severity_Label'] != 'Low']
+    return FL_Data.dropna(subset=['Severity_Label'])
+
+
+@pytest.mark.parametrize('drop_low', [True, False])
+def test_fused_selection_keeps_the_pixels_of_the_chained_masks(drop_low):
+    layers = _layers(200000, 0)
+    idx, change = select_pixels(layers, burn_year_lut(), forest_lut(), drop_low)
+    expected = _chained_masks(layers, drop_low)
+    assert len(idx) > 1000
+    np.testing.assert_array_equal(idx, expected.index.to_numpy())
+    np.testing.assert_allclose(change['Burn_Severity'], expected['Burn_Severity'], rtol=1e-6)
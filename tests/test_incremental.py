@@ -0,0 +1,88 @@
+'''Incremental updates of incremental.py against a full rebuild of the changed scene.'''
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fl_carbon import settings
+from fl_carbon.cache import load_table
+from fl_carbon.incremental import STATE_FILE, update
+from fl_carbon.raster import read_pixel_table
+from fl_carbon.regression import age_summary, batch_regression_from_summary
+
+from .conftest import WINDOW_ROWS
+
+
+def _edit(directory, name, rows, change):
+    '''Change some rows of a layer in place and move its modification time on.'''
+    import tifffile
+    path = os.path.join(directory, settings.LAYER_FILES[name])
+    data = tifffile.memmap(path, mode='r+')
+    data[rows] = change(data[rows])
+    data.flush()
+    del data
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+@pytest.fixture
+def scene_copy(scene, tmp_path):
+    directory = str(tmp_path / 'scene')
+    shutil.copytree(scene, directory)
+    return directory
+
+
+def test_update_matches_a_full_rebuild(scene_copy):
+    _, _, _, report = update(scene_copy, window_rows=WINDOW_ROWS, render=False)
+    assert report['full_rebuild']
+
+    #A burn year layer with some fires moved a year on and others to 2010, which is excluded, and a band of regrown AGB
+    _edit(scene_copy, 'Burn_Year', slice(100, 180),
+          lambda years: np.where(years > 33, 40, np.where(years > 0, years + 1, 0)).astype(years.dtype))
+    _edit(scene_copy, 'AGB_2010', slice(300, 320), lambda agb: agb * np.float32(1.1))
+    FL_Data, Age_Summary, Reg_Results, report = update(scene_copy, window_rows=WINDOW_ROWS, render=False)
+    assert not report['full_rebuild']
+    assert sorted(report['layers_changed']) == ['AGB_2010', 'Burn_Year']
+    assert report['bands_changed'] == 3
+    assert report['rows_removed'] and report['rows_changed']
+
+    expected = read_pixel_table(scene_copy, WINDOW_ROWS)
+    pd.testing.assert_frame_equal(FL_Data, expected)
+    summary = age_summary(expected)
+    pd.testing.assert_frame_equal(Age_Summary, summary, check_dtype=False, check_categorical=False, rtol=1e-9)
+    columns = ['n', 'intercept', 'coef_x1', 'coef_x2', 'rmse', 'r2', 'F', 'p']
+    pd.testing.assert_frame_equal(Reg_Results[columns], batch_regression_from_summary(summary)[columns], rtol=1e-7)
+
+
+def test_unchanged_scene_reads_nothing(scene_copy):
+    update(scene_copy, window_rows=WINDOW_ROWS, render=False)
+    FL_Data, _, _, report = update(scene_copy, window_rows=WINDOW_ROWS, render=False)
+    assert report['bands_changed'] == 0 and not report['layers_changed']
+    #The stored table is memory-mapped, a copy compares as plain arrays
+    pd.testing.assert_frame_equal(FL_Data.copy(), read_pixel_table(scene_copy, WINDOW_ROWS))
+
+
+def test_stored_table_follows_every_update(scene_copy):
+    update(scene_copy, window_rows=WINDOW_ROWS, render=False)
+    state_path = os.path.join(scene_copy, 'FL_State')
+    for step in range(2):
+        _edit(scene_copy, 'Burn_Year', slice(100, 180),
+              lambda years: np.where(years > 33, 40, np.where(years > 0, years + 1, 0)).astype(years.dtype))
+        _, _, _, report = update(scene_copy, window_rows=WINDOW_ROWS, render=False)
+        assert report['bands_changed'] == 2
+
+        expected = read_pixel_table(scene_copy, WINDOW_ROWS)
+        with open(os.path.join(state_path, STATE_FILE)) as f:
+            state = json.load(f)
+        pd.testing.assert_frame_equal(load_table(os.path.join(state_path, state['table'])).copy(), expected)
+        #Only the folders named by the state are kept
+        assert sorted(name for name in os.listdir(state_path) if name != STATE_FILE) == \
+            sorted([state['table'], state['cells']])
+
+    FL_Data, _, _, report = update(scene_copy, window_rows=WINDOW_ROWS, render=False)
+    assert report['bands_changed'] == 0
+    pd.testing.assert_frame_equal(FL_Data.copy(), expected)
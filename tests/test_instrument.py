@@ -0,0 +1,88 @@
+'''The stage records of instrument.py, on their own and around the pixel table pipeline.'''
+
+import io
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from fl_carbon import instrument
+from fl_carbon.instrument import StageRecorder, recording, stage
+from fl_carbon.raster import read_pixel_table
+
+from .conftest import COLS, ROWS, WINDOW_ROWS
+
+
+def test_no_recorder_records_nothing():
+    assert instrument.active_recorder() is None
+    with stage('idle', rows_in=5) as s:
+        s.rows_out = 3
+    with recording(StageRecorder(track_peak=False)) as recorder:
+        pass
+    assert recorder.records == [] and recorder.summary().empty
+
+
+def test_records_time_rows_and_memory():
+    with recording(StageRecorder(track_peak=False)) as recorder:
+        for _ in range(3):
+            with stage('outer', rows_in=np.array([True, False, True, True])) as s:
+                with stage('inner', rows_in=10):
+                    time.sleep(0.01)
+                    block = np.ones(4 << 20)
+                s.rows_out = np.array([True, False, False, False])
+        del block
+    assert instrument.active_recorder() is None
+    #Inner stages end first
+    assert [record.name for record in recorder.records[:2]] == ['inner', 'outer']
+    summary = recorder.summary()
+    assert set(summary.index) == {'outer', 'inner'}
+    assert summary.loc['outer', 'calls'] == 3
+    assert summary.loc['outer', 'rows_in'] == 9 and summary.loc['outer', 'rows_out'] == 3
+    assert summary.loc['inner', 'rows_in'] == 30 and np.isnan(summary.loc['inner', 'rows_out'])
+    assert summary.loc['inner', 'wall_s'] >= 0.03
+    assert summary.loc['outer', 'wall_s'] >= summary.loc['inner', 'wall_s']
+    assert summary.loc['inner', 'rss_delta_mb'] > 0
+
+
+def test_records_are_logged_as_json(caplog):
+    with caplog.at_level(logging.INFO, logger='fl_carbon.stages'):
+        with recording(StageRecorder(track_peak=False)):
+            with stage('logged', rows_in=2) as s:
+                s.rows_out = 1
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record['stage'] == 'logged' and record['rows_in'] == 2 and record['rows_out'] == 1
+
+
+def test_profile_and_trace_chosen_stages(tmp_path):
+    recorder = StageRecorder.from_environment({'FL_PROFILE': 'busy, other', 'FL_TRACEMALLOC': 'busy',
+                                               'FL_PROFILE_DIR': str(tmp_path)})
+    assert recorder.profile == {'busy', 'other'} and recorder.trace_memory == {'busy'}
+    with recording(recorder):
+        with stage('busy'):
+            kept = [list(range(100)) for _ in range(100)]
+        with stage('quiet'):
+            sum(range(1000))
+    text = io.StringIO()
+    recorder.report(text)
+    assert os.path.exists(os.path.join(str(tmp_path), 'busy.prof'))
+    assert not os.path.exists(os.path.join(str(tmp_path), 'quiet.prof'))
+    assert 'Largest allocations in busy' in text.getvalue()
+    assert 'quiet' in text.getvalue()
+    del kept
+
+
+def test_pipeline_stages_count_the_pixels(scene, FL_Data):
+    with recording(StageRecorder()) as recorder:
+        read_pixel_table(scene, WINDOW_ROWS)
+    summary = recorder.summary()
+    windows = -(-ROWS // WINDOW_ROWS)
+    assert summary.loc['decode', 'calls'] == windows
+    assert summary.loc['decode', 'rows_out'] == ROWS * COLS
+    #Each filter looks at the pixels the one before it kept
+    filters = ['filter_burn_year', 'filter_forest_type', 'filter_agb_loss']
+    for before, after in zip(filters[:-1], filters[1:]):
+        assert summary.loc[after, 'rows_in'] == summary.loc[before, 'rows_out']
+    assert summary.loc['concat', 'rows_out'] == len(FL_Data)
+    assert (summary['peak_rss_mb'] > 0).all()
@@ -0,0 +1,94 @@
+'''Chunked reductions of lazy.py against the same statistics of the whole pixel table.'''
+
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fl_carbon import lazy
+from fl_carbon.lazy import AgeSummary, LazyScene, Reduction, compute
+from fl_carbon.raster import open_layers
+from fl_carbon.regression import age_summary, batch_regression
+
+from .conftest import WINDOW_ROWS
+
+#Chunks which do not line up with the bands of the reader, so pixels of one age are merged across many chunks
+CHUNK_ROWS = 48
+
+
+@pytest.fixture(scope='module')
+def lazy_results(scene):
+    lazy = LazyScene(scene, chunk_rows=CHUNK_ROWS, window_rows=WINDOW_ROWS)
+    return compute(lazy.severity_counts(), lazy.age_summary(), lazy.regression(), scheduler='sync')
+
+
+def test_severity_counts(lazy_results, FL_Data):
+    counts = lazy_results[0]
+    expected = FL_Data['Severity_Label'].value_counts(sort=False)
+    pd.testing.assert_series_equal(counts.sort_index(), expected.sort_index(), check_names=False, check_dtype=False)
+
+
+def test_age_summary_matches_the_whole_table(lazy_results, FL_Data):
+    summary = lazy_results[1]
+    expected = age_summary(FL_Data)
+    assert list(summary.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(summary, expected, check_dtype=False, check_categorical=False, rtol=1e-9)
+
+
+def test_regression_matches_the_whole_table(lazy_results, FL_Data):
+    columns = ['n', 'intercept', 'coef_x1', 'coef_x2', 'rmse', 'r2', 'F', 'p']
+    pd.testing.assert_frame_equal(lazy_results[2][columns], batch_regression(FL_Data)[columns], rtol=1e-7)
+
+
+def test_chan_merge_keeps_the_variance_of_large_values():
+    #Values with a large mean and a small spread, where sum(y^2) / n - mean^2 loses most of its digits
+    rng = np.random.default_rng(0)
+    values = 1e6 + rng.normal(0, 1e-2, 10000)
+    frame = pd.DataFrame({'Severity_Label': pd.Categorical(['Severe'] * len(values)),
+                          'Burn_Scar_Age': np.full(len(values), 5), 'AGB_2010': values})
+    reduction = AgeSummary(None, ['Severity_Label'], 'Burn_Scar_Age', ['AGB_2010'])
+    parts = [reduction.partial(frame.iloc[rows], None) for rows in np.array_split(np.arange(len(frame)), 7)]
+    total = parts[0]
+    for part in parts[1:]:
+        total = reduction.combine(total, part)
+    summary = reduction.finalize(total)
+    np.testing.assert_allclose(summary['AGB_2010_mean'], values.mean(), rtol=1e-15)
+    #The naive formula is off by about the variance itself here
+    np.testing.assert_allclose(summary['AGB_2010_var'], values.var(), rtol=1e-6)
+
+
+def test_reductions_must_define_partial_and_combine():
+    class Counts(Reduction):
+        def partial(self, FL_Data, chunk):
+            return len(FL_Data)
+
+    with pytest.raises(TypeError):
+        Counts(None)
+
+
+@pytest.mark.parametrize('scheduler', ['threads', 'processes'])
+def test_layers_are_opened_once_per_worker(scene, monkeypatch, scheduler):
+    opened = []
+
+    def counting_open_layers(*args, **kwargs):
+        opened.append(threading.get_ident())
+        return open_layers(*args, **kwargs)
+
+    monkeypatch.setattr(lazy, 'open_layers', counting_open_layers)
+    scene = LazyScene(scene, chunk_rows=CHUNK_ROWS, window_rows=WINDOW_ROWS)
+    counts, = compute(scene.severity_counts(), scheduler=scheduler, workers=2)
+    assert counts.sum() > 0
+    #The scene opens the layers once to read the height, then each worker thread opens them once for all its chunks.
+    #Worker processes get the scene without its open layers and open their own, which are not counted here.
+    assert 1 <= len(opened) <= (1 + 2 if scheduler == 'threads' else 1)
+    assert len(set(opened)) == len(opened)
+
+
+def test_forked_worker_opens_its_own_layers(scene, monkeypatch):
+    scene = LazyScene(scene, chunk_rows=CHUNK_ROWS, window_rows=WINDOW_ROWS)
+    parent = scene.layers()
+    assert scene.layers() is parent
+    #A forked child has the thread-local of the parent but another process id
+    monkeypatch.setattr(lazy.os, 'getpid', lambda: -1)
+    assert scene.layers() is not parent
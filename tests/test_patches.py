@@ -0,0 +1,82 @@
+'''Patch labelling of patches.py, band by band, against scipy.ndimage.label over the whole Burn_Year layer.'''
+
+import os
+
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from fl_carbon import settings
+from fl_carbon.patches import NO_FIRE, label_patches, patch_table
+from fl_carbon.readers import open_layer
+
+
+@pytest.fixture(scope='module')
+def years(scene):
+    layer = open_layer(os.path.join(scene, settings.LAYER_FILES['Burn_Year']))
+    return layer.read_rows(0, layer.shape[0]).astype(np.int64)
+
+
+def _reference(years, connectivity):
+    '''Patch number of every pixel (-1 unburned), numbered in the order of their first pixel, as label_patches does.'''
+    structure = ndimage.generate_binary_structure(2, 1 if connectivity == 4 else 2)
+    labels = np.full(years.shape, -1, dtype=np.int64)
+    n = 0
+    for code in np.unique(years[years != NO_FIRE]):
+        year_labels, m = ndimage.label(years == code, structure)
+        labels[year_labels > 0] = year_labels[year_labels > 0] - 1 + n
+        n += m
+    flat = labels.ravel()
+    burned = np.flatnonzero(flat >= 0)
+    first = np.full(n, np.iinfo(np.int64).max)
+    np.minimum.at(first, flat[burned], burned)
+    rank = np.empty(n, dtype=np.int64)
+    rank[np.argsort(first, kind='stable')] = np.arange(n)
+    return np.where(labels >= 0, rank[np.maximum(labels, 0)], -1)
+
+
+@pytest.mark.parametrize('connectivity', [4, 8])
+@pytest.mark.parametrize('window_rows', [7, 64])
+def test_bands_give_the_whole_scene_labels(scene, FL_Data, years, connectivity, window_rows):
+    reference = _reference(years, connectivity)
+    labelled, Patches = label_patches(scene, FL_Data, window_rows=window_rows, connectivity=connectivity)
+
+    n = reference.max() + 1
+    assert len(Patches) == n
+    np.testing.assert_array_equal(Patches['Pixels'], np.bincount(reference[reference >= 0], minlength=n))
+    burn_year = np.zeros(n, dtype=np.int64)
+    burn_year[reference[reference >= 0]] = years[reference >= 0]
+    np.testing.assert_array_equal(Patches['Burn_Year'], burn_year)
+    np.testing.assert_array_equal(labelled['Patch_ID'], reference.ravel()[FL_Data.index.to_numpy()])
+
+
+def test_perimeter_and_edges(scene, FL_Data, years):
+    reference = _reference(years, 4)
+    _, Patches = label_patches(scene, FL_Data, window_rows=64)
+    padded = np.pad(years, 1, constant_values=-1)
+    sides = sum((padded[1 + dr:1 + dr + years.shape[0], 1 + dc:1 + dc + years.shape[1]] != years).astype(np.int64)
+                for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1)))
+    burned = reference >= 0
+    n = len(Patches)
+    faces = np.bincount(reference[burned], weights=sides[burned], minlength=n)
+    edges = np.bincount(reference[burned], weights=sides[burned] > 0, minlength=n)
+    np.testing.assert_allclose(Patches['Perimeter_m'], faces * 30.0)
+    np.testing.assert_array_equal(Patches['Edge_Pixels'], edges)
+
+
+def test_erode_drops_the_pixels_near_an_edge(scene, FL_Data, years):
+    erode = 2
+    labelled, _ = label_patches(scene, FL_Data, window_rows=64, erode=erode)
+    padded = np.pad(years, erode, constant_values=-1)
+    size = 2 * erode + 1
+    same = ndimage.minimum_filter(padded, size) == ndimage.maximum_filter(padded, size)
+    interior = same[erode:-erode, erode:-erode].ravel()
+    np.testing.assert_array_equal(labelled.index, FL_Data.index[interior[FL_Data.index.to_numpy()]])
+
+
+def test_patch_table_averages_the_kept_pixels(scene, FL_Data):
+    labelled, Patches = label_patches(scene, FL_Data, window_rows=64)
+    Events = patch_table(labelled, Patches)
+    means = labelled.groupby('Patch_ID')['NEP_2010'].mean()
+    np.testing.assert_allclose(Events['NEP_2010'], means.loc[Events['Patch_ID']].to_numpy(), rtol=1e-6)
+    assert Events['Table_Pixels'].sum() == len(labelled)
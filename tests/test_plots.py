@@ -0,0 +1,73 @@
+'''Headless rendering of plots.py: the files written, on one process or several, and the density-binned layers.'''
+
+import os
+import sys
+
+import numpy as np
+import pytest
+from matplotlib.collections import PathCollection
+from PIL import Image
+
+from fl_carbon import plots
+from fl_carbon.instrument import StageRecorder, recording
+from fl_carbon.regression import age_summary
+
+FIGURES = ['Histogram_Severity', 'Scatterplot_AGB_NEP', 'FacetGrid_AGB_Raw', 'FacetGrid_AGB_Mean',
+           'FacetGrid_NEP_Raw', 'FacetGrid_NEP_Mean']
+
+
+@pytest.fixture(scope='module')
+def summary(FL_Data):
+    return age_summary(FL_Data)
+
+
+@pytest.fixture
+def drawn(monkeypatch):
+    '''Markers drawn and whether a density layer was drawn, for every figure saved in this process.'''
+    figures = {}
+    save = plots._save
+
+    def spy(fig, path):
+        collections = [c for ax in fig.axes for c in ax.collections]
+        points = [len(c.get_offsets()) for c in collections if type(c) is PathCollection]
+        figures[os.path.basename(path)] = (sum(points), len(points) < len(collections))
+        return save(fig, path)
+
+    monkeypatch.setattr(plots, '_save', spy)
+    return figures
+
+
+def test_figures_are_written_without_a_display(FL_Data, summary, tmp_path):
+    paths = plots.render_figures(FL_Data, summary, str(tmp_path), workers=1)
+    assert [os.path.basename(path) for path in paths] == [name + '.png' for name in FIGURES]
+    for path in paths:
+        with Image.open(path) as im:
+            assert im.format == 'PNG' and im.size[0] > 100
+    #Nothing is drawn through pyplot, so no figure is left open
+    if 'matplotlib.pyplot' in sys.modules:
+        assert not sys.modules['matplotlib.pyplot'].get_fignums()
+
+
+def test_worker_processes_draw_the_same_files(FL_Data, summary, tmp_path):
+    for name in ('one', 'two'):
+        os.makedirs(tmp_path / name)
+    one = plots.render_figures(FL_Data, summary, str(tmp_path / 'one'), workers=1)
+    with recording(StageRecorder(track_peak=False)) as recorder:
+        two = plots.render_figures(FL_Data, summary, str(tmp_path / 'two'), workers=2)
+    for a, b in zip(one, two):
+        with Image.open(a) as im_a, Image.open(b) as im_b:
+            np.testing.assert_array_equal(np.asarray(im_a), np.asarray(im_b))
+    #The stages measured in the workers are handed back to the recorder
+    assert sorted(record.name for record in recorder.records) == sorted('figure:' + name for name in FIGURES)
+
+
+@pytest.mark.parametrize('max_points, density', [(200, True), (plots.MAX_POINTS, False)])
+def test_large_layers_are_density_binned(FL_Data, tmp_path, drawn, max_points, density):
+    assert 200 < len(FL_Data) < plots.MAX_POINTS
+    plots.scatter_agb_nep(FL_Data, str(tmp_path / 'scatter.png'), max_points)
+    plots.facet_raw(FL_Data, 'AGB_2010', str(tmp_path / 'facet.png'), max_points)
+    for name in ('scatter.png', 'facet.png'):
+        markers, binned = drawn[name]
+        #A density layer replaces every marker, otherwise each pixel is one marker
+        assert binned == density, name
+        assert markers == (0 if density else len(FL_Data)), name
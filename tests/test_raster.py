@@ -0,0 +1,58 @@
+'''The windowed reader of raster.py against the whole-scene load and chained masks of the original script.'''
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from PIL import Image
+
+from fl_carbon import settings
+from fl_carbon.raster import read_pixel_table, stream_pixels
+
+from .conftest import ROWS, WINDOW_ROWS
+
+
+def _original_part1(directory):
+    '''Part 1 of the original script: every layer loaded whole, stacked and filtered as a dataframe.'''
+    arrays = [np.asarray(Image.open(os.path.join(directory, fname))).flatten()
+              for fname in settings.LAYER_FILES.values()]
+    FL_Data = pd.DataFrame(np.vstack(arrays).T, columns=settings.COLUMNS)
+    FL_Data = FL_Data[(FL_Data.Burn_Year != 0) & (FL_Data.Burn_Year != 16) & (FL_Data.Burn_Year != 20) &
+                      (FL_Data.Burn_Year != 40)].copy()
+    FL_Data = FL_Data[(FL_Data['AGB_1990'] - FL_Data['AGB_2000'] > 0) |
+                      (FL_Data['AGB_2000'] - FL_Data['AGB_2010'] > 0)].copy()
+    FL_Data['Date'] = 1970 + FL_Data['Burn_Year']
+    FL_Data['Burn_Severity'] = (FL_Data['AGB_1990'] - FL_Data['AGB_2000']) / FL_Data['AGB_1990'] * 100
+    FL_Data.loc[FL_Data.Date > 2000, 'Burn_Severity'] = (FL_Data['AGB_2000'] - FL_Data['AGB_2010']) / \
+        FL_Data['AGB_2000'] * 100
+    FL_Data['Severity_Label'] = pd.cut(FL_Data['Burn_Severity'], bins=settings.CUT_BINS, labels=settings.BS_LABELS)
+    FL_Data = FL_Data[FL_Data['Forest_Type'] == settings.LONGLEAF_SLASH_PINE]
+    FL_Data = FL_Data[FL_Data['Severity_Label'] != 'Low']
+    return FL_Data.dropna(subset=['Severity_Label'])
+
+
+def test_windows_keep_the_pixels_of_the_whole_scene(scene, FL_Data):
+    expected = _original_part1(scene)
+    assert len(FL_Data) > 1000
+    np.testing.assert_array_equal(FL_Data.index, expected.index)
+    for name in ('AGB_1990', 'AGB_2000', 'AGB_2010', 'NEP_2010', 'Burn_Year'):
+        np.testing.assert_array_equal(FL_Data[name].to_numpy(dtype=np.float64), expected[name])
+    np.testing.assert_allclose(FL_Data['Burn_Severity'], expected['Burn_Severity'], rtol=1e-5)
+    np.testing.assert_array_equal(FL_Data['Severity_Label'].astype(str), expected['Severity_Label'].astype(str))
+
+
+@pytest.mark.parametrize('window_rows', [7, ROWS, 4 * ROWS])
+def test_table_does_not_depend_on_the_window_size(scene, FL_Data, window_rows):
+    pd.testing.assert_frame_equal(read_pixel_table(scene, window_rows), FL_Data)
+
+
+def test_windows_and_strips(scene, FL_Data):
+    width = len(np.asarray(Image.open(os.path.join(scene, settings.LAYER_FILES['Burn_Year'])))[0])
+    parts = list(stream_pixels(scene, WINDOW_ROWS))
+    assert len(parts) == -(-ROWS // WINDOW_ROWS)
+    #Every window only holds pixels of its own rows
+    for i, part in enumerate(parts):
+        assert ((part.index >= i * WINDOW_ROWS * width) & (part.index < (i + 1) * WINDOW_ROWS * width)).all()
+    strip = read_pixel_table(scene, WINDOW_ROWS, rows=(100, 300))
+    pd.testing.assert_frame_equal(strip, FL_Data[(FL_Data.index >= 100 * width) & (FL_Data.index < 300 * width)])
@@ -0,0 +1,76 @@
+'''The windowed decoders of readers.py against whole-layer reads with tifffile, on striped, tiled and compressed scenes.'''
+
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from fl_carbon import settings
+from fl_carbon.raster import open_layers
+from fl_carbon.readers import BACKENDS, open_layer
+from fl_carbon.synthetic import DOUBLE, ORIGIN, PIXEL_SIZE, SHORT, compress_scene, geotiff_tags
+
+tifffile = pytest.importorskip('tifffile')
+
+#Windows which start and end inside strips and tiles, and the last rows of the scene
+WINDOWS = [(0, 37), (37, 101), (250, 251), (490, 512)]
+
+
+@pytest.fixture(scope='module', params=['striped', 'tiled', 'zlib_tiled', 'zlib_striped'])
+def layout(request, scene, tmp_path_factory):
+    '''The scene, rewritten with one of the layouts. The synthetic scene itself is uncompressed strips.'''
+    if request.param == 'striped':
+        return scene
+    directory = str(tmp_path_factory.mktemp(request.param))
+    if request.param == 'zlib_striped':
+        for fname in settings.LAYER_FILES.values():
+            tifffile.imwrite(os.path.join(directory, fname), tifffile.imread(os.path.join(scene, fname)),
+                             rowsperstrip=40, compression='zlib')
+    else:
+        #Tiles of 48 pixels do not divide the scene, so the last row and column of tiles are partial
+        compress_scene(scene, directory, 'zlib' if request.param == 'zlib_tiled' else None, tile=48)
+    return directory
+
+
+@pytest.mark.parametrize('backend', list(BACKENDS))
+def test_windows_match_a_whole_read(layout, backend):
+    if backend == 'rasterio':
+        pytest.importorskip('rasterio')
+    for name, fname in settings.LAYER_FILES.items():
+        path = os.path.join(layout, fname)
+        expected = tifffile.imread(path)
+        layer = open_layer(path, backend)
+        assert layer.shape == expected.shape
+        for row0, row1 in WINDOWS:
+            window = layer.read_rows(row0, row1)
+            assert window.dtype == expected.dtype, name
+            np.testing.assert_array_equal(window, expected[row0:row1], err_msg='%s %s' % (name, (row0, row1)))
+
+
+def test_auto_picks_an_installed_backend(scene):
+    layer = open_layer(os.path.join(scene, settings.LAYER_FILES['Burn_Year']))
+    assert layer.backend in BACKENDS
+    with pytest.raises(ValueError):
+        open_layer(os.path.join(scene, settings.LAYER_FILES['Burn_Year']), 'gdal')
+
+
+def test_open_layers_rejects_a_mismatched_grid(scene, tmp_path):
+    directory = str(tmp_path / 'scene')
+    shutil.copytree(scene, directory)
+    path = os.path.join(directory, settings.LAYER_FILES['NEP_2000'])
+    tifffile.imwrite(path, tifffile.imread(path)[:-1])
+    with pytest.raises(ValueError, match='not the same size'):
+        open_layers(directory)
+
+
+def test_open_layers_rejects_a_shifted_geotransform(scene, tmp_path):
+    directory = str(tmp_path / 'scene')
+    shutil.copytree(scene, directory)
+    path = os.path.join(directory, settings.LAYER_FILES['NEP_2000'])
+    #The same grid, one pixel to the east
+    extratags = [(tag, {SHORT: 'H', DOUBLE: 'd'}[field_type], len(values), values, True)
+                 for tag, field_type, values in geotiff_tags(origin=(ORIGIN[0] + PIXEL_SIZE, ORIGIN[1]))]
+    tifffile.imwrite(path, tifffile.imread(path), extratags=extratags)
+    with pytest.raises(ValueError, match='geotransform'):
+        open_layers(directory)
@@ -0,0 +1,134 @@
+'''The grouped normal-equation fits of regression.py against np.polyfit and sklearn's f_regression.'''
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from fl_carbon.regression import (MIN_ROWS, age_summary, batch_regression, batch_regression_from_summary,
+                                  regression_table)
+
+RESPONSES = ['AGB_2010', 'NEP_2010']
+
+
+@pytest.fixture
+def table():
+    '''Three groups of pixels with a quadratic recovery in Burn_Scar_Age, and a group too small to fit.'''
+    rng = np.random.default_rng(0)
+    n = 3000
+    age = rng.integers(1, 20, n)
+    group = rng.choice(['Low', 'Moderate', 'Severe'], n)
+    df = pd.DataFrame({
+        'Severity_Label': pd.Categorical(group, categories=['Low', 'Moderate', 'Severe', 'Tiny']),
+        'Burn_Scar_Age': age.astype(np.int8),
+        'AGB_2010': (20 + 3 * age - 0.1 * age ** 2 + rng.normal(0, 4, n)).astype(np.float32),
+        'NEP_2010': (rng.normal(100, 60, n) + 2 * age).astype(np.float32),
+    })
+    tiny = df.iloc[:MIN_ROWS - 1].copy()
+    tiny['Severity_Label'] = 'Tiny'
+    return pd.concat([df, tiny], ignore_index=True)
+
+
+def _reference(x, y, degree):
+    coefs = np.polyfit(x, y, degree)[::-1]
+    residual = y - np.polyval(coefs[::-1], x)
+    sse = (residual ** 2).sum()
+    sst = ((y - y.mean()) ** 2).sum()
+    dfd = len(x) - degree - 1
+    F = ((sst - sse) / degree) / (sse / dfd)
+    return coefs, np.sqrt(sse / len(x)), 1 - sse / sst, F, stats.f.sf(F, degree, dfd)
+
+
+def _row(results, label, response, model):
+    rows = results[(results['Severity_Label'] == label) & (results['response'] == response) &
+                   (results['model'] == model)]
+    assert len(rows) == 1
+    return rows.iloc[0]
+
+
+def test_in_sample_fits_match_polyfit(table):
+    results = batch_regression(table, responses=RESPONSES)
+    for label in ['Low', 'Moderate', 'Severe']:
+        group = table[table['Severity_Label'] == label]
+        x = group['Burn_Scar_Age'].to_numpy(dtype=np.float64)
+        for response in RESPONSES:
+            y = group[response].to_numpy(dtype=np.float64)
+            for model, degree in [('linear', 1), ('quadratic', 2)]:
+                coefs, rmse, r2, F, p = _reference(x, y, degree)
+                row = _row(results, label, response, model)
+                assert row['n'] == len(group)
+                np.testing.assert_allclose([row['intercept'], row['coef_x1']], coefs[:2], rtol=1e-7, atol=1e-9)
+                if degree == 2:
+                    np.testing.assert_allclose(row['coef_x2'], coefs[2], rtol=1e-7, atol=1e-12)
+                else:
+                    assert np.isnan(row['coef_x2'])
+                np.testing.assert_allclose([row['rmse'], row['r2'], row['F']], [rmse, r2, F], rtol=1e-7)
+                np.testing.assert_allclose(row['p'], p, rtol=1e-6, atol=1e-300)
+
+
+def test_linear_f_test_matches_f_regression(table):
+    from sklearn.feature_selection import f_regression
+    results = batch_regression(table, responses=RESPONSES)
+    group = table[table['Severity_Label'] == 'Moderate']
+    F, p = f_regression(group[['Burn_Scar_Age']].to_numpy(dtype=np.float64),
+                        group['NEP_2010'].to_numpy(dtype=np.float64))
+    row = _row(results, 'Moderate', 'NEP_2010', 'linear')
+    np.testing.assert_allclose([row['F'], row['p']], [F[0], p[0]], rtol=1e-7)
+
+
+def test_held_out_scores(table):
+    test_size, random_state = 0.4, 3
+    results = batch_regression(table, responses=RESPONSES, test_size=test_size, random_state=random_state)
+    held_out = np.random.default_rng(random_state).random(len(table)) < test_size
+    for label in ['Moderate', 'Severe']:
+        in_group = (table['Severity_Label'] == label).to_numpy()
+        train, test = table[in_group & ~held_out], table[in_group & held_out]
+        coefs = np.polyfit(train['Burn_Scar_Age'].astype(float), train['AGB_2010'].astype(float), 2)
+        residual = test['AGB_2010'].astype(float) - np.polyval(coefs, test['Burn_Scar_Age'].astype(float))
+        y = test['AGB_2010'].astype(float)
+        row = _row(results, label, 'AGB_2010', 'quadratic')
+        np.testing.assert_allclose([row['intercept'], row['coef_x1'], row['coef_x2']], coefs[::-1], rtol=1e-7)
+        np.testing.assert_allclose(row['rmse'], np.sqrt((residual ** 2).mean()), rtol=1e-7)
+        np.testing.assert_allclose(row['r2'], 1 - (residual ** 2).sum() / ((y - y.mean()) ** 2).sum(), rtol=1e-7)
+
+
+def test_small_groups_are_nan(table):
+    results = batch_regression(table, responses=RESPONSES)
+    tiny = results[results['Severity_Label'] == 'Tiny']
+    assert (tiny['n'] == MIN_ROWS - 1).all()
+    assert tiny[['intercept', 'coef_x1', 'rmse', 'r2']].isna().all().all()
+
+
+def test_per_age_summary_gives_the_same_fits(table):
+    pixels = batch_regression(table, responses=RESPONSES)
+    summary = age_summary(table, responses=RESPONSES)
+    aggregated = batch_regression_from_summary(summary, responses=RESPONSES)
+    columns = ['n', 'intercept', 'coef_x1', 'coef_x2', 'rmse', 'r2', 'F', 'p']
+    pd.testing.assert_frame_equal(aggregated[columns], pixels[columns], rtol=1e-6)
+
+
+def test_too_few_ages_are_nan():
+    #Many pixels of one age: the rounding of the sums must not pass for a second distinct value
+    rng = np.random.default_rng(2)
+    n = 20000
+    df = pd.DataFrame({'Severity_Label': pd.Categorical(rng.choice(['Moderate', 'Severe'], n)),
+                       'Burn_Scar_Age': np.where(np.arange(n) < n // 2, 4, 17).astype(np.int8),
+                       'AGB_2010': rng.gamma(4.0, 2.0, n), 'NEP_2010': rng.normal(100, 60, n)})
+    df.loc[df['Severity_Label'] == 'Severe', 'Burn_Scar_Age'] = 11
+    results = batch_regression(df, responses=RESPONSES)
+    severe = results[results['Severity_Label'] == 'Severe']
+    assert severe[['intercept', 'coef_x1', 'coef_x2']].isna().all().all()
+    #Two ages give a line but not a parabola
+    moderate = results[results['Severity_Label'] == 'Moderate'].set_index(['response', 'model'])
+    assert moderate[['intercept', 'coef_x1']].loc[(slice(None), 'linear'), :].notna().all().all()
+    assert moderate[['intercept', 'coef_x1', 'coef_x2']].loc[(slice(None), 'quadratic'), :].isna().all().all()
+
+
+def test_aggregate_mode_matches_the_pixel_fits(FL_Data):
+    #In-sample fits of the scene from its per-age summary, and from every pixel
+    aggregated = regression_table(FL_Data, aggregate=True)
+    pixels = regression_table(FL_Data, test_size=None)
+    assert len(aggregated) == 8 and aggregated['n'].min() > MIN_ROWS
+    pd.testing.assert_frame_equal(aggregated, pixels, rtol=1e-6)
+    #A held out split changes the scores, but aggregate mode always fits every pixel
+    assert regression_table(FL_Data, aggregate=True, test_size=0.4, random_state=0).equals(aggregated)
@@ -0,0 +1,64 @@
+'''Bootstrap and K-fold resampling of resample.py against direct fits of the resampled pixels.'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fl_carbon.regression import solve_moments
+from fl_carbon.resample import _moments, feature_matrix, resample_regression
+
+RESPONSES = ['AGB_2010', 'NEP_2010']
+
+
+@pytest.fixture
+def table():
+    rng = np.random.default_rng(0)
+    n = 2000
+    age = rng.integers(1, 20, n)
+    return pd.DataFrame({
+        'Severity_Label': pd.Categorical(rng.choice(['Moderate', 'Severe'], n)),
+        'Burn_Scar_Age': age.astype(np.int8),
+        'AGB_2010': 20 + 3 * age - 0.1 * age ** 2 + rng.normal(0, 4, n),
+        'NEP_2010': rng.normal(100, 60, n) + 2 * age,
+    })
+
+
+def test_weighted_feature_sums_match_polyfit(table):
+    #A replicate is a vector of weights over the pixels, and its fit comes from weights @ F
+    rng = np.random.default_rng(1)
+    x = table['Burn_Scar_Age'].to_numpy(dtype=np.float64)
+    Y = table[RESPONSES].to_numpy(dtype=np.float64)
+    F = feature_matrix(x, Y, 2)
+    drawn = np.bincount(rng.integers(0, len(x), len(x)), minlength=len(x))
+    fit = _moments((drawn @ F)[None], len(RESPONSES), 2)
+    coefs = solve_moments(fit, 2)[0]
+    for r in range(len(RESPONSES)):
+        expected = np.polyfit(np.repeat(x, drawn), np.repeat(Y[:, r], drawn), 2)[::-1]
+        np.testing.assert_allclose(coefs[r], expected, rtol=1e-8)
+
+
+@pytest.mark.parametrize('scheduler', ['threads', 'processes'])
+def test_results_do_not_depend_on_the_scheduler(table, scheduler):
+    options = {'responses': RESPONSES, 'replicates': 40, 'random_state': 0}
+    _, expected = resample_regression(table, scheduler='sync', **options)
+    _, replicates = resample_regression(table, scheduler=scheduler, workers=2, **options)
+    pd.testing.assert_frame_equal(replicates, expected)
+
+
+def test_kfold_splits_every_group(table):
+    folds = 4
+    _, replicates = resample_regression(table, responses=RESPONSES, method='kfold', replicates=3, folds=folds,
+                                        scheduler='sync')
+    sizes = table['Severity_Label'].value_counts()
+    rows = replicates[(replicates['response'] == 'AGB_2010') & (replicates['model'] == 'linear')]
+    assert rows['replicate'].nunique() == 3 * folds
+    for label, group in rows.groupby('Severity_Label', observed=True):
+        assert ((group['n_train'] + group['n_test']) == sizes[label]).all()
+        #Every pixel is in the test fold of exactly one replicate of every repeat
+        assert group['n_test'].sum() == 3 * sizes[label]
+
+
+def test_summary_brackets_the_estimate(table):
+    summary, _ = resample_regression(table, responses=RESPONSES, replicates=200, scheduler='sync')
+    slopes = summary[(summary['statistic'] == 'coef_x1') & (summary['model'] == 'linear')]
+    assert ((slopes['low'] <= slopes['estimate']) & (slopes['estimate'] <= slopes['high'])).all()
@@ -0,0 +1,42 @@
+'''The multi-scene driver of scenes.py against the same pipeline run on each scene in turn.'''
+
+import pandas as pd
+import pytest
+
+from fl_carbon.raster import read_pixel_table
+from fl_carbon.regression import regression_table
+from fl_carbon.scenes import read_manifest, run_scenes
+
+from .conftest import WINDOW_ROWS
+
+
+@pytest.fixture
+def manifest(scene, tmp_path):
+    #The whole scene, then two strips of it, listed out of row order
+    path = tmp_path / 'manifest.csv'
+    path.write_text('scene,directory,row_start,row_end\n'
+                    'whole,%s,,\n'
+                    'south,%s,256,512\n'
+                    'north,%s,0,256\n' % (scene, scene, scene))
+    return str(path)
+
+
+def test_manifest_rows(manifest, scene):
+    entries = read_manifest(manifest)
+    assert [entry['scene'] for entry in entries] == ['whole', 'south', 'north']
+    assert [entry['rows'] for entry in entries] == [None, (256, 512), (0, 256)]
+    assert all(entry['directory'] == scene for entry in entries)
+
+
+def test_results_follow_the_manifest(manifest, scene, FL_Data):
+    entries = read_manifest(manifest)
+    summary = run_scenes(entries, workers=2, window_rows=WINDOW_ROWS, random_state=0)
+    assert list(summary['scene'].unique()) == ['whole', 'south', 'north']
+    pixels = summary.groupby('scene', sort=False)['pixels'].first()
+    assert pixels['whole'] == len(FL_Data) == pixels['south'] + pixels['north']
+    for entry in entries:
+        expected = regression_table(read_pixel_table(scene, WINDOW_ROWS, rows=entry['rows']), random_state=0)
+        result = summary[summary['scene'] == entry['scene']].drop(columns=['scene', 'pixels'])
+        pd.testing.assert_frame_equal(result.reset_index(drop=True), expected)
+    #The same summary on every run, whatever the number of workers
+    pd.testing.assert_frame_equal(run_scenes(entries, workers=1, window_rows=WINDOW_ROWS, random_state=0), summary)
@@ -0,0 +1,103 @@
+'''Bounding box and polygon queries of spatial.py against a brute-force mask over every pixel of the table.'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fl_carbon.spatial import SpatialIndex, pixel_coordinates, read_grid
+
+#Blocks which do not divide the 512 x 640 scene, so queries cross block edges and partial blocks
+BLOCK_SIZE = 100
+
+
+@pytest.fixture(scope='module')
+def grid(scene):
+    return read_grid(scene)
+
+
+@pytest.fixture(scope='module')
+def index(FL_Data, grid):
+    return SpatialIndex(FL_Data, grid, BLOCK_SIZE)
+
+
+@pytest.fixture(scope='module')
+def centres(FL_Data, grid):
+    return pixel_coordinates(FL_Data, grid)
+
+
+def _box(grid, col0, row0, col1, row1):
+    #Map coordinates of the corners of a range of pixels, pixel edges included
+    x0, dx, _, y0, _, dy = grid['geotransform']
+    return x0 + col0 * dx, y0 + row1 * dy, x0 + col1 * dx, y0 + row0 * dy
+
+
+#(first column, first row, last column, last row) in pixels, partly or wholly outside the scene for some
+BOXES = {
+    'inside': (150, 120, 330, 410),
+    'top_left_corner': (-20, -20, 60, 45),
+    'bottom_right_corner': (600, 480, 700, 560),
+    'left_edge': (-5, 200, 3, 300),
+    'one_pixel': (201, 201, 202, 202),
+    'whole_scene': (-10, -10, 700, 600),
+    'outside': (700, 0, 800, 100),
+}
+
+
+@pytest.mark.parametrize('name', list(BOXES))
+def test_bbox_matches_brute_force(index, FL_Data, grid, centres, name):
+    xmin, ymin, xmax, ymax = _box(grid, *BOXES[name])
+    expected = FL_Data[centres['X'].between(xmin, xmax) & centres['Y'].between(ymin, ymax)]
+    found = index.bbox(xmin, ymin, xmax, ymax)
+    pd.testing.assert_frame_equal(found, expected)
+    if name == 'outside':
+        assert found.empty
+    if name == 'whole_scene':
+        assert len(found) == len(FL_Data)
+
+
+def test_bbox_with_column_filters(index, FL_Data, grid, centres):
+    xmin, ymin, xmax, ymax = _box(grid, *BOXES['inside'])
+    inside = centres['X'].between(xmin, xmax) & centres['Y'].between(ymin, ymax)
+    expected = FL_Data[inside & (FL_Data['Severity_Label'] == 'Severe')]
+    pd.testing.assert_frame_equal(index.bbox(xmin, ymin, xmax, ymax, Severity_Label='Severe'), expected)
+    assert index.bbox(xmin, ymin, xmax, ymax, Severity_Label='Low').empty
+
+
+def _inside_triangle(x, y, triangle):
+    #The centre is on the same side of all three edges of a counter-clockwise triangle
+    inside = np.ones(len(x), dtype=bool)
+    for (ax, ay), (bx, by) in zip(triangle, np.roll(triangle, -1, axis=0)):
+        inside &= (bx - ax) * (y - ay) - (by - ay) * (x - ax) > 0
+    return inside
+
+
+def test_polygon_with_a_hole_matches_brute_force(index, FL_Data, grid, centres):
+    x0, dx, _, y0, _, dy = grid['geotransform']
+    #A triangle over most of the scene and past its left edge, and a square hole in it. No vertex or edge falls on a
+    #pixel centre, so the brute-force test needs no rule for points on the boundary.
+    triangle = np.array([[x0 - 40.3 * dx, y0 + 500.3 * dy], [x0 + 610.7 * dx, y0 + 480.1 * dy],
+                         [x0 + 300.2 * dx, y0 + 10.6 * dy]])
+    (ax, ay), (bx, by), (cx, cy) = triangle
+    if (bx - ax) * (cy - ay) - (by - ay) * (cx - ax) < 0:
+        triangle = triangle[::-1]
+    xmin, ymin, xmax, ymax = _box(grid, 250.1, 300.1, 350.1, 400.1)
+    hole = [(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax)]
+    polygon = {'type': 'Polygon', 'coordinates': [triangle.tolist(), hole]}
+
+    x, y = centres['X'].to_numpy(), centres['Y'].to_numpy()
+    in_hole = (x > xmin) & (x < xmax) & (y > ymin) & (y < ymax)
+    expected = FL_Data[_inside_triangle(x, y, triangle) & ~in_hole]
+    found = index.within(polygon)
+    assert 0 < len(found) < len(FL_Data)
+    pd.testing.assert_frame_equal(found, expected)
+
+    #A MultiPolygon of the triangle and a part outside the scene gives the same rows
+    outside = _box(grid, 700.5, 0.5, 800.5, 100.5)
+    square = [(outside[0], outside[1]), (outside[2], outside[1]), (outside[2], outside[3]), (outside[0], outside[3])]
+    multi = {'type': 'MultiPolygon', 'coordinates': [[triangle.tolist(), hole], [square]]}
+    pd.testing.assert_frame_equal(index.within(multi), expected)
+
+
+def test_polygon_outside_the_scene_is_empty(index, grid):
+    xmin, ymin, xmax, ymax = _box(grid, -50.5, -50.5, -10.5, -10.5)
+    assert index.within([(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax)]).empty
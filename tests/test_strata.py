@@ -0,0 +1,54 @@
+'''The one-pass stratified analysis of strata.py against age_summary and batch_regression of every stratum.'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fl_carbon.regression import age_summary, batch_regression
+from fl_carbon.strata import STRATA, select_stratum, stratified_analysis, stratified_table
+
+from .conftest import WINDOW_ROWS
+
+
+@pytest.fixture(scope='module')
+def all_strata(scene):
+    return stratified_table(scene, cache_dir=None, window_rows=WINDOW_ROWS)
+
+
+@pytest.fixture(scope='module')
+def analysis(all_strata):
+    return stratified_analysis(all_strata)
+
+
+def test_every_forest_type_and_severity_is_kept(all_strata):
+    assert all_strata['Forest_Type'].nunique() > 1
+    assert (all_strata['Severity_Label'] == 'Low').any()
+
+
+def test_counts(all_strata, analysis):
+    Counts = analysis[0]
+    expected = all_strata.groupby(STRATA, observed=True).size()
+    np.testing.assert_array_equal(Counts['count'], expected.to_numpy())
+
+
+def test_summary_matches_age_summary(all_strata, analysis):
+    Summary = analysis[1]
+    expected = age_summary(all_strata, by=STRATA)
+    assert list(Summary.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(Summary, expected, check_dtype=False, check_categorical=False, rtol=1e-7)
+
+
+def test_results_match_batch_regression(all_strata, analysis):
+    Results = analysis[2]
+    expected = batch_regression(all_strata, by=STRATA)
+    expected = expected[expected['n'] > 0].reset_index(drop=True)
+    columns = ['n', 'intercept', 'coef_x1', 'coef_x2', 'rmse', 'r2', 'F', 'p']
+    pd.testing.assert_frame_equal(Results[columns], expected[columns], rtol=1e-6)
+
+
+def test_select_stratum_gives_the_longleaf_result(FL_Data, analysis):
+    Results = select_stratum(analysis[2], forest_type='Longleaf/Slash Pine', severity=['Moderate', 'Severe'])
+    expected = batch_regression(FL_Data)
+    expected = expected[expected['n'] > 0].reset_index(drop=True)
+    columns = ['n', 'intercept', 'coef_x1', 'coef_x2', 'rmse', 'r2']
+    pd.testing.assert_frame_equal(Results[columns], expected[columns], rtol=1e-6)
@@ -0,0 +1,41 @@
+'''The compact column layout of table.py against the upcast float columns of the original frame.'''
+
+import numpy as np
+import pandas as pd
+
+from fl_carbon import settings
+from fl_carbon.table import memory_per_pixel
+
+
+def test_columns_keep_compact_types(FL_Data):
+    for name in ('AGB_1990', 'AGB_2000', 'AGB_2010', 'NEP_1990', 'NEP_2000', 'NEP_2010', 'Burn_Severity',
+                 'NEP_Change'):
+        assert FL_Data[name].dtype == np.float32, name
+    assert FL_Data['Burn_Year'].dtype == np.uint8
+    assert FL_Data['Date'].dtype == np.int16
+    assert FL_Data['Burn_Scar_Age'].dtype == np.int8
+    forest, severity = FL_Data['Forest_Type'].dtype, FL_Data['Severity_Label'].dtype
+    assert list(forest.categories) == list(settings.FOREST_TYPE_LIST) and not forest.ordered
+    assert list(severity.categories) == list(settings.BS_LABELS) and severity.ordered
+
+
+def test_values_match_the_float_columns(FL_Data):
+    burn_year = FL_Data['Burn_Year'].to_numpy(dtype=np.float64)
+    np.testing.assert_array_equal(FL_Data['Date'], 1970 + burn_year)
+    np.testing.assert_array_equal(FL_Data['Burn_Scar_Age'], 2010 - (1970 + burn_year))
+    assert (FL_Data['Forest_Type'] == 'Longleaf/Slash Pine').all()
+    assert set(FL_Data['Severity_Label']) <= {'Moderate', 'Severe'}
+
+
+def test_memory_per_pixel_is_below_the_float_layout(FL_Data):
+    #The original frame: the eight layers stacked into float32 columns, five float64 columns added to them (Date,
+    #Burn_Scar_Age, Burn_Severity and the two AGB differences) and the labels as strings
+    original = pd.DataFrame({name: FL_Data[name].to_numpy(dtype=np.float32) for name in settings.COLUMNS
+                             if name != 'Forest_Type'}, index=FL_Data.index)
+    for name in ('Date', 'Burn_Scar_Age', 'Burn_Severity', 'Minus_90_00', 'Minus_00_10'):
+        original[name] = np.zeros(len(FL_Data))
+    original['Forest_Type'] = FL_Data['Forest_Type'].astype(str).astype(object)
+    original['Severity_Label'] = FL_Data['Severity_Label'].astype(str).astype(object)
+    compact = memory_per_pixel(FL_Data)
+    assert compact == FL_Data.memory_usage(deep=True, index=True).sum() / len(FL_Data)
+    assert 0 < compact < memory_per_pixel(original) / 3
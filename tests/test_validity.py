@@ -0,0 +1,54 @@
+'''Nodata masking of validity.py and the filters, on small arrays and on a copy of the synthetic scene.'''
+
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from fl_carbon import settings
+from fl_carbon.instrument import StageRecorder, recording
+from fl_carbon.raster import read_pixel_table
+from fl_carbon.validity import missing_counts, validity_bits
+
+from .conftest import COLS, WINDOW_ROWS
+
+
+def test_validity_bits():
+    window = {'a': np.array([1.0, np.nan, 3.0, np.inf], dtype=np.float32),
+              'b': np.array([0, 7, 7, 2], dtype=np.uint8),
+              'c': np.array([5, 5, 5, 5], dtype=np.uint16)}
+    #300 does not fit in uint8 and never matches
+    bits = validity_bits(window, {'b': 7, 'c': 300})
+    np.testing.assert_array_equal(bits, [0, 0b011, 0b010, 0b001])
+    assert missing_counts(bits, list(window)) == {'nodata:a': 2, 'nodata:b': 2}
+    assert validity_bits({'c': window['c']}) is None
+
+
+def test_table_has_no_missing_values(FL_Data):
+    assert not FL_Data.isna().any().any()
+
+
+def _edit(directory, name, flat, value):
+    import tifffile
+    data = tifffile.memmap(os.path.join(directory, settings.LAYER_FILES[name]), mode='r+')
+    data[np.divmod(flat, COLS)] = value
+    data.flush()
+
+
+def test_nodata_pixels_are_dropped(scene, FL_Data, tmp_path, monkeypatch):
+    directory = str(tmp_path / 'scene')
+    shutil.copytree(scene, directory)
+    rng = np.random.default_rng(0)
+    picked = rng.choice(FL_Data.index.to_numpy(), 60, replace=False)
+    #NaN in a float layer, and a nodata value given in settings for a layer without a nodata tag
+    _edit(directory, 'AGB_2000', picked[:40], np.nan)
+    _edit(directory, 'NEP_2010', picked[30:], -9999)
+    monkeypatch.setattr(settings, 'NODATA', {'NEP_2010': -9999})
+
+    with recording(StageRecorder()) as recorder:
+        table = read_pixel_table(directory, WINDOW_ROWS)
+    pd.testing.assert_frame_equal(table, FL_Data.drop(picked))
+    drops = recorder.drop_summary().set_index('reason')['pixels']
+    assert drops['nodata:AGB_2000'] == 40
+    assert drops['nodata:NEP_2010'] == 30